@@ -0,0 +1,185 @@
+"""
+  Задержки API rbs_cloud под смешанной нагрузкой: параллельные загрузки бэгов (/upload-rel),
+  чтение каталога (/dataset-status/, /query), создание датасетов (перезапись каталога)
+  и проба /health. Сервер запускается через uvicorn во временном каталоге с заранее
+  заполненным каталогом --catalog-rows датасетов.
+
+  Для каждой операции печатаются p50/p95/p99/max и число ошибок; результат дописывается
+  строкой JSON в --results. Сравнение «до/после» — запуск против другой ревизии сервера:
+
+    git worktree add /tmp/rbs_before HEAD~1
+    python benchmarks/bench_concurrency.py --server-root /tmp/rbs_before --label before
+    python benchmarks/bench_concurrency.py --label after
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+# Запрос дольше этого считается ошибкой (зависание сервера не должно вешать бенчмарк)
+REQUEST_TIMEOUT = 60
+
+def seed_catalog(data_dir: Path, rows: int) -> None:
+    """Каталог из *rows* загруженных датасетов и датасет bench, в который идут загрузки."""
+    names = [f"ds_{i:06d}" for i in range(rows)] + ["bench"]
+    df = pd.DataFrame({
+        "name": names,
+        "num_episodes": np.random.randint(1, 100, len(names)).astype("int32"),
+        "src_format": "rosbag",
+        "work_format": "lerobot",
+        # не store: у этих датасетов нет данных на диске, представления для них не строятся
+        "status": ["save"] * rows + ["creating"],
+    })
+    df.to_parquet(data_dir / "datasets.parquet", index=False)
+
+def start_server(server_root: Path, work: Path, port: int) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(server_root), os.environ.get("PYTHONPATH", "")]),
+               RBS_WARM_WORKERS="0", RBS_GC_INTERVAL_MIN="0")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "rbs_cloud:app", "--port", str(port), "--log-level", "warning"],
+        cwd=work, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            if requests.get(url + "/health", timeout=1).ok:
+                return proc
+        except requests.RequestException:
+            pass
+        if proc.poll() is not None:
+            raise RuntimeError("Server exited during start-up")
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("Server did not start")
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # операция -> [(задержка, ok)]
+
+    def add(self, op: str, latency: float, ok: bool) -> None:
+        with self._lock:
+            self.samples.setdefault(op, []).append((latency, ok))
+
+    def summary(self, duration: float) -> dict:
+        result = {}
+        for op, samples in sorted(self.samples.items()):
+            lat = np.array([s[0] for s in samples]) * 1000
+            result[op] = {
+                "count": len(samples),
+                "errors": sum(not s[1] for s in samples),
+                "rps": round(len(samples) / duration, 2),
+                **{f"p{q}_ms": round(float(np.percentile(lat, q)), 1) for q in (50, 95, 99)},
+                "max_ms": round(float(lat.max()), 1),
+            }
+        return result
+
+def worker(op: str, request, deadline: float, recorder: Recorder) -> None:
+    session = requests.Session()
+    n = 0
+    while time.time() < deadline:
+        t0 = time.perf_counter()
+        try:
+            ok = request(session, n).ok
+        except requests.RequestException:  # в том числе тайм-аут
+            ok = False
+        recorder.add(op, time.perf_counter() - t0, ok)
+        n += 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of rbs_cloud under mixed upload and query load")
+    parser.add_argument("--server-root", default=str(ROOT), help="Directory with rbs_cloud.py to benchmark")
+    parser.add_argument("--label", default="", help="Free-form label stored with the results")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load")
+    parser.add_argument("--uploaders", type=int, default=8)
+    parser.add_argument("--upload-mb", type=float, default=8, help="Size of each uploaded file")
+    parser.add_argument("--readers", type=int, default=8, help="Clients calling /dataset-status/ and /query")
+    parser.add_argument("--writers", type=int, default=2, help="Clients creating datasets")
+    parser.add_argument("--catalog-rows", type=int, default=20000)
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--results", default="bench_concurrency.jsonl", help="JSONL file to append results to")
+    args = parser.parse_args()
+
+    server_root = Path(args.server_root).resolve()
+    payload = os.urandom(int(args.upload_mb * 2**20))
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        (work / "data").mkdir()
+        (work / "cache").mkdir()
+        seed_catalog(work / "data", args.catalog_rows)
+        proc = start_server(server_root, work, args.port)
+        url = f"http://127.0.0.1:{args.port}"
+        try:
+            def upload(session, n, wid):
+                return session.post(url + "/upload-rel", data={"dataset_name": "bench", "relative_path": f"w{wid}/{n % 4}.mcap"},
+                                    files={"file": ("bag.mcap", payload)}, timeout=REQUEST_TIMEOUT)
+
+            def status(session, n):
+                return session.get(url + "/dataset-status/", params={"dataset_name": f"ds_{random.randrange(args.catalog_rows):06d}"}, timeout=REQUEST_TIMEOUT)
+
+            def query(session, n):
+                # случайная граница — мимо кэша результатов
+                sql = f"SELECT status, count(*) FROM datasets WHERE num_episodes > {random.randrange(100)} GROUP BY status"
+                return session.get(url + "/query", params={"sql": sql}, timeout=REQUEST_TIMEOUT)
+
+            def create(session, n, wid):
+                return session.post(url + "/create-dataset/", params={"dataset_name": f"new_{wid}_{n}"}, timeout=REQUEST_TIMEOUT)
+
+            def health(session, n):
+                return session.get(url + "/health", timeout=REQUEST_TIMEOUT)
+
+            recorder = Recorder()
+            deadline = time.time() + args.duration
+            threads = [threading.Thread(target=worker, args=("upload", lambda s, n, w=w: upload(s, n, w), deadline, recorder))
+                       for w in range(args.uploaders)]
+            readers = [("status", status), ("query", query)]
+            threads += [threading.Thread(target=worker, args=(*readers[i % 2], deadline, recorder))
+                        for i in range(args.readers)]
+            threads += [threading.Thread(target=worker, args=("create", lambda s, n, w=w: create(s, n, w), deadline, recorder))
+                        for w in range(args.writers)]
+            threads.append(threading.Thread(target=worker, args=("health", health, deadline, recorder)))
+            t0 = time.time()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            duration = time.time() - t0
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()  # зависшие соединения не дают uvicorn завершиться
+                proc.wait()
+
+    ops = recorder.summary(duration)
+    uploaded = ops.get("upload", {}).get("count", 0) - ops.get("upload", {}).get("errors", 0)
+    rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=server_root, capture_output=True, text=True).stdout.strip()
+    result = {
+        "label": args.label,
+        "server_rev": rev,
+        "config": {k: v for k, v in vars(args).items() if k not in ("results", "port", "server_root")},
+        "upload_mb_per_sec": round(uploaded * args.upload_mb / duration, 1),
+        "ops": ops,
+    }
+    print(f"{'op':8} {'count':>6} {'err':>4} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for op, s in ops.items():
+        print(f"{op:8} {s['count']:6d} {s['errors']:4d} {s['rps']:7.1f} {s['p50_ms']:8.1f} {s['p95_ms']:8.1f} {s['p99_ms']:8.1f} {s['max_ms']:8.1f}")
+    print(f"upload: {result['upload_mb_per_sec']} MB/s")
+    with open(args.results, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    print(f"Results appended to {args.results}")
+
+if __name__ == "__main__":
+    main()
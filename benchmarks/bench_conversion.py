@@ -0,0 +1,157 @@
+"""
+  Бенчмарк конвертации rosbag -> LeRobot на синтетических бэгах (офлайн, CPU).
+
+  Для каждого сценария генерируются бэги (benchmarks/synthetic_bags.py), затем стадии
+  convert_rosbag_to_lerobot.py (extract, lerobot) выполняются по очереди, каждая в отдельном
+  процессе. Для стадии записываются время, кадров/с, пиковый RSS и размер результата.
+  Результаты дописываются строками JSON в --results; --compare сравнивает с прошлым
+  файлом результатов и завершается с кодом 1 при падении скорости больше --tolerance.
+
+  Пример:
+    python benchmarks/bench_conversion.py --scenario small_raw small_jpeg --results bench_results.jsonl
+    python benchmarks/bench_conversion.py --scenario small_jpeg --compare bench_results.jsonl
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Параметры synthetic_bags.generate для типовых сценариев
+SCENARIOS = {
+    "small_raw": dict(episodes=3, seconds=5, cameras=1, width=320, height=240, compressed=False),
+    "small_jpeg": dict(episodes=3, seconds=5, cameras=1, width=320, height=240, compressed=True),
+    "hd_jpeg_2cam": dict(episodes=2, seconds=10, cameras=2, width=1280, height=720, compressed=True),
+    "long_joint_500hz": dict(episodes=1, seconds=60, cameras=1, width=320, height=240, joint_rate=500, compressed=True),
+}
+STAGES = ("extract", "lerobot")
+
+def dir_bytes(*paths: Path) -> int:
+    total = 0
+    for path in paths:
+        if path.is_file():
+            total += path.stat().st_size
+        elif path.is_dir():
+            total += sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return total
+
+def run_stage(stage: str, work: Path, bags: Path, options: dict) -> dict:
+    """Выполняет одну стадию конвертации в текущем процессе (вызывается в дочернем процессе)."""
+    import convert_rosbag_to_lerobot as conv
+
+    msg_json, synced, frames, output = work / "msg.json", work / ("msg" + conv.SYNCED), work / "frames", work / "dataset"
+    t0 = time.perf_counter()
+    if stage == "extract":
+        conv.extract_rosbag_to_json(bags, msg_json, synced, frames, passthrough=options.get("passthrough", conv.PASSTHROUGH))
+        out_bytes = dir_bytes(frames, msg_json, msg_json.with_suffix(".jsonl"), synced, synced.with_suffix(".jsonl"))
+    else:
+        conv.to_lerobot_dataset(synced, str(output), use_videos=options.get("videos", False))
+        out_bytes = dir_bytes(output)
+    seconds = time.perf_counter() - t0
+
+    frames_total = sum(e["num_frames"] for e in conv.iter_episodes(synced))
+    return {
+        "seconds": round(seconds, 3),
+        "frames": frames_total,
+        "fps": round(frames_total / seconds, 2) if seconds > 0 else 0.0,
+        # ru_maxrss в килобайтах на Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "output_bytes": out_bytes,
+    }
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return ""
+
+def run_scenario(name: str, params: dict, stages, options: dict) -> dict:
+    from synthetic_bags import generate
+
+    record = {"scenario": name, "params": params, "options": options, "revision": git_revision(),
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "stages": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        bags = generate(work / "bags", **params)
+        record["input_bytes"] = dir_bytes(bags)
+        for stage in stages:
+            # каждая стадия — отдельный процесс, чтобы пиковый RSS относился только к ней
+            proc = subprocess.run(
+                [sys.executable, __file__, "--run-stage", stage, "--work", str(work), "--options", json.dumps(options)],
+                capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                sys.stderr.write(proc.stdout + proc.stderr)
+                raise RuntimeError(f"Stage '{stage}' of scenario '{name}' failed with code {proc.returncode}")
+            record["stages"][stage] = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"{name}/{stage}: {record['stages'][stage]}")
+    return record
+
+def compare(records: list, baseline_file: Path, tolerance: float) -> bool:
+    """Сравнивает fps с последней записью того же сценария в baseline; False при регрессии."""
+    baseline = {}
+    with open(baseline_file, "r") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                baseline[rec["scenario"]] = rec
+    ok = True
+    for rec in records:
+        base = baseline.get(rec["scenario"])
+        if base is None:
+            continue
+        for stage, cur in rec["stages"].items():
+            prev = base["stages"].get(stage)
+            if not prev or not prev["fps"]:
+                continue
+            ratio = cur["fps"] / prev["fps"]
+            flag = "REGRESSION" if ratio < 1.0 - tolerance else "ok"
+            ok = ok and flag == "ok"
+            print(f"{rec['scenario']}/{stage}: fps {prev['fps']} -> {cur['fps']} (x{ratio:.2f}), "
+                  f"rss {prev['peak_rss_mb']} -> {cur['peak_rss_mb']} MB  {flag}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversion benchmark on synthetic ROS2 bags")
+    parser.add_argument("--scenario", nargs="+", default=["small_raw", "small_jpeg"], choices=sorted(SCENARIOS))
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--videos", action="store_true", help="Benchmark the video output mode")
+    parser.add_argument("--decode-compressed", action="store_true", help="Disable JPEG passthrough")
+    parser.add_argument("--results", default="bench_results.jsonl", help="JSONL file to append results to")
+    parser.add_argument("--compare", default="", help="Previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative fps drop")
+    # внутренний режим: выполнить одну стадию и напечатать результат
+    parser.add_argument("--run-stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--work", help=argparse.SUPPRESS)
+    parser.add_argument("--options", default="{}", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull  # вывод конвертера не мешает результату
+            try:
+                result = run_stage(args.run_stage, Path(args.work), Path(args.work) / "bags", json.loads(args.options))
+            finally:
+                sys.stdout = stdout
+        print(json.dumps(result))
+        return
+
+    options = {"videos": args.videos, "passthrough": not args.decode_compressed}
+    records = [run_scenario(name, SCENARIOS[name], args.stages, options) for name in args.scenario]
+
+    ok = compare(records, Path(args.compare), args.tolerance) if args.compare else True
+    with open(args.results, "a") as f:
+        for rec in records:
+            f.write(json.dumps(rec) + "\n")
+    print(f"Results appended to {args.results}")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
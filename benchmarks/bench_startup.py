@@ -0,0 +1,160 @@
+"""
+  Время старта серверов: импорт rbs_cloud (и какие тяжёлые библиотеки он загрузил),
+  время от запуска uvicorn до первого ответа /health для rbs_cloud и gpu_server и
+  до первого ответа /query (соединение DuckDB и ссылки представлений готовятся в фоне).
+
+  Каждое измерение — новый процесс в новом временном каталоге с каталогом из
+  --catalog-rows датасетов, из них --store-datasets сохранённых (для них при старте
+  раскладываются ссылки представлений). Печатаются min/median/max по --runs запускам;
+  результат дописывается строкой JSON в --results. Если медиана старта /health
+  rbs_cloud больше --budget секунд, код выхода 1.
+
+    python benchmarks/bench_startup.py --budget 1.0
+    python benchmarks/bench_startup.py --server-root /tmp/rbs_before --label before
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import requests
+
+from load_test import git_revision, stop
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("pandas", "pyarrow", "duckdb", "numpy", "cv2")
+
+IMPORT_PROBE = f"""
+import sys, time, json
+t0 = time.perf_counter()
+import rbs_cloud
+print(json.dumps({{"seconds": time.perf_counter() - t0, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+def seed(work: Path, catalog_rows: int, store_datasets: int, episodes: int) -> None:
+    """
+    Каталог (как у уже работавшего сервера — файлы есть) и *store_datasets* сохранённых
+    датасетов по *episodes* parquet-файлов эпизодов.
+    """
+    data = work / "data"
+    (work / "cache").mkdir(parents=True)
+    data.mkdir()
+    stored = [f"store_{i:04d}" for i in range(store_datasets)]
+    for name in stored:
+        chunk = data / name / "data" / "chunk-000"
+        chunk.mkdir(parents=True)
+        for ep in range(episodes):
+            pd.DataFrame({"frame_index": np.arange(10), "timestamp": np.arange(10) / 30}).to_parquet(
+                chunk / f"episode_{ep:06d}.parquet", index=False)
+    names = [f"ds_{i:06d}" for i in range(catalog_rows)] + stored
+    pd.DataFrame({
+        "name": names,
+        "num_episodes": np.full(len(names), episodes, dtype="int32"),
+        "src_format": "rosbag",
+        "work_format": "lerobot",
+        "status": ["save"] * catalog_rows + ["store"] * len(stored),
+    }).to_parquet(data / "datasets.parquet", index=False)
+    pd.DataFrame({"name": ["w0"], "dataset": [stored[0] if stored else "ds_000000"], "steps": np.int32([100])}).to_parquet(
+        data / "weights.parquet", index=False)
+
+def wait_for(url: str, proc: subprocess.Popen, timeout: float = 120, **kwargs) -> float:
+    """Ждёт успешного ответа *url*; время с момента вызова."""
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        try:
+            if requests.get(url, timeout=timeout, **kwargs).ok:
+                return time.perf_counter() - t0
+        except requests.RequestException:
+            pass
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited before answering {url}")
+        time.sleep(0.01)
+    raise RuntimeError(f"No answer from {url} in {timeout} s")
+
+def measure_import(server_root: Path, work: Path) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(server_root), os.environ.get("PYTHONPATH", "")]))
+    out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=work, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def measure_server(app: str, server_root: Path, work: Path, port: int, probes: list) -> dict:
+    """Времена до первого ответа каждого из *probes* [(имя, путь, params)] от запуска процесса."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(server_root), os.environ.get("PYTHONPATH", "")]),
+               RBS_WARM_WORKERS="0", RBS_GC_INTERVAL_MIN="0")
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+                            cwd=work, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {}
+    try:
+        for name, path, params in probes:
+            wait_for(f"http://127.0.0.1:{port}{path}", proc, params=params)
+            result[name] = time.perf_counter() - t0
+    finally:
+        stop(proc)
+    return result
+
+def summarize(values: list) -> dict:
+    return {"min": round(min(values), 3), "median": round(statistics.median(values), 3), "max": round(max(values), 3)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up time of rbs_cloud and gpu_server")
+    parser.add_argument("--server-root", default=str(ROOT), help="Directory with rbs_cloud.py and gpu_server/ to measure")
+    parser.add_argument("--label", default="", help="Free-form label stored with the results")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--catalog-rows", type=int, default=20000)
+    parser.add_argument("--store-datasets", type=int, default=50, help="Converted datasets linked into views at start-up")
+    parser.add_argument("--episodes", type=int, default=10, help="Episode files per converted dataset")
+    parser.add_argument("--budget", type=float, default=0, help="Max median seconds until rbs_cloud /health answers (0 = no check)")
+    parser.add_argument("--port", type=int, default=8795)
+    parser.add_argument("--results", default="bench_startup.jsonl", help="JSONL file to append results to")
+    args = parser.parse_args()
+
+    server_root = Path(args.server_root).resolve()
+    samples = {}
+    loaded = set()
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            work = Path(tmp)
+            seed(work, args.catalog_rows, args.store_datasets, args.episodes)
+            probe = measure_import(server_root, work)
+            samples.setdefault("import_rbs_cloud", []).append(probe["seconds"])
+            loaded.update(probe["loaded"])
+            cloud = measure_server("rbs_cloud:app", server_root, work, args.port, [
+                ("rbs_cloud_health", "/health", None),
+                ("rbs_cloud_first_query", "/query", {"sql": "SELECT count(*) FROM datasets"}),
+            ])
+            gpu = measure_server("gpu_server.gpu_server:app", server_root, work, args.port + 1, [
+                ("gpu_server_root", "/", None),
+            ])
+            for name, seconds in {**cloud, **gpu}.items():
+                samples.setdefault(name, []).append(seconds)
+
+    result = {
+        "label": args.label,
+        "server_rev": git_revision(server_root),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("results", "port", "server_root", "label", "budget")},
+        "heavy_modules_on_import": sorted(loaded),
+        "seconds": {name: summarize(values) for name, values in samples.items()},
+    }
+    print(f"{'measurement':24} {'min':>7} {'median':>7} {'max':>7}  (s)")
+    for name, s in result["seconds"].items():
+        print(f"{name:24} {s['min']:7.3f} {s['median']:7.3f} {s['max']:7.3f}")
+    print(f"heavy modules loaded by 'import rbs_cloud': {', '.join(result['heavy_modules_on_import']) or 'none'}")
+    with open(args.results, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    print(f"Results appended to {args.results}")
+
+    health = result["seconds"]["rbs_cloud_health"]["median"]
+    if args.budget and health > args.budget:
+        print(f"rbs_cloud /health took {health} s, budget {args.budget} s")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
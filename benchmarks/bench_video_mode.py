@@ -0,0 +1,83 @@
+"""
+  Сравнение режимов хранения LeRobot-датасета: PNG-кадры и видео.
+  Для каждого режима измеряется время конвертации, размер и число файлов датасета,
+  а также пропускная способность загрузчика обучения (кадров/с).
+
+  Пример:
+    python benchmarks/bench_video_mode.py /path/to/rosbags --vcodec libx264 --results bench_video.json
+"""
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import convert_rosbag_to_lerobot as conv
+
+# convert_sec видеорежима включает запись PNG-кадров: см. комментарий в to_lerobot_dataset
+VIDEO_MODE_NOTE = ("video mode still writes every camera frame as PNG (episode stats are computed from them), "
+                   "in LeRobot's async image writer threads as in PNG mode; ffmpeg encoding runs alongside conversion")
+
+def dir_stats(root: Path) -> dict:
+    files = [p for p in root.rglob("*") if p.is_file()]
+    return {"files": len(files), "bytes": sum(p.stat().st_size for p in files)}
+
+def loader_throughput(root: Path, batch_size: int, num_workers: int, max_batches: int) -> float:
+    import torch
+    from lerobot.datasets.lerobot_dataset import LeRobotDataset
+
+    dataset = LeRobotDataset(conv.REPO_ID, root=root)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, num_workers=num_workers, shuffle=True)
+    frames = 0
+    t0 = time.perf_counter()
+    for i, batch in enumerate(loader):
+        frames += len(batch["index"])
+        if i + 1 >= max_batches:
+            break
+    return frames / (time.perf_counter() - t0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PNG vs video LeRobot output")
+    parser.add_argument("bag", help="Path to folder with ROS2 bag episode files")
+    parser.add_argument("--vcodec", default=conv.VCODEC)
+    parser.add_argument("--crf", type=int, default=conv.CRF)
+    parser.add_argument("--gop", type=int, default=conv.GOP)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--max-batches", type=int, default=200)
+    parser.add_argument("--results", default="", help="JSON file to store results")
+    args = parser.parse_args()
+
+    results = {"bag": str(Path(args.bag).resolve()), "vcodec": args.vcodec, "crf": args.crf, "gop": args.gop, "modes": {},
+               "note": VIDEO_MODE_NOTE}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        synced = tmp / ("msg" + conv.SYNCED)
+        conv.extract_rosbag_to_json(Path(args.bag), tmp / "msg.json", synced, tmp / "frames")
+
+        for mode, use_videos in (("png", False), ("video", True)):
+            out = tmp / f"dataset_{mode}"
+            t0 = time.perf_counter()
+            conv.to_lerobot_dataset(synced, str(out), use_videos=use_videos, vcodec=args.vcodec, crf=args.crf, gop=args.gop)
+            convert_sec = time.perf_counter() - t0
+            results["modes"][mode] = {
+                "convert_sec": round(convert_sec, 3),
+                **dir_stats(out),
+                "loader_fps": round(loader_throughput(out, args.batch_size, args.num_workers, args.max_batches), 1),
+            }
+            print(f"{mode}: {results['modes'][mode]}")
+
+    png, video = results["modes"]["png"], results["modes"]["video"]
+    results["size_ratio"] = round(png["bytes"] / max(video["bytes"], 1), 2)
+    results["loader_speedup"] = round(video["loader_fps"] / max(png["loader_fps"], 1e-9), 2)
+    print(json.dumps(results, indent=2))
+    print(f"Note: {VIDEO_MODE_NOTE}")
+    if args.results:
+        with open(args.results, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+  Сквозной нагрузочный тест: rbs_cloud и gpu_server запускаются через uvicorn во временных
+  каталогах, вместо lerobot.scripts.train — заглушка (печатает шаги, пишет файл весов).
+  Клиенты в потоках создают смешанную нагрузку:
+
+    ingest  — создание датасета и загрузка бэгов (/create-dataset/, /upload-rel);
+    pull    — выкачивание опубликованного датасета (/list, /download по файлам);
+    catalog — запросы каталога (/dataset-status/, /query, /conversions);
+    train   — задача обучения на gpu_server (/train, опрос /status/{id}): датасет
+              выкачивается с rbs_cloud, веса загружаются обратно (/upload-weights).
+
+  Состав нагрузки задаётся --workload (готовые смеси) и переопределяется числом клиентов
+  каждого вида. Для каждой операции печатаются p50/p95/p99/max, rps и число ошибок, плюс
+  пропускная способность загрузки/выкачивания в МБ/с; результат дописывается строкой JSON
+  в --results. --compare сравнивает с последней записью той же смеси в прошлом файле
+  результатов и завершается с кодом 1, если p95 вырос или пропускная способность упала
+  больше --tolerance.
+
+  Пример:
+    python benchmarks/load_test.py --workload mixed --label baseline
+    python benchmarks/load_test.py --workload mixed --compare load_test.jsonl
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import requests
+
+from bench_concurrency import REQUEST_TIMEOUT, Recorder
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Число клиентов каждого вида в готовых смесях
+WORKLOADS = {
+    "mixed": dict(ingest=4, pull=4, catalog=4, train=1),
+    "ingest": dict(ingest=8, pull=0, catalog=2, train=0),
+    "pull": dict(ingest=0, pull=8, catalog=2, train=2),
+    "catalog": dict(ingest=1, pull=1, catalog=12, train=0),
+}
+CLIENTS = ("ingest", "pull", "catalog", "train")
+
+# Заглушка lerobot.scripts.train: прогресс в формате "step i/N", как у настоящего скрипта
+TRAIN_STUB = '''
+import os, sys, time, argparse
+parser = argparse.ArgumentParser()
+parser.add_argument("--output_dir")
+parser.add_argument("--steps", type=int, default=10)
+args, _ = parser.parse_known_args()
+step_sec = float(os.environ.get("RBS_STUB_STEP_SEC", "0.05"))
+for i in range(1, args.steps + 1):
+    time.sleep(step_sec)
+    print(f"step {i}/{args.steps} loss=0.1", flush=True)
+model = os.path.join(args.output_dir, "checkpoints", "last", "pretrained_model")
+os.makedirs(model, exist_ok=True)
+with open(os.path.join(model, "model.safetensors"), "wb") as f:
+    f.write(os.urandom(int(float(os.environ.get("RBS_STUB_WEIGHTS_MB", "1")) * 2**20)))
+'''
+
+def write_train_stub(root: Path) -> Path:
+    scripts = root / "lerobot" / "scripts"
+    scripts.mkdir(parents=True)
+    (root / "lerobot" / "__init__.py").write_text("")
+    (scripts / "__init__.py").write_text("")
+    (scripts / "train.py").write_text(TRAIN_STUB)
+    return root
+
+def seed_data(data_dir: Path, catalog_rows: int, pull_datasets: int, files: int, file_mb: float) -> list:
+    """
+    Каталог из *catalog_rows* датасетов без данных и *pull_datasets* опубликованных (store)
+    датасетов pull_<i> по *files* файлов; возвращает имена опубликованных.
+    """
+    pulls = [f"pull_{i:03d}" for i in range(pull_datasets)]
+    chunk = os.urandom(int(file_mb * 2**20))
+    for name in pulls:
+        root = data_dir / name
+        (root / "meta").mkdir(parents=True)
+        (root / "meta" / "info.json").write_text(json.dumps({"total_episodes": files, "fps": 30}))
+        videos = root / "videos" / "chunk-000" / "observation.images.cam"
+        videos.mkdir(parents=True)
+        for i in range(files):
+            # не parquet: представления DuckDB над этими датасетами не строятся
+            (videos / f"episode_{i:06d}.mp4").write_bytes(chunk)
+    names = [f"ds_{i:06d}" for i in range(catalog_rows)] + pulls
+    pd.DataFrame({
+        "name": names,
+        "num_episodes": np.random.randint(1, 100, len(names)).astype("int32"),
+        "src_format": "rosbag",
+        "work_format": "lerobot",
+        "status": ["save"] * catalog_rows + ["store"] * len(pulls),
+    }).to_parquet(data_dir / "datasets.parquet", index=False)
+    return pulls
+
+def start_uvicorn(app: str, cwd: Path, port: int, env: dict, probe: str, workers: int = 1) -> subprocess.Popen:
+    log = open(cwd / "server.log", "wb")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=cwd, env=dict(os.environ, **env), stdout=log, stderr=subprocess.STDOUT,
+    )
+    for _ in range(600):
+        try:
+            if requests.get(f"http://127.0.0.1:{port}{probe}", timeout=1).ok:
+                return proc
+        except requests.RequestException:
+            pass
+        if proc.poll() is not None:
+            break
+        time.sleep(0.1)
+    stop(proc)
+    sys.stderr.write((cwd / "server.log").read_text(errors="replace")[-4000:])
+    raise RuntimeError(f"{app} did not start")
+
+def stop(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()  # зависшие соединения не дают uvicorn завершиться
+        proc.wait()
+
+class Load:
+    """Клиенты нагрузки; каждый повторяет свой сценарий до *deadline*, операции пишутся в Recorder."""
+
+    def __init__(self, cloud: str, gpu: str, args, pulls: list, deadline: float):
+        self.cloud = cloud
+        self.gpu = gpu
+        self.args = args
+        self.pulls = pulls
+        self.deadline = deadline
+        self.recorder = Recorder()
+        self._bytes_lock = threading.Lock()
+        self.bytes = {"upload": 0, "download": 0}
+        self.bag = os.urandom(int(args.bag_mb * 2**20))
+
+    def call(self, op: str, func, *args, **kwargs):
+        """Выполняет запрос и записывает задержку; ответ или None при ошибке."""
+        t0 = time.perf_counter()
+        try:
+            response = func(*args, timeout=REQUEST_TIMEOUT, **kwargs)
+            ok = response.ok
+        except requests.RequestException:  # в том числе тайм-аут
+            response, ok = None, False
+        self.recorder.add(op, time.perf_counter() - t0, ok)
+        return response if ok else None
+
+    def count_bytes(self, kind: str, n: int) -> None:
+        with self._bytes_lock:
+            self.bytes[kind] += n
+
+    def ingest(self, wid: int) -> None:
+        s = requests.Session()
+        n = 0
+        while time.time() < self.deadline:
+            name = f"ingest_{wid}_{n}"
+            n += 1
+            if self.call("create", s.post, self.cloud + "/create-dataset/", params={"dataset_name": name}) is None:
+                continue
+            for i in range(self.args.bags):
+                if time.time() >= self.deadline:
+                    break
+                r = self.call("upload", s.post, self.cloud + "/upload-rel",
+                              data={"dataset_name": name, "relative_path": f"episode_{i}/episode_{i}_0.mcap"},
+                              files={"file": ("bag.mcap", self.bag)})
+                if r is not None:
+                    self.count_bytes("upload", len(self.bag))
+
+    def pull(self, wid: int) -> None:
+        s = requests.Session()
+        while time.time() < self.deadline:
+            name = random.choice(self.pulls)
+            r = self.call("list", s.get, self.cloud + "/list", params={"name": name})
+            if r is None:
+                continue
+            for rel in r.json()["files"]:
+                if time.time() >= self.deadline:
+                    break
+                t0 = time.perf_counter()
+                size, ok = 0, False
+                try:
+                    with s.get(self.cloud + "/download", params={"filename": f"{name}/{rel}"},
+                               stream=True, timeout=REQUEST_TIMEOUT) as resp:
+                        if resp.ok:
+                            for block in resp.iter_content(2**20):
+                                size += len(block)
+                            ok = True
+                except requests.RequestException:
+                    pass
+                self.recorder.add("download", time.perf_counter() - t0, ok)
+                self.count_bytes("download", size)
+
+    def catalog(self, wid: int) -> None:
+        s = requests.Session()
+        rows = self.args.catalog_rows
+        calls = [
+            lambda: self.call("status", s.get, self.cloud + "/dataset-status/",
+                              params={"dataset_name": f"ds_{random.randrange(rows):06d}"}),
+            # случайная граница — мимо кэша результатов
+            lambda: self.call("query", s.get, self.cloud + "/query", params={
+                "sql": f"SELECT status, count(*) FROM datasets WHERE num_episodes > {random.randrange(100)} GROUP BY status"}),
+            lambda: self.call("conversions", s.get, self.cloud + "/conversions"),
+        ]
+        n = wid
+        while time.time() < self.deadline:
+            calls[n % len(calls)]()
+            n += 1
+
+    def train(self, wid: int) -> None:
+        """Задачи обучения по очереди; время задачи — от /train до finished/failed."""
+        s = requests.Session()
+        n = wid
+        while time.time() < self.deadline:
+            # у клиентов разные датасеты: gpu_server удаляет датасет после обучения
+            name = self.pulls[n % len(self.pulls)]
+            n += self.args.train
+            t0 = time.perf_counter()
+            r = self.call("train_submit", s.post, self.gpu + "/train",
+                          json={"dataset_name": name, "steps": self.args.train_steps, "device": "cpu"})
+            if r is None:
+                continue
+            job_id, state = r.json()["job_id"], None
+            while state not in ("finished", "failed") and time.time() < self.deadline + REQUEST_TIMEOUT:
+                time.sleep(0.2)
+                st = self.call("train_status", s.get, f"{self.gpu}/status/{job_id}")
+                state = st.json()["state"] if st is not None else state
+            self.recorder.add("train_job", time.perf_counter() - t0, state == "finished")
+
+    def run(self) -> float:
+        threads = [threading.Thread(target=getattr(self, kind), args=(w,))
+                   for kind in CLIENTS for w in range(getattr(self.args, kind))]
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.time() - t0
+
+def git_revision(root: Path) -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return ""
+
+def compare(result: dict, baseline_file: Path, tolerance: float) -> bool:
+    """Сравнивает с последней записью той же смеси в baseline; False при регрессии."""
+    base = None
+    with open(baseline_file, "r") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                if rec["workload"] == result["workload"]:
+                    base = rec
+    if base is None:
+        print(f"No '{result['workload']}' results in {baseline_file}")
+        return True
+    ok = True
+    for op, cur in result["ops"].items():
+        prev = base["ops"].get(op)
+        if not prev or not prev["p95_ms"]:
+            continue
+        ratio = cur["p95_ms"] / prev["p95_ms"]
+        flag = "REGRESSION" if ratio > 1.0 + tolerance or cur["errors"] > prev["errors"] else "ok"
+        ok = ok and flag == "ok"
+        print(f"{op:13} p95 {prev['p95_ms']} -> {cur['p95_ms']} ms (x{ratio:.2f}), rps {prev['rps']} -> {cur['rps']}  {flag}")
+    for key in ("upload_mb_per_sec", "download_mb_per_sec"):
+        if base.get(key):
+            ratio = result[key] / base[key]
+            flag = "REGRESSION" if ratio < 1.0 - tolerance else "ok"
+            ok = ok and flag == "ok"
+            print(f"{key}: {base[key]} -> {result[key]} (x{ratio:.2f})  {flag}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of rbs_cloud and gpu_server")
+    parser.add_argument("--workload", default="mixed", choices=sorted(WORKLOADS))
+    for kind in CLIENTS:
+        parser.add_argument(f"--{kind}", type=int, help=f"Number of {kind} clients (overrides --workload)")
+    parser.add_argument("--server-root", default=str(ROOT), help="Directory with rbs_cloud.py and gpu_server/ to test")
+    parser.add_argument("--label", default="", help="Free-form label stored with the results")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes of rbs_cloud")
+    parser.add_argument("--bags", type=int, default=4, help="Bag files uploaded per ingested dataset")
+    parser.add_argument("--bag-mb", type=float, default=8, help="Size of each uploaded bag")
+    parser.add_argument("--pull-datasets", type=int, default=4, help="Published datasets to pull")
+    parser.add_argument("--pull-files", type=int, default=8, help="Files per published dataset")
+    parser.add_argument("--pull-file-mb", type=float, default=4)
+    parser.add_argument("--catalog-rows", type=int, default=5000)
+    parser.add_argument("--train-steps", type=int, default=20, help="Steps of the stub trainer (0.05 s each)")
+    parser.add_argument("--port", type=int, default=8797, help="rbs_cloud port; gpu_server uses the next one")
+    parser.add_argument("--results", default="load_test.jsonl", help="JSONL file to append results to")
+    parser.add_argument("--compare", default="", help="Previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative p95 growth / throughput drop")
+    args = parser.parse_args()
+    for kind in CLIENTS:
+        if getattr(args, kind) is None:
+            setattr(args, kind, WORKLOADS[args.workload][kind])
+
+    server_root = Path(args.server_root).resolve()
+    cloud, gpu = f"http://127.0.0.1:{args.port}", f"http://127.0.0.1:{args.port + 1}"
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        for d in ("cloud/data", "cloud/cache", "gpu"):
+            (work / d).mkdir(parents=True)
+        pulls = seed_data(work / "cloud" / "data", args.catalog_rows, max(args.pull_datasets, args.train, 1),
+                          args.pull_files, args.pull_file_mb)
+        stubs = write_train_stub(work / "stubs")
+        pythonpath = os.pathsep.join([str(server_root), os.environ.get("PYTHONPATH", "")])
+        procs = []
+        try:
+            procs.append(start_uvicorn("rbs_cloud:app", work / "cloud", args.port,
+                                       {"PYTHONPATH": pythonpath, "RBS_WARM_WORKERS": "0", "RBS_GC_INTERVAL_MIN": "0"},
+                                       "/health", args.workers))
+            # gpu_server запускает "python -m lerobot.scripts.train": тот же интерпретатор, заглушка в PYTHONPATH
+            procs.append(start_uvicorn("gpu_server.gpu_server:app", work / "gpu", args.port + 1, {
+                "PYTHONPATH": os.pathsep.join([str(stubs), pythonpath]),
+                "PATH": os.pathsep.join([str(Path(sys.executable).parent), os.environ.get("PATH", "")]),
+                "RBS_DATA_SERVER": cloud,
+            }, "/"))
+            load = Load(cloud, gpu, args, pulls, time.time() + args.duration)
+            duration = load.run()
+        finally:
+            for proc in procs:
+                stop(proc)
+
+    ops = load.recorder.summary(duration)
+    result = {
+        "workload": args.workload,
+        "label": args.label,
+        "server_rev": git_revision(server_root),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("results", "compare", "port", "server_root", "label")},
+        "duration_sec": round(duration, 1),
+        "upload_mb_per_sec": round(load.bytes["upload"] / 2**20 / duration, 1),
+        "download_mb_per_sec": round(load.bytes["download"] / 2**20 / duration, 1),
+        "ops": ops,
+    }
+    print(f"{'op':13} {'count':>6} {'err':>4} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for op, s in ops.items():
+        print(f"{op:13} {s['count']:6d} {s['errors']:4d} {s['rps']:7.1f} {s['p50_ms']:8.1f} {s['p95_ms']:8.1f} {s['p99_ms']:8.1f} {s['max_ms']:8.1f}")
+    print(f"upload: {result['upload_mb_per_sec']} MB/s, download: {result['download_mb_per_sec']} MB/s")
+
+    ok = compare(result, Path(args.compare), args.tolerance) if args.compare else True
+    with open(args.results, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    print(f"Results appended to {args.results}")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+  Генератор синтетических ROS2-бэгов (по одной папке с .db3 на эпизод) для бенчмарков конвертации.
+  Камеры (Image или CompressedImage/JPEG) и JointState пишутся с заданными частотами.
+
+  Пример:
+    python benchmarks/synthetic_bags.py /tmp/bags --episodes 5 --seconds 10 --cameras 2 --width 640 --height 480 --compressed
+"""
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+from rosbags.rosbag2 import StoragePlugin, Writer
+from rosbags.typesys import Stores, get_typestore
+
+TYPESTORE = get_typestore(Stores.ROS2_JAZZY)
+Image = TYPESTORE.types["sensor_msgs/msg/Image"]
+CompressedImage = TYPESTORE.types["sensor_msgs/msg/CompressedImage"]
+JointState = TYPESTORE.types["sensor_msgs/msg/JointState"]
+Header = TYPESTORE.types["std_msgs/msg/Header"]
+Time = TYPESTORE.types["builtin_interfaces/msg/Time"]
+
+def make_header(t_ns: int, frame_id: str):
+    return Header(stamp=Time(sec=t_ns // 10**9, nanosec=t_ns % 10**9), frame_id=frame_id)
+
+def make_image(rng: np.random.Generator, index: int, width: int, height: int) -> np.ndarray:
+    """BGR-кадр: сдвигающийся градиент с шумом, чтобы JPEG/PNG сжимались как реальные снимки."""
+    x = (np.arange(width, dtype=np.uint16) + 4 * index) % 256
+    y = np.arange(height, dtype=np.uint16)[:, None] % 256
+    base = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)), (x + y) % 256], axis=-1)
+    noise = rng.integers(0, 16, size=base.shape, dtype=np.uint16)
+    return (base + noise).astype(np.uint8)
+
+def write_episode(path: Path, seed: int, seconds: float, cameras: int, width: int, height: int,
+                  camera_fps: float, joint_rate: float, joints: int, compressed: bool) -> None:
+    rng = np.random.default_rng(seed)
+    msgtype = CompressedImage.__msgtype__ if compressed else Image.__msgtype__
+    with Writer(path, version=8, storage_plugin=StoragePlugin.SQLITE3) as writer:
+        cam_conns = [writer.add_connection(f"/camera{i}/image", msgtype, typestore=TYPESTORE) for i in range(cameras)]
+        joint_conn = writer.add_connection("/joint_states", JointState.__msgtype__, typestore=TYPESTORE)
+
+        # события в порядке времени: (t_ns, вид, индекс)
+        events = [(int(i * 1e9 / camera_fps) + 1, 0, i) for i in range(int(seconds * camera_fps))]
+        events += [(int(i * 1e9 / joint_rate) + 1, 1, i) for i in range(int(seconds * joint_rate))]
+        events.sort()
+        names = [f"joint_{j}" for j in range(joints)]
+
+        for t_ns, kind, index in events:
+            if kind == 0:
+                img = make_image(rng, index, width, height)
+                for cam, conn in enumerate(cam_conns):
+                    header = make_header(t_ns, f"camera{cam}")
+                    if compressed:
+                        data = np.frombuffer(cv2.imencode(".jpg", img)[1].tobytes(), dtype=np.uint8)
+                        msg = CompressedImage(header=header, format="jpeg", data=data)
+                    else:
+                        msg = Image(header=header, height=height, width=width, encoding="bgr8",
+                                    is_bigendian=0, step=width * 3, data=img.reshape(-1))
+                    writer.write(conn, t_ns, TYPESTORE.serialize_cdr(msg, msgtype))
+            else:
+                phase = t_ns / 1e9
+                msg = JointState(
+                    header=make_header(t_ns, ""),
+                    name=names,
+                    position=np.sin(np.arange(joints) + phase),
+                    velocity=np.cos(np.arange(joints) + phase),
+                    effort=np.zeros(joints),
+                )
+                writer.write(joint_conn, t_ns, TYPESTORE.serialize_cdr(msg, JointState.__msgtype__))
+
+def generate(root: Path, episodes: int = 2, seconds: float = 5.0, cameras: int = 1, width: int = 320, height: int = 240,
+             camera_fps: float = 30.0, joint_rate: float = 200.0, joints: int = 7, compressed: bool = False, seed: int = 0) -> Path:
+    """Создаёт *episodes* бэгов в *root*/episode_XXX и возвращает *root*."""
+    root.mkdir(parents=True, exist_ok=True)
+    for e in range(episodes):
+        write_episode(root / f"episode_{e:03d}", seed + e, seconds, cameras, width, height,
+                      camera_fps, joint_rate, joints, compressed)
+    return root
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic ROS2 bags for conversion benchmarks")
+    parser.add_argument("output", help="Directory for generated bags (one subfolder per episode)")
+    parser.add_argument("--episodes", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5.0, help="Episode length")
+    parser.add_argument("--cameras", type=int, default=1)
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--camera-fps", type=float, default=30.0)
+    parser.add_argument("--joint-rate", type=float, default=200.0, help="JointState rate, Hz")
+    parser.add_argument("--joints", type=int, default=7)
+    parser.add_argument("--compressed", action="store_true", help="Write sensor_msgs/CompressedImage (JPEG) instead of raw Image")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate(Path(args.output), args.episodes, args.seconds, args.cameras, args.width, args.height,
+             args.camera_fps, args.joint_rate, args.joints, args.compressed, args.seed)
+    print(f"Generated {args.episodes} episodes in {args.output}")
+
+if __name__ == "__main__":
+    main()
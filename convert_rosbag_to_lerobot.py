@@ -11,12 +11,21 @@
 import sys
 import json
 import argparse
-from typing import List
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 from PIL import Image
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.compute as pc
 import cv2
 import time
+import shutil
+import signal
+import functools
+import contextlib
+import collections
+import subprocess
 
 from cv_bridge import CvBridge
 from rosbags.highlevel import AnyReader
@@ -27,9 +36,192 @@ from lerobot.datasets.lerobot_dataset import LeRobotDataset
 FPS = 30 # default
 REPO_ID = "rbs_ros2bag"
 SYNCED = "_synced.json"
-USE_VIDEOS = False  # используем PNG-фреймы, так что формат — изображения
+JOINT_STATES = "joint_states.parquet" # колонки JointState эпизода рядом с его кадрами
+CHECKPOINT = "meta/rbs_conversion.json" # прогресс конвертации внутри датасета
+# индекс эпизодов и кадров для произвольного доступа без чтения всего датасета
+EPISODE_INDEX = "meta/rbs_episodes.parquet"
+FRAME_INDEX = "meta/rbs_frames.parquet"
+FRAME_INDEX_PARTS = "meta/rbs_frames.parts" # индекс эпизодов текущей конвертации, файл на эпизод
+# сводная статистика датасета для каталога (rbs_cloud.py переносит её в datasets.parquet)
+STATS = "meta/rbs_stats.json"
+USE_VIDEOS = False  # по умолчанию PNG-фреймы, так что формат — изображения
+# параметры видеокодирования (--videos), по умолчанию как в LeRobot
+VCODEC = "libsvtav1"
+CRF = 30
+GOP = 2
+# асинхронная запись кадров LeRobot: потоков на камеру (как в примерах LeRobot) и процессов
+IMAGE_WRITER_THREADS = 4
+IMAGE_WRITER_PROCESSES = 0
+PASSTHROUGH = True  # CompressedImage сохраняем без перекодирования в PNG
+JPEG_MAGIC = b"\xff\xd8\xff"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+@functools.lru_cache(maxsize=None)
+def ros_typestore():
+    # построение typestore дорогое — в долгоживущем воркере делаем это один раз
+    return get_typestore(Stores.ROS2_JAZZY)
+
+def preload() -> None:
+    """Прогрев для долгоживущих процессов конвертации (rbs_server.workers)."""
+    ros_typestore()
+
+class ProgressReporter:
+    """
+    Машиночитаемый прогресс конвертации: JSON-события по одному на строку.
+    Без файла (progress.open(None)) события не пишутся.
+    """
+
+    def __init__(self, min_interval: float = 1.0):
+        self.min_interval = min_interval  # не чаще раза в секунду для событий "frames"
+        self.open(None)
+
+    def open(self, path: Optional[Path]) -> None:
+        self.path = path
+        self.stage = ""
+        self.episode = 0
+        self.num_episodes = 0
+        self.frames = 0
+        self.bytes_written = 0
+        self.stage_start = time.monotonic()
+        self.last_emit = 0.0
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text("")
+
+    def start_stage(self, stage: str, num_episodes: int) -> None:
+        self.stage = stage
+        self.episode = 0
+        self.num_episodes = num_episodes
+        self.frames = 0
+        self.stage_start = time.monotonic()
+        self.emit("stage")
+
+    def frame(self, nbytes: int = 0) -> None:
+        self.frames += 1
+        self.bytes_written += nbytes
+        if time.monotonic() - self.last_emit >= self.min_interval:
+            self.emit("frames")
+
+    def end_episode(self, nbytes: int = 0, **fields) -> None:
+        self.episode += 1
+        self.bytes_written += nbytes
+        self.emit("episode", **fields)
+
+    def emit(self, event: str, **fields) -> None:
+        if self.path is None:
+            return
+        now = time.monotonic()
+        self.last_emit = now
+        elapsed = now - self.stage_start
+        record = {
+            "ts": time.time(),
+            "event": event,
+            "stage": self.stage,
+            "episode": self.episode,
+            "num_episodes": self.num_episodes,
+            "frames": self.frames,
+            "fps": round(self.frames / elapsed, 2) if elapsed > 0 else 0.0,
+            "bytes_written": self.bytes_written,
+            "stage_elapsed": round(elapsed, 3),
+            **fields,
+        }
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+progress = ProgressReporter()
+
+class Profiler:
+    """
+    Накопительные таймеры и счётчики по стадиям конвертации: за эпизод и за весь запуск.
+    Использование: t0 = time.perf_counter(); ...; profiler.add("decode", t0)
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.totals = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+        self.episode_totals = collections.defaultdict(float)
+        self.episode_counts = collections.defaultdict(int)
+        self.episodes = []
+
+    def add(self, name: str, t0: float) -> None:
+        dt = time.perf_counter() - t0
+        self.episode_totals[name] += dt
+        self.episode_counts[name] += 1
+
+    def timed_iter(self, name: str, iterable):
+        """Оборачивает итератор, относя время каждого next() к стадии *name*."""
+        it = iter(iterable)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.add(name, t0)
+            yield item
+
+    def end_episode(self, stage: str) -> dict:
+        """Закрывает эпизод: переносит его таймеры в общие и печатает их в лог."""
+        timings = {name: {"sec": round(sec, 4), "count": self.episode_counts[name]}
+                   for name, sec in self.episode_totals.items()}
+        for name, sec in self.episode_totals.items():
+            self.totals[name] += sec
+            self.counts[name] += self.episode_counts[name]
+        self.episodes.append({"stage": stage, "timings": timings})
+        self.episode_totals.clear()
+        self.episode_counts.clear()
+        print(f"⏱  {stage}: " + ", ".join(f"{n}={t['sec']:.3f}s/{t['count']}" for n, t in timings.items()))
+        return timings
+
+    def summary(self) -> dict:
+        total = sum(self.totals.values())
+        return {
+            name: {
+                "sec": round(sec, 4),
+                "count": self.counts[name],
+                "share": round(sec / total, 4) if total > 0 else 0.0,
+            }
+            for name, sec in sorted(self.totals.items(), key=lambda kv: -kv[1])
+        }
 
-start_time = time.time()  # Запоминаем время начала
+    def print_summary(self) -> None:
+        print("⏱  Stage timings:")
+        for name, t in self.summary().items():
+            print(f"   {name:<14} {t['sec']:>10.3f} s  {t['count']:>8}  {100 * t['share']:5.1f}%")
+
+profiler = Profiler()
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер на SIGPROF: раз в *interval* секунд процессорного времени
+    запоминает стек главного потока. Результат — "folded stacks" для flamegraph.pl/speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+
+    def _sample(self, signum, frame) -> None:
+        stack = []
+        while frame is not None:
+            stack.append(f"{frame.f_code.co_name} ({Path(frame.f_code.co_filename).name}:{frame.f_code.co_firstlineno})")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self, path: Path) -> None:
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Sampling profile ({sum(self.stacks.values())} samples) saved to: {path}")
 
 def convert_seconds(total_seconds) -> str:
     hours = int(total_seconds // 3600)
@@ -46,25 +238,116 @@ def find_folders_with_db3_files(directory: Path) -> List[Path]:
     # Сортируем список папок
     return sorted(subfolders)
 
-def to_lerobot_dataset(json_file: Path, output_root: str):
-    # === ЗАГРУЗКА ДАННЫХ ===
+def load_checkpoint(dataset_dir: Path) -> Optional[dict]:
+    """Чекпоинт конвертации, сверенный с числом эпизодов в meta/info.json."""
+    checkpoint_file = dataset_dir / CHECKPOINT
+    info_file = dataset_dir / "meta" / "info.json"
+    if not checkpoint_file.is_file() or not info_file.is_file():
+        return None
+    with open(checkpoint_file, "r") as f:
+        checkpoint = json.load(f)
+    with open(info_file, "r") as f:
+        total_episodes = json.load(f)["total_episodes"]
+
+    # эпизод мог быть сохранён датасетом, но не успеть попасть в чекпоинт
+    in_progress = checkpoint.pop("in_progress", None)
+    if in_progress and total_episodes == len(checkpoint["episodes"]) + 1:
+        checkpoint["episodes"].append(in_progress)
+    checkpoint["episodes"] = checkpoint["episodes"][:total_episodes]
+    return checkpoint
+
+def save_checkpoint(dataset_dir: Path, checkpoint: dict) -> None:
+    checkpoint_file = dataset_dir / CHECKPOINT
+    tmp_file = checkpoint_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    tmp_file.replace(checkpoint_file)
+
+def dataset_params(target_fps: Optional[float], resolution: Optional[Tuple[int, int]], use_videos: bool,
+                   vcodec: str, crf: int, gop: int) -> dict:
+    """Параметры, определяющие содержимое датасета; сохраняются в meta/rbs_conversion.json."""
+    return {
+        "target_fps": target_fps,
+        "resolution": list(resolution) if resolution else None,
+        "use_videos": use_videos,
+        "vcodec": vcodec if use_videos else None,
+        "crf": crf if use_videos else None,
+        "gop": gop if use_videos else None,
+    }
+
+class VideoEncoder:
+    """Фоновый процесс ffmpeg, кодирующий RGB-кадры одной камеры в видеофайл по мере их поступления."""
+
+    def __init__(self, video_path: Path, width: int, height: int, fps: float, vcodec: str = VCODEC, crf: int = CRF, gop: int = GOP):
+        video_path.parent.mkdir(parents=True, exist_ok=True)
+        self.video_path = video_path
+        self.width, self.height = width, height
+        cmd = [
+            "ffmpeg", "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "rgb24",
+            "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+            "-c:v", vcodec, "-pix_fmt", "yuv420p",
+            "-crf", str(crf), "-g", str(gop),
+            str(video_path),
+        ]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, image: np.ndarray) -> None:
+        if image.shape[:2] != (self.height, self.width):
+            # сырой поток без заголовков: кадр другого размера сдвинул бы все следующие
+            raise ValueError(f"Frame {image.shape[1]}x{image.shape[0]} does not match video size {self.width}x{self.height} of {self.video_path}")
+        # запись в pipe блокируется, только если кодер не успевает
+        self.process.stdin.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+
+    def close(self) -> None:
+        self.process.stdin.close()
+        retcode = self.process.wait()
+        if retcode != 0:
+            raise RuntimeError(f"ffmpeg exited with code {retcode} while encoding {self.video_path}")
+
+    def abort(self) -> None:
+        """Останавливает ffmpeg, не дожидаясь конца потока, и удаляет недописанный файл."""
+        self.process.kill()
+        self.process.wait()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass  # ffmpeg уже не читает pipe
+        # иначе LeRobot примет обрывок за готовое видео эпизода и не перекодирует его
+        self.video_path.unlink(missing_ok=True)
+
+def to_lerobot_dataset(json_file: Path, output_root: str, use_videos: bool = USE_VIDEOS, vcodec: str = VCODEC, crf: int = CRF, gop: int = GOP, resolution: Optional[Tuple[int, int]] = None):
+    # === ЗАГРУЗКА ДАННЫХ === (только заголовок, эпизоды читаются по одному)
     with open(json_file, "r") as f:
         data = json.load(f)
 
     camera_keys = data["cameras"]
     image_shape = data["image_shape"]
+    if resolution:
+        image_shape = [resolution[1], resolution[0], 3]
 
     cam_features = [cam.lstrip('/').replace('/', '.') for cam in camera_keys]  # ['/robot_camera/depth_image', '/robot_camera/image']
 
-    robot_joint_names = data["episodes"][0]["frames"][0]["joint_state"]["name"]
+    # генератор закрываем явно, иначе файл эпизодов остаётся открытым до сборки мусора
+    with contextlib.closing(iter_episodes(json_file)) as episodes:
+        robot_joint_names = next(episodes)["joint_names"]
     nof_joints = len(robot_joint_names)
     estimated_fps = data["estimated_fps"]
     fps = FPS if estimated_fps < 0.1 else estimated_fps
+    if data.get("target_fps"):
+        # после прореживания оценка частоты чуть «плавает» — не выше заданной
+        fps = min(fps, data["target_fps"])
+
+    if use_videos and shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg not found in PATH, video mode is unavailable")
+
+    params = dataset_params(data.get("target_fps"), resolution, use_videos, vcodec, crf, gop)
 
     # === ОПРЕДЕЛЕНИЕ FEATURES ===
     features = {
         cam: {
-            "dtype": "image",
+            "dtype": "video" if use_videos else "image",
             "shape": image_shape,
             "names": ["height", "width", "channels"]
         }
@@ -85,40 +368,388 @@ def to_lerobot_dataset(json_file: Path, output_root: str):
         },
     })
 
-    # === СОЗДАНИЕ LeRobotDataset ===
-    dataset = LeRobotDataset.create(
-        repo_id=REPO_ID,
-        fps=fps,
-        root=output_root,
-        features=features,
-        use_videos=USE_VIDEOS,
-    )
-
-    for episode in data["episodes"]:
-        # === КОНВЕРТАЦИЯ ФРЕЙМОВ ===
-        for frame in episode["frames"]:
-            frame_data = {
-                "observation.state": np.array(frame["joint_state"]["pos"], dtype=np.float32),
-                "action": np.array(frame["joint_state"]["pos"], dtype=np.float32),
-            }
-
-            for cam_idx, cam in enumerate(camera_keys):
-                image_path = Path(frame[cam])
-                image = Image.open(image_path).convert("RGB")
-                frame_data[cam_features[cam_idx]] = np.array(image)
-
-            dataset.add_frame(frame_data, "default_task")
-
-        # === СОХРАНЕНИЕ ЭПИЗОДА ===
-        dataset.save_episode()
+    # === СОЗДАНИЕ LeRobotDataset (или продолжение существующего) ===
+    dataset_dir = Path(output_root)
+    checkpoint = load_checkpoint(dataset_dir)
+    if checkpoint is None:
+        dataset = LeRobotDataset.create(
+            repo_id=REPO_ID,
+            fps=fps,
+            root=output_root,
+            features=features,
+            use_videos=use_videos,
+        )
+        checkpoint = {"complete": False, "params": params, "episodes": []}
+    else:
+        if checkpoint.get("params", params) != params:
+            raise ValueError(f"Cannot append: dataset was converted with {checkpoint.get('params')}, requested {params}")
+        checkpoint["params"] = params
+        dataset = LeRobotDataset(REPO_ID, root=output_root)
+        checkpoint["complete"] = False
+        print(f"Appending to existing dataset: {len(checkpoint['episodes'])} episodes already converted")
+    save_checkpoint(dataset_dir, checkpoint)
+    frame_index = FrameIndex(dataset_dir)
+    progress.start_stage("lerobot", data["num_episodes"])
+
+    # PNG-кадры (и для image-, и для video-признаков) пишутся асинхронно; save_episode дожидается записи
+    dataset.start_image_writer(num_processes=IMAGE_WRITER_PROCESSES, num_threads=IMAGE_WRITER_THREADS * len(cam_features))
+    try:
+        for episode in iter_episodes(json_file):
+            # В видеорежиме кадры каждой камеры сразу уходят в свой процесс ffmpeg; кодер
+            # создаётся на первом кадре камеры — размер видео берётся из него, а не из общего
+            # image_shape. LeRobot не перекодирует эпизод, если видеофайл уже существует.
+            # PNG-кадры add_frame пишет и для видеопризнаков (по ним save_episode считает
+            # статистику эпизода) — в потоках image writer, не задерживая цикл.
+            encoders = {}
+            episode_index = dataset.meta.total_episodes
+            encoded = False
+            try:
+                # === КОНВЕРТАЦИЯ ФРЕЙМОВ ===
+                for frame in episode["frames"]:
+                    frame_data = {
+                        "observation.state": np.array(frame["joint_state"]["pos"], dtype=np.float32),
+                        "action": np.array(frame["joint_state"]["pos"], dtype=np.float32),
+                    }
 
-def add_episode(dir: Path) -> None:
+                    for cam_idx, cam in enumerate(camera_keys):
+                        t0 = time.perf_counter()
+                        image_path = Path(frame[cam])
+                        image = np.array(Image.open(image_path).convert("RGB"))
+                        profiler.add("load_image", t0)
+                        image = resize_image(image, resolution)
+                        frame_data[cam_features[cam_idx]] = image
+                        if use_videos:
+                            t0 = time.perf_counter()
+                            cam = cam_features[cam_idx]
+                            if cam not in encoders:
+                                video_path = dataset.root / dataset.meta.get_video_file_path(episode_index, cam)
+                                encoders[cam] = VideoEncoder(video_path, image.shape[1], image.shape[0], fps, vcodec, crf, gop)
+                            encoders[cam].write(image)
+                            profiler.add("video_encode", t0)
+
+                    t0 = time.perf_counter()
+                    dataset.add_frame(frame_data, "default_task")
+                    profiler.add("add_frame", t0)
+                    progress.frame()
+
+                t0 = time.perf_counter()
+                for encoder in encoders.values():
+                    encoder.close()
+                if encoders:
+                    profiler.add("video_encode", t0)
+                encoded = True
+            finally:
+                if not encoded:
+                    # сбой посреди эпизода: ffmpeg не должны остаться ждать stdin (в воркере они
+                    # пережили бы задачу), а недописанные видео — попасть в датасет
+                    for encoder in encoders.values():
+                        encoder.abort()
+
+            # === СОХРАНЕНИЕ ЭПИЗОДА ===
+            checkpoint["in_progress"] = episode["bag"]
+            save_checkpoint(dataset_dir, checkpoint)
+            episode_index = dataset.meta.total_episodes
+            t0 = time.perf_counter()
+            dataset.save_episode()
+            profiler.add("save_episode", t0)
+            nbytes = episode_bytes(dataset, episode_index, use_videos)
+            frame_index.add_episode(dataset, episode_index, episode, fps, use_videos, nbytes)
+            progress.end_episode(nbytes, timings=profiler.end_episode("lerobot"))
+            checkpoint["episodes"].append(checkpoint.pop("in_progress"))
+            save_checkpoint(dataset_dir, checkpoint)
+            print(f"episode {len(checkpoint['episodes'])}: saved ({episode['bag']})")
+    finally:
+        dataset.stop_image_writer()
+
+    t0 = time.perf_counter()
+    frame_index.finish()
+    write_stats(dataset_dir, frame_index.episodes, fps, robot_joint_names, cam_features, image_shape)
+    profiler.add("stats", t0)
+    checkpoint["complete"] = True
+    save_checkpoint(dataset_dir, checkpoint)
+
+def write_stats(dataset_dir: Path, episodes: List[dict], fps: float, joint_names: List[str], cameras: List[str], image_shape) -> dict:
+    """Сводка по датасету из построчной статистики эпизодов (средние и дисперсии взвешены числом кадров)."""
+    n = np.array([e["num_frames"] for e in episodes], dtype=np.float64)
+    stats = {
+        "num_episodes": len(episodes),
+        "num_frames": int(n.sum()),
+        "duration_sec": float(sum(e["duration_sec"] for e in episodes)),
+        "size_bytes": int(sum(e["size_bytes"] for e in episodes)),
+        "fps": fps,
+        "num_joints": len(joint_names),
+        "joint_names": joint_names,
+        "cameras": cameras,
+        "image_shape": list(image_shape),
+    }
+    if episodes and n.sum() > 0:
+        mins = np.array([e["state_min"] for e in episodes])
+        maxs = np.array([e["state_max"] for e in episodes])
+        means = np.array([e["state_mean"] for e in episodes])
+        stds = np.array([e["state_std"] for e in episodes])
+        w = (n / n.sum())[:, None]
+        mean = (w * means).sum(0)
+        var = (w * (stds ** 2 + means ** 2)).sum(0) - mean ** 2
+        stats.update({
+            "state_min": mins.min(0).tolist(),
+            "state_max": maxs.max(0).tolist(),
+            "state_mean": mean.tolist(),
+            "state_std": np.sqrt(np.maximum(var, 0)).tolist(),
+        })
+    tmp = dataset_dir / (STATS + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(stats, f, indent=2)
+    tmp.replace(dataset_dir / STATS)
+    return stats
+
+def episode_bytes(dataset: LeRobotDataset, episode_index: int, use_videos: bool) -> int:
+    """Размер файлов, записанных LeRobot для эпизода."""
+    paths = [dataset.root / dataset.meta.get_data_file_path(episode_index)]
+    if use_videos:
+        paths += [dataset.root / dataset.meta.get_video_file_path(episode_index, key) for key in dataset.meta.video_keys]
+    return sum(p.stat().st_size for p in paths if p.is_file())
+
+class FrameIndex:
+    """
+    Индекс сконвертированного датасета: строка на эпизод (bag, длительность, файлы) и строка на кадр
+    (время ROS, глобальный index, row group и строка внутри него в parquet-файле эпизода).
+
+    Во время конвертации индекс каждого эпизода пишется отдельным файлом в FRAME_INDEX_PARTS
+    (строка эпизода — в метаданных файла); finish() один раз сливает их с прежним индексом.
+    Части, оставшиеся от прерванного запуска, подхватываются при продолжении.
+    """
+
+    def __init__(self, dataset_dir: Path):
+        self.dataset_dir = dataset_dir
+        self.parts_dir = dataset_dir / FRAME_INDEX_PARTS
+        self._episodes: Dict[int, dict] = {}
+        if (dataset_dir / EPISODE_INDEX).is_file() and (dataset_dir / FRAME_INDEX).is_file():
+            self._episodes = {e["episode_index"]: e for e in pq.read_table(dataset_dir / EPISODE_INDEX).to_pylist()}
+        for part in self._parts():
+            episode = json.loads(pq.read_schema(part).metadata[b"episode"])
+            self._episodes[episode["episode_index"]] = episode
+
+    @property
+    def episodes(self) -> List[dict]:
+        return [self._episodes[i] for i in sorted(self._episodes)]
+
+    def _parts(self) -> List[Path]:
+        return sorted(self.parts_dir.glob("episode_*.parquet")) if self.parts_dir.is_dir() else []
+
+    def add_episode(self, dataset: LeRobotDataset, episode_index: int, episode: dict, fps: float, use_videos: bool, nbytes: int = 0) -> None:
+        num_frames = len(episode["frames"])
+        data_file = dataset.meta.get_data_file_path(episode_index)
+        data_path = dataset.root / data_file
+        # эпизоды пишутся последовательно, глобальный index продолжает предыдущий
+        first_index = sum(e["num_frames"] for i, e in self._episodes.items() if i < episode_index)
+
+        row_group = np.zeros(num_frames, dtype=np.int32)
+        row_in_group = np.arange(num_frames, dtype=np.int32)
+        if data_path.is_file():
+            metadata = pq.ParquetFile(data_path).metadata
+            offset = 0
+            for rg in range(metadata.num_row_groups):
+                rows = metadata.row_group(rg).num_rows
+                row_group[offset:offset + rows] = rg
+                row_in_group[offset:offset + rows] = np.arange(rows)[:num_frames - offset]
+                offset += rows
+        ros_ts = np.array([f["timestamp"] for f in episode["frames"]], dtype=np.int64)
+        # статистика положений суставов за один проход по матрице (кадры x суставы)
+        pos = np.array([f["joint_state"]["pos"] for f in episode["frames"]], dtype=np.float64).reshape(num_frames, -1)
+        videos = {}
+        if use_videos:
+            videos = {key: str(dataset.meta.get_video_file_path(episode_index, key)) for key in dataset.meta.video_keys}
+
+        row = {
+            "episode_index": episode_index,
+            "bag": episode["bag"],
+            "num_frames": num_frames,
+            "duration_sec": num_frames / fps,
+            "start_ros_ts": int(ros_ts[0]) if num_frames else None,
+            "end_ros_ts": int(ros_ts[-1]) if num_frames else None,
+            "first_index": first_index,
+            "data_file": str(data_file),
+            "videos": json.dumps(videos),
+            "size_bytes": nbytes,
+            "state_min": pos.min(0).tolist() if num_frames else [],
+            "state_max": pos.max(0).tolist() if num_frames else [],
+            "state_mean": pos.mean(0).tolist() if num_frames else [],
+            "state_std": pos.std(0).tolist() if num_frames else [],
+        }
+        self._episodes[episode_index] = row
+        frames = pa.table({
+            "episode_index": np.full(num_frames, episode_index, dtype=np.int64),
+            "frame_index": np.arange(num_frames, dtype=np.int64),
+            "index": np.arange(num_frames, dtype=np.int64) + first_index,
+            "timestamp": np.arange(num_frames, dtype=np.float64) / fps,
+            "ros_timestamp": ros_ts,
+            "row_group": row_group,
+            "row_in_group": row_in_group,
+        }, metadata={"episode": json.dumps(row)})
+        # эпизод, перезаписанный после сбоя, заменяет свою часть целиком
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        part = self.parts_dir / f"episode_{episode_index:06d}.parquet"
+        tmp = part.with_name(part.name + ".tmp")
+        pq.write_table(frames, tmp)
+        tmp.replace(part)
+
+    def finish(self) -> None:
+        """Сливает части эпизодов с прежним индексом и переписывает оба файла индекса."""
+        parts = self._parts()
+        if not parts:
+            return
+        tables = [pq.read_table(part).replace_schema_metadata(None) for part in parts]
+        if (self.dataset_dir / FRAME_INDEX).is_file():
+            # кадры эпизодов, переписанных в этом запуске, берём из частей
+            rewritten = pa.array([self._episode_of(part) for part in parts], pa.int64())
+            previous = pq.read_table(self.dataset_dir / FRAME_INDEX)
+            tables.insert(0, previous.filter(pc.invert(pc.is_in(previous["episode_index"], rewritten))))
+        frames = pa.concat_tables(tables).sort_by([("episode_index", "ascending"), ("frame_index", "ascending")])
+        for name, table in ((EPISODE_INDEX, pa.Table.from_pylist(self.episodes)), (FRAME_INDEX, frames)):
+            tmp = self.dataset_dir / (name + ".tmp")
+            pq.write_table(table, tmp)
+            tmp.replace(self.dataset_dir / name)
+        shutil.rmtree(self.parts_dir)
+
+    @staticmethod
+    def _episode_of(part: Path) -> int:
+        return int(part.stem[len("episode_"):])
+
+class JointStateBuffer:
+    """Растущие numpy-массивы (timestamp, pos, vel, eff) для сообщений JointState одного эпизода."""
+
+    def __init__(self, capacity: int = 4096):
+        self.size = 0
+        self.names = None
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.pos = self.vel = self.eff = None # размер известен после первого сообщения
+
+    def append(self, timestamp: int, msg) -> None:
+        if self.names is None:
+            self.names = list(msg.name)
+            shape = (len(self.timestamps), len(self.names))
+            self.pos, self.vel, self.eff = (np.zeros(shape) for _ in range(3))
+        elif self.size == len(self.timestamps):
+            self._grow()
+
+        i = self.size
+        self.timestamps[i] = timestamp
+        # velocity/effort в JointState часто пустые — остаются нулями
+        for arr, values in ((self.pos, msg.position), (self.vel, msg.velocity), (self.eff, msg.effort)):
+            n = min(len(values), arr.shape[1])
+            arr[i, :n] = values[:n]
+        self.size += 1
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self.timestamps)
+        self.timestamps = np.resize(self.timestamps, capacity)
+        for name in ("pos", "vel", "eff"):
+            old = getattr(self, name)
+            new = np.zeros((capacity, old.shape[1]))
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def to_table(self) -> pa.Table:
+        n = self.size
+        columns = {"timestamp": pa.array(self.timestamps[:n])}
+        for name in ("pos", "vel", "eff"):
+            arr = getattr(self, name)[:n] if n else np.zeros((0, 0))
+            arr[np.isnan(arr)] = 0.0 # NaN -> 0.0
+            # JointState без имён суставов — колонок нет: список размера 0 не принимают
+            # ни FixedSizeListArray.from_arrays, ни чтение parquet
+            if arr.shape[1]:
+                columns[name] = pa.FixedSizeListArray.from_arrays(pa.array(arr.ravel()), arr.shape[1])
+        return pa.table(columns, metadata={"names": json.dumps(self.names or [])})
+
+def read_joint_states(path: Path) -> dict:
+    """Читает колонки JointState эпизода в numpy-массивы."""
+    table = pq.read_table(path)
+    n = table.num_rows
+    states = {
+        "name": json.loads(table.schema.metadata[b"names"]),
+        "timestamp": table.column("timestamp").to_numpy(),
+    }
+    for name in ("pos", "vel", "eff"):
+        if name not in table.column_names:
+            states[name] = np.zeros((n, 0))  # суставов нет
+            continue
+        values = table.column(name).combine_chunks().flatten().to_numpy()
+        states[name] = values.reshape(n, -1) if n else values.reshape(0, 0)
+    return states
+
+def nearest_indices(timestamps: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Индексы ближайших по времени элементов отсортированного *timestamps* для каждого значения *query*."""
+    if len(timestamps) == 1:
+        return np.zeros(len(query), dtype=np.int64)
+    right = np.clip(np.searchsorted(timestamps, query), 1, len(timestamps) - 1)
+    left = right - 1
+    # при равенстве расстояний берём более раннее сообщение
+    take_right = np.abs(timestamps[right] - query) < np.abs(query - timestamps[left])
+    return np.where(take_right, right, left)
+
+def decimate_indices(timestamps: np.ndarray, target_fps: float) -> np.ndarray:
+    """Индексы кадров, ближайших к равномерной сетке с шагом 1/target_fps (без повторов, без увеличения частоты)."""
+    if len(timestamps) < 2 or target_fps <= 0:
+        return np.arange(len(timestamps))
+    period = 1e9 / target_fps
+    # сетка не выходит за последний кадр: узел за ним добавил бы лишний кадр вплотную к предыдущему
+    grid = timestamps[0] + np.arange(0.0, timestamps[-1] - timestamps[0] + 1, period)
+    return np.unique(nearest_indices(timestamps, grid.astype(np.int64)))
+
+def resize_image(image: np.ndarray, resolution: Optional[Tuple[int, int]]) -> np.ndarray:
+    """Приводит кадр к разрешению (width, height); INTER_AREA — для уменьшения без муара."""
+    if resolution is None or (image.shape[1], image.shape[0]) == tuple(resolution):
+        return image
+    t0 = time.perf_counter()
+    image = cv2.resize(image, tuple(resolution), interpolation=cv2.INTER_AREA)
+    profiler.add("resize", t0)
+    return image
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    """'640x480' -> (640, 480)"""
+    try:
+        width, height = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Resolution must look like WIDTHxHEIGHT, got '{value}'")
+    return width, height
+
+def compressed_suffix(data) -> Optional[str]:
+    """Расширение файла для сжатого кадра по сигнатуре (None - формат не поддерживается как есть)."""
+    head = bytes(data[:8])
+    if head.startswith(JPEG_MAGIC):
+        return ".jpg"
+    if head.startswith(PNG_MAGIC):
+        return ".png"
+    return None # например, compressedDepth с заголовком перед PNG
+
+def decode_image(topic: str, msg) -> Optional[np.ndarray]:
+    """Декодирует сообщение камеры в RGB-массив."""
+    t0 = time.perf_counter()
+    if topic in extract_rosbag_to_json.cim_topic:
+        img_cv = extract_rosbag_to_json.bridge.compressed_imgmsg_to_cv2(msg)
+    else:
+        img_cv = extract_rosbag_to_json.bridge.imgmsg_to_cv2(msg) #, desired_encoding="passthrough")
+    profiler.add("decode", t0)
+
+    if img_cv is None:
+        return None
+    t0 = time.perf_counter()
+    if len(img_cv.shape) == 2:
+        img_cv = cv2.cvtColor(img_cv, cv2.COLOR_GRAY2RGB)
+    elif img_cv.shape[2] == 4:
+        img_cv = cv2.cvtColor(img_cv, cv2.COLOR_BGRA2RGB)
+    else:
+        img_cv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
+    profiler.add("color", t0)
+    return img_cv
+
+def add_episode(dir: Path) -> dict:
     image_shape = None
     episode = {
         "bag": str(dir.resolve()),
         "eidx": add_episode.counter,
         "num_joint_state": 0,
-        "joint_states": [],
+        "joint_states": "",
         "num_frame": 0,
         "frames": []
     }
@@ -127,56 +758,58 @@ def add_episode(dir: Path) -> None:
         camera_topics = [] # for update
         frame_index = -1
         start_topic = ""
-        num_js = 0
-        for conn, timestamp, rawdata in reader.messages():
+        joint_states = JointStateBuffer()
+        for conn, timestamp, rawdata in profiler.timed_iter("read", reader.messages()):
             topic = conn.topic
 
             if topic == extract_rosbag_to_json.joint_topic:
+                t0 = time.perf_counter()
                 msg = reader.deserialize(rawdata, conn.msgtype)
-                def clean_array(arr):
-                    return [0.0 if isinstance(v, float) and (v != v) else v for v in arr]  # NaN != NaN
-
-                num_js += 1
-                episode["joint_states"].append({
-                    "timestamp": timestamp,
-                    "joint_state": {
-                        "name": list(msg.name),
-                        "pos": clean_array(list(msg.position)),
-                        "vel": clean_array(list(msg.velocity)),
-                        "eff": clean_array(list(msg.effort)),
-                    }
-                })
+                profiler.add("deserialize", t0)
+                t0 = time.perf_counter()
+                joint_states.append(timestamp, msg)
+                profiler.add("joint_state", t0)
 
             elif topic in extract_rosbag_to_json.camera_topics:
+                t0 = time.perf_counter()
                 msg = reader.deserialize(rawdata, conn.msgtype)
+                profiler.add("deserialize", t0)
+                img_cv = None
                 try:
-                    if topic in extract_rosbag_to_json.cim_topic:
-                        img_cv = extract_rosbag_to_json.bridge.compressed_imgmsg_to_cv2(msg)
-                    else:
-                        img_cv = extract_rosbag_to_json.bridge.imgmsg_to_cv2(msg) #, desired_encoding="passthrough")
-
-                    if img_cv is None:
-                        continue
-                    elif len(img_cv.shape) == 2:
-                        img_cv = cv2.cvtColor(img_cv, cv2.COLOR_GRAY2RGB)
-                    elif img_cv.shape[2] == 4:
-                        img_cv = cv2.cvtColor(img_cv, cv2.COLOR_BGRA2RGB)
-                    else:
-                        img_cv = cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
+                    # сжатые кадры (JPEG/PNG) сохраняем как есть, без декодирования
+                    suffix = None
+                    if extract_rosbag_to_json.passthrough and topic in extract_rosbag_to_json.cim_topic:
+                        suffix = compressed_suffix(msg.data)
+                    if suffix is None:
+                        img_cv = decode_image(topic, msg)
+                        if img_cv is None:
+                            continue
+                        # кадр всё равно декодирован — уменьшаем до кодирования в PNG
+                        img_cv = resize_image(img_cv, extract_rosbag_to_json.resolution)
 
                     if frame_index < 0:
                         start_topic = topic
                     if topic == start_topic:
                         if image_shape == None:
+                            if img_cv is None:
+                                # декодируем только первый кадр, чтобы узнать размер
+                                img_cv = decode_image(topic, msg)
                             image_shape = img_cv.shape
                         frame_index += 1
 
                     camera_name = topic.lstrip('/').replace('/', '_')
-                    img_filename = f"{e_image_dir}/{camera_name}/frame_{frame_index:06d}.png"
+                    img_filename = f"{e_image_dir}/{camera_name}/frame_{frame_index:06d}{suffix or '.png'}"
                     img_path = extract_rosbag_to_json.image_dir / img_filename
                     img_path.parent.parent.mkdir(exist_ok=True)
                     img_path.parent.mkdir(exist_ok=True)
-                    Image.fromarray(img_cv).save(img_path)
+                    t0 = time.perf_counter()
+                    if suffix:
+                        img_path.write_bytes(msg.data.tobytes())
+                        profiler.add("write_raw", t0)
+                    else:
+                        Image.fromarray(img_cv).save(img_path)
+                        profiler.add("png_encode", t0)
+                    progress.frame(img_path.stat().st_size)
 
                     episode["frames"].append({
                         "timestamp": timestamp,
@@ -195,12 +828,20 @@ def add_episode(dir: Path) -> None:
             extract_rosbag_to_json.camera_topics = camera_topics
             extract_rosbag_to_json.output["cameras"] = camera_topics
 
+    js_path = extract_rosbag_to_json.image_dir / e_image_dir / JOINT_STATES
+    js_path.parent.mkdir(exist_ok=True)
+    t0 = time.perf_counter()
+    pq.write_table(joint_states.to_table(), js_path)
+    profiler.add("joint_state", t0)
+    progress.bytes_written += js_path.stat().st_size
+
     episode["num_frame"] = frame_index + 1
-    episode["num_joint_state"] = num_js
-    extract_rosbag_to_json.output["episodes"].append(episode)
+    episode["num_joint_state"] = joint_states.size
+    episode["joint_states"] = str(js_path)
     extract_rosbag_to_json.image_shape = image_shape # applies to the entire dataset
 
     add_episode.counter += 1
+    return episode
 
 def common_part_json(dir: Path) -> None:
     # common part
@@ -233,19 +874,24 @@ def common_part_json(dir: Path) -> None:
             "image_shape": [],
             "robots": [extract_rosbag_to_json.joint_topic],
             "num_episodes": 0,
-            "episodes": []
+            "episodes_file": ""
         }
         extract_rosbag_to_json.camera_topics = camera_topics
 
-def extract_rosbag_to_json(bag_path:Path, output_json:Path, synced_json_path:Path, output_image_dir:Path) -> None:
+def extract_rosbag_to_json(bag_path:Path, output_json:Path, synced_json_path:Path, output_image_dir:Path, passthrough:bool = PASSTHROUGH, skip_bags:Optional[List[str]] = None,
+                           target_fps:Optional[float] = None, resolution:Optional[Tuple[int, int]] = None) -> None:
     print("Starting the export procedure..")
 
+    extract_rosbag_to_json.passthrough = passthrough
+    extract_rosbag_to_json.target_fps = target_fps
+    extract_rosbag_to_json.resolution = resolution
+
     extract_rosbag_to_json.image_dir = output_image_dir
     extract_rosbag_to_json.image_dir.mkdir(exist_ok=True, parents=True)
 
     extract_rosbag_to_json.bridge = CvBridge()
 
-    extract_rosbag_to_json.typestore = get_typestore(Stores.ROS2_JAZZY)
+    extract_rosbag_to_json.typestore = ros_typestore()
 
     extract_rosbag_to_json.output = {}
     extract_rosbag_to_json.im_topic = []
@@ -257,16 +903,55 @@ def extract_rosbag_to_json(bag_path:Path, output_json:Path, synced_json_path:Pat
     list_bags = find_folders_with_db3_files(bag_path)
     common_part_json(list_bags[0])
     print(f"JSON common part: {extract_rosbag_to_json.output}")
-    print(f"Total episodes: {len(list_bags)}")
+    # уже сконвертированные эпизоды пропускаем
+    skip_bags = skip_bags or []
+    list_bags = [bag for bag in list_bags if str(bag.resolve()) not in skip_bags]
+    print(f"Total episodes: {len(list_bags)} (skipped: {len(skip_bags)})")
 
-    add_episode.counter = 0
+    add_episode.counter = len(skip_bags)
 
-    for bag in list_bags:
-        add_episode(bag)
-        print(f"episode {add_episode.counter}: ok")
+    # Эпизоды пишутся построчно (JSONL) сразу после обработки и в памяти не накапливаются;
+    # в *.json остаётся только заголовок со ссылкой на файл эпизодов.
+    output_episodes = output_json.with_suffix(".jsonl")
+    synced_episodes = synced_json_path.with_suffix(".jsonl")
+    synced_output = {
+        "bags": str(bag_path.resolve()),
+        "estimated_fps": 0.0,
+        "target_fps": target_fps,
+        "cameras": [],
+        "image_shape": None,
+        "robots": [extract_rosbag_to_json.joint_topic],
+        "num_episodes": len(list_bags),
+        "episodes_file": str(synced_episodes.resolve()),
+    }
+
+    progress.start_stage("extract", len(list_bags))
+    with open(output_episodes, "w") as raw_f, open(synced_episodes, "w") as synced_f:
+        for bag in list_bags:
+            episode = add_episode(bag)
+            raw_f.write(json.dumps(episode) + "\n")
+
+            # === СИНХРОНИЗАЦИЯ ЭПИЗОДА ===
+            t0 = time.perf_counter()
+            e_sync = sync_episode(episode, extract_rosbag_to_json.camera_topics, target_fps)
+            profiler.add("sync", t0)
+            synced_f.write(json.dumps(e_sync) + "\n")
+            synced_f.flush()
+
+            num_frames = e_sync["num_frames"]
+            if num_frames >= 2 and synced_output["estimated_fps"] <= 0.0:
+                t0 = e_sync["frames"][0]["timestamp"]
+                t1 = e_sync["frames"][-1]["timestamp"]
+                duration_sec = (t1 - t0) / 1e9  # наносекунды → секунды
+                fps = (num_frames - 1) / duration_sec if duration_sec > 0 else 0.0
+                synced_output["estimated_fps"] = fps
+                print(f"📈 Estimated FPS (synced): {fps:.1f}")
+            print(f"episode {add_episode.counter}: ok")
+            progress.end_episode(timings=profiler.end_episode("extract"))
 
     extract_rosbag_to_json.output["image_shape"] = extract_rosbag_to_json.image_shape
     extract_rosbag_to_json.output["num_episodes"] = len(list_bags) #add_episode.counter
+    extract_rosbag_to_json.output["episodes_file"] = str(output_episodes.resolve())
 
     with open(output_json, "w") as f:
         json.dump(extract_rosbag_to_json.output, f, indent=2)
@@ -274,63 +959,8 @@ def extract_rosbag_to_json(bag_path:Path, output_json:Path, synced_json_path:Pat
     print(f"✅ Export complete!\nJSON saved to: {output_json.resolve()}\nImages saved to: {extract_rosbag_to_json.image_dir.resolve()}")
 
     # === СОХРАНЕНИЕ СИНХРОНИЗИРОВАННОГО ВАРИАНТА ===
-    fps = 0.0
-    synced_output = {
-        "bags": str(bag_path.resolve()),
-        "estimated_fps": fps,
-        "cameras": extract_rosbag_to_json.camera_topics,
-        "image_shape": extract_rosbag_to_json.image_shape,
-        "robots": [extract_rosbag_to_json.joint_topic],
-        "num_episodes": len(list_bags),
-        "episodes": []
-    }
-    rgb_topic = extract_rosbag_to_json.camera_topics[0]
-
-    for episode in extract_rosbag_to_json.output["episodes"]:
-        e_sync = {
-            "bag": episode["bag"],
-            "eidx": episode["eidx"],
-            "num_frames": 0,
-            "frames": []
-        }
-
-        rgb_msgs = [m for m in episode["frames"] if rgb_topic in m]
-        joint_msgs = [m for m in episode["joint_states"]]
-
-        num_frames = 0
-        for im in rgb_msgs:
-            # Находим ближайшее joint_state сообщение по timestamp
-            closest = min(joint_msgs, key=lambda j: abs(j["timestamp"] - im["timestamp"]))
-
-            # Добавляем все изображения (включая rgb_topic и другие камеры)
-            cam_images = {}
-            for cam_topic in extract_rosbag_to_json.camera_topics:
-                # ищем изображение от этой камеры с таким же timestamp
-                candidates = [m for m in episode["frames"] if cam_topic in m]
-                match = min(candidates, key=lambda m: abs(m["timestamp"] - im["timestamp"])) if candidates else None
-                if match:
-                    cam_key = cam_topic
-                    cam_images[cam_key] = match[cam_topic]
-
-            e_sync["frames"].append({
-                "timestamp": im["timestamp"],
-                "idx": num_frames,
-                "joint_state": closest["joint_state"],
-                **cam_images  # добавляем все камеры
-            })
-            num_frames += 1
-
-        e_sync["num_frames"] = num_frames
-
-        if num_frames >= 2 and fps <= 0.0:
-            t0 = e_sync["frames"][0]["timestamp"]
-            t1 = e_sync["frames"][-1]["timestamp"]
-            duration_sec = (t1 - t0) / 1e9  # наносекунды → секунды
-            fps = (num_frames - 1) / duration_sec if duration_sec > 0 else 0.0
-            synced_output["estimated_fps"] = fps
-            print(f"📈 Estimated FPS (synced): {fps:.1f}")
-
-        synced_output["episodes"].append(e_sync)
+    synced_output["cameras"] = extract_rosbag_to_json.camera_topics
+    synced_output["image_shape"] = extract_rosbag_to_json.image_shape
 
     # synced_json_path = output_json.with_name(output_json.stem + SYNCED)
     with open(synced_json_path, "w") as f:
@@ -339,35 +969,145 @@ def extract_rosbag_to_json(bag_path:Path, output_json:Path, synced_json_path:Pat
     print(f"🧩 Synced JSON saved to: {synced_json_path.resolve()}")
     return #synced_json_path
 
-def main():
+def sync_episode(episode: dict, camera_topics: List[str], target_fps: Optional[float] = None) -> dict:
+    """Сопоставляет каждому кадру основной камеры (первой из *camera_topics*) ближайшие joint_state
+    и кадры остальных камер; при *target_fps* кадры основной камеры прореживаются."""
+    e_sync = {
+        "bag": episode["bag"],
+        "eidx": episode["eidx"],
+        "joint_names": [],
+        "num_frames": 0,
+        "frames": []
+    }
+    rgb_topic = camera_topics[0]
+
+    rgb_msgs = [m for m in episode["frames"] if rgb_topic in m]
+    if target_fps:
+        # прореживание по времени до целевой частоты
+        rgb_ts = np.array([m["timestamp"] for m in rgb_msgs], dtype=np.int64)
+        rgb_msgs = [rgb_msgs[i] for i in decimate_indices(rgb_ts, target_fps)]
+    joint_states = read_joint_states(Path(episode["joint_states"]))
+    if not len(joint_states["timestamp"]):
+        raise ValueError(f"No JointState messages in {episode['bag']}")
+    e_sync["joint_names"] = joint_states["name"]
+
+    # Находим ближайшие joint_state и кадры остальных камер по timestamp (векторно)
+    rgb_ts = np.array([m["timestamp"] for m in rgb_msgs], dtype=np.int64)
+    closest = nearest_indices(joint_states["timestamp"], rgb_ts)
+    cam_matches = {}
+    for cam_topic in camera_topics:
+        candidates = [m for m in episode["frames"] if cam_topic in m]
+        if candidates:
+            cam_ts = np.array([m["timestamp"] for m in candidates], dtype=np.int64)
+            cam_matches[cam_topic] = [candidates[i][cam_topic] for i in nearest_indices(cam_ts, rgb_ts)]
+
+    for num_frame, (im, j) in enumerate(zip(rgb_msgs, closest)):
+        # Добавляем все изображения (включая rgb_topic и другие камеры)
+        cam_images = {cam_key: paths[num_frame] for cam_key, paths in cam_matches.items()}
+
+        e_sync["frames"].append({
+            "timestamp": im["timestamp"],
+            "idx": num_frame,
+            "joint_state": {
+                "pos": joint_states["pos"][j].tolist(),
+                "vel": joint_states["vel"][j].tolist(),
+                "eff": joint_states["eff"][j].tolist(),
+            },
+            **cam_images  # добавляем все камеры
+        })
+
+    e_sync["num_frames"] = len(e_sync["frames"])
+    return e_sync
+
+def iter_episodes(json_file: Path):
+    """Лениво читает эпизоды из JSONL-файла, на который ссылается заголовок *json_file*."""
+    with open(json_file, "r") as f:
+        episodes_file = json.load(f)["episodes_file"]
+    with open(episodes_file, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def main(argv: Optional[List[str]] = None):
+    start_time = time.time()  # Запоминаем время начала
+
     parser = argparse.ArgumentParser(description="Convert ROS2 bag to JSON + image folder (LeRobot format)")
     parser.add_argument("bag", help="Path to folder with ROS2 bag episode files")
     parser.add_argument("--output", default="./converted_dataset", help="Directory to store dataset")
     parser.add_argument("--json", default="ros2bag_msg.json", help="Path to output JSON file")
     parser.add_argument("--images", default="frames", help="Directory to store extracted images")
-    args = parser.parse_args()
+    parser.add_argument("--videos", action="store_true", help="Store camera streams as encoded videos instead of PNG frames")
+    parser.add_argument("--vcodec", default=VCODEC, help="ffmpeg video codec for --videos")
+    parser.add_argument("--crf", type=int, default=CRF, help="Constant rate factor for --videos")
+    parser.add_argument("--gop", type=int, default=GOP, help="Keyframe interval (GOP size) for --videos")
+    parser.add_argument("--target-fps", type=float, default=None, help="Decimate frames by timestamp down to this rate")
+    parser.add_argument("--resolution", type=parse_resolution, default=None, help="Resize camera frames to WIDTHxHEIGHT")
+    parser.add_argument("--append", action="store_true", help="Append new bags to an already converted dataset instead of starting over")
+    parser.add_argument("--progress", default="", help="JSONL file for machine-readable progress events")
+    parser.add_argument("--sample-profile", default="", help="Enable the sampling profiler and write folded stacks to this file")
+    parser.add_argument("--decode-compressed", action="store_true", help="Re-encode CompressedImage frames to PNG instead of storing original bytes")
+    args = parser.parse_args(argv)
+    progress.open(Path(args.progress) if args.progress else None)
+    profiler.reset()
 
     bag = Path(args.bag)
     if not bag.is_dir():
         print(f"[!] {args.bag} is not a folder")
-        sys.exit()
-
-    dataset_dir = Path(args.output)
-    x = 0
-    while dataset_dir.is_dir():
-        dataset_dir = Path(args.output + str(x))
-        x += 1
-    if x:
-        Path(args.output).rename(dataset_dir)
-        # print(f"[✔] Конвертация пропущена: данные уже существуют в '{dataset_dir}'")
+        sys.exit(1)
+
+    # незавершённую конвертацию продолжаем, завершённую дополняем только с --append
+    checkpoint = load_checkpoint(Path(args.output))
+    params = dataset_params(args.target_fps, args.resolution, args.videos, args.vcodec, args.crf, args.gop)
+    if checkpoint is not None and checkpoint.get("params", params) != params:
+        # дописать эпизоды с другими параметрами нельзя — проверяем до извлечения, а не после
+        if args.append:
+            print(f"[!] Cannot append: '{args.output}' was converted with {checkpoint['params']}, requested {params}")
+            progress.emit("error", message="conversion parameters differ from the existing dataset")
+            sys.exit(1)
+        print(f"Conversion parameters changed, starting over: was {checkpoint['params']}, requested {params}")
+        checkpoint = None
+    if checkpoint is not None and (args.append or not checkpoint["complete"]):
+        skip_bags = checkpoint["episodes"]
+        pending = [b for b in find_folders_with_db3_files(bag) if str(b.resolve()) not in skip_bags]
+        if not pending:
+            # прошлый запуск мог прерваться после последнего эпизода, не успев слить индекс
+            FrameIndex(Path(args.output)).finish()
+            print(f"[✔] Nothing to convert: all {len(skip_bags)} episodes are already in '{args.output}'")
+            progress.emit("done")
+            return
+        print(f"Resuming conversion: {len(skip_bags)} episodes done, {len(pending)} pending")
+    else:
+        skip_bags = []
+        dataset_dir = Path(args.output)
+        x = 0
+        while dataset_dir.is_dir():
+            dataset_dir = Path(args.output + str(x))
+            x += 1
+        if x:
+            Path(args.output).rename(dataset_dir)
+            # print(f"[✔] Конвертация пропущена: данные уже существуют в '{dataset_dir}'")
 
     out_json = Path(args.json)
     synced = out_json.with_name(out_json.stem + SYNCED)
     frames = Path(args.images)
 
-    extract_rosbag_to_json(bag, out_json, synced, frames)
-
-    to_lerobot_dataset(synced, args.output)
+    sampler = SamplingProfiler() if args.sample_profile else None
+    if sampler:
+        sampler.start()
+    try:
+        extract_rosbag_to_json(bag, out_json, synced, frames, passthrough=not args.decode_compressed, skip_bags=skip_bags,
+                               target_fps=args.target_fps, resolution=args.resolution)
+
+        to_lerobot_dataset(synced, args.output, use_videos=args.videos, vcodec=args.vcodec, crf=args.crf, gop=args.gop,
+                           resolution=args.resolution)
+    except Exception as e:
+        progress.emit("error", message=str(e), profile=profiler.summary())
+        raise
+    finally:
+        if sampler:
+            sampler.stop(Path(args.sample_profile))
+        profiler.print_summary()
+    progress.emit("done", profile=profiler.summary())
 
     end_time = time.time()  # время окончания
     execution_time = end_time - start_time
@@ -1,13 +1,16 @@
-import asyncio, datetime as dt, os, shutil, subprocess, uuid
+import asyncio, datetime as dt, os, shutil, subprocess, time, uuid
 from pathlib import Path
 from typing import Dict, Literal, Optional
 
 import requests
 from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.responses import Response
 from pydantic import BaseModel, Field
 
+from rbs_server.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, DURATION_BUCKETS, HttpMetrics, HttpMetricsMiddleware, Registry
+
 # ─────────────────── Константы центрального сервера ───────────────────
-DATA_SERVER   = "http://msi.lan:8000"
+DATA_SERVER   = os.environ.get("RBS_DATA_SERVER", "http://msi.lan:8000")
 LIST_URL      = f"{DATA_SERVER}/list"      # GET  → {"files": ["rbs_ros2bag", ...]}
 DOWNLOAD_URL  = f"{DATA_SERVER}/download"  # GET dataset files
 UPLOAD_WEIGHTS_URL = f"{DATA_SERVER}/upload-weights"
@@ -15,8 +18,6 @@ UPLOAD_WEIGHTS_URL = f"{DATA_SERVER}/upload-weights"
 # ────────────────── Локальные директории GPU‑узла ─────────────────────
 DATA_DIR = Path("data")   # <datasets>/<dataset_name>/…
 JOBS_DIR = Path("jobs")       # <jobs>/<job_id>/{output,train.log,model.tar.gz}
-DATA_DIR.mkdir(exist_ok=True)
-JOBS_DIR.mkdir(exist_ok=True)
 
 # ──────────────────────── Pydantic‑модели ─────────────────────────────
 class TrainRequest(BaseModel):
@@ -41,6 +42,21 @@ JOBS: Dict[str, JobStatus] = {}
 # ──────────────────────────── FastAPI app ────────────────────────────
 app = FastAPI(title="GPU Training Orchestrator")
 
+# ───────────────────────────── Метрики ─────────────────────────────
+metrics = Registry()
+app.add_middleware(HttpMetricsMiddleware, metrics=HttpMetrics(metrics))
+JOB_STATES = ("pending", "running", "finished", "failed")
+GPU_JOBS = metrics.gauge("gpu_jobs", "Training jobs by state", ("state",))
+GPU_JOBS.set_function(lambda: {(s,): sum(j.state == s for j in JOBS.values()) for s in JOB_STATES})
+DOWNLOAD_SECONDS = metrics.histogram("gpu_dataset_download_seconds", "Dataset download time per job", buckets=DURATION_BUCKETS)
+DOWNLOADED_BYTES = metrics.counter("gpu_downloaded_bytes_total", "Dataset bytes downloaded from the data server")
+TRAINING_SECONDS = metrics.histogram("gpu_training_duration_seconds", "Training run time", ("state",), DURATION_BUCKETS)
+
+@app.on_event("startup")
+def init_dirs():
+    DATA_DIR.mkdir(exist_ok=True)
+    JOBS_DIR.mkdir(exist_ok=True)
+
 # ──────────────────────── Вспомогательные функции ────────────────────
 def _update_job(job_id: str, **kw):
     job = JOBS[job_id]
@@ -56,9 +72,12 @@ def download_dataset(relative_path: Path):
     try:
         response = requests.get(DOWNLOAD_URL, params={"filename": str(relative_path)}, stream=True)
         response.raise_for_status()
+        size = 0
         with open(save_path, "wb") as f:
             for chunk in response.iter_content(chunk_size=8192):
                 f.write(chunk)
+                size += len(chunk)
+        DOWNLOADED_BYTES.inc(size)
         print(f"✅ Сохранено: {save_path}")
     except Exception as e:
         print(f"❌ Ошибка загрузки {relative_path}: {str(e)}")
@@ -99,8 +118,9 @@ async def run_training(files: list[Path], job_id: str, req: TrainRequest):
         if not local_ds.exists():
             _update_job(job_id, message="Скачиваем датасет…")
             write_log("Downloading dataset")
-            for file_path in files:
-                download_dataset(req.dataset_name + "/" + file_path)
+            with DOWNLOAD_SECONDS.time():
+                for file_path in files:
+                    download_dataset(req.dataset_name + "/" + file_path)
 
         # 2. Команда обучения
         cmd = [
@@ -119,6 +139,7 @@ async def run_training(files: list[Path], job_id: str, req: TrainRequest):
 
         # 3. Запуск
         _update_job(job_id, state="running", message="Запущено обучение")
+        started = time.perf_counter()
         proc = await asyncio.create_subprocess_exec(
             *cmd,
             stdout=asyncio.subprocess.PIPE,
@@ -136,6 +157,7 @@ async def run_training(files: list[Path], job_id: str, req: TrainRequest):
                     pass
 
         rc = await proc.wait()
+        TRAINING_SECONDS.observe(time.perf_counter() - started, "finished" if rc == 0 else "failed")
         if rc != 0:
             raise RuntimeError(f"Процесс вернул код {rc}")
 
@@ -190,5 +212,9 @@ def log(job_id: str, lines: int = 50):
     if not lp.exists(): raise HTTPException(404, "Лог ещё не создан")
     return {"log_tail": "".join(lp.read_text().splitlines()[-lines:])}
 
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/")
 def root(): return {"message": "GPU сервер доступен"}
@@ -1,7 +1,7 @@
 """
 web_client.py — Streamlit‑клиент без зависимостей от pandas/numpy.
 Работает с вашим FastAPI‑сервером: загружает файлы по одному, показывает
-/preview и /list простыми таблицами.
+/preview (Arrow-таблицы, pyarrow идёт вместе со streamlit) и /list.
 """
 
 from io import BytesIO
@@ -14,6 +14,8 @@ from rbs_client.web_utils import (
     _safe_rerun,
     upload_directory,
     fetch_preview,
+    fetch_conversions,
+    fetch_contact_sheet,
 )
 
 API_URL = "http://msi.lan:8000"  # меняйте при необходимости
@@ -110,6 +112,33 @@ def main():
         else:
             st.info("Список весов пуст")
 
+        st.subheader("Превью эпизода")
+        sheet_ds = st.text_input("Датасет", key="sheet_ds", placeholder="dataset_name")
+        sheet_ep = st.number_input("Эпизод", min_value=0, step=1, key="sheet_ep")
+        if sheet_ds and st.button("Показать кадры"):
+            sheet = fetch_contact_sheet(sheet_ds, int(sheet_ep), api_url=API_URL)
+            if sheet:
+                st.image(sheet, use_container_width=True)
+
+        st.subheader("Конвертации")
+        jobs = [j for j in fetch_conversions(API_URL) if j["state"] in ("queued", "running")]
+        if not jobs:
+            st.info("Нет активных конвертаций")
+        for job in jobs:
+            prog = job.get("progress")
+            if job["state"] == "queued":
+                st.write(f"{job['dataset_name']}: в очереди, позиция {job['queue_position']}")
+            elif prog and prog.get("percent") is not None:
+                eta = prog.get("eta_sec")
+                eta_text = f", осталось ~{int(eta)} с" if eta is not None else ""
+                st.progress(
+                    prog["percent"] / 100,
+                    text=f"{job['dataset_name']}: {prog['stage']} {prog['episode']}/{prog['num_episodes']}, "
+                    f"{prog['fps']:.0f} кадр/с{eta_text}",
+                )
+            else:
+                st.write(f"{job['dataset_name']}: запуск…")
+
         st.button("Обновить", on_click=_safe_rerun)
 
 
@@ -1,6 +1,7 @@
 from io import BytesIO
 from pathlib import Path
 
+import pyarrow as pa
 import requests
 import streamlit as st
 
@@ -45,16 +46,49 @@ def upload_directory(dir_path: Path, api_url: str = API_URL):
 
 
 def fetch_preview(file: str, limit: int, api_url: str = API_URL):
-    """Return /preview data as a list of dicts or None on error."""
+    """Return /preview data as a pyarrow Table (Arrow IPC stream) or None on error."""
     try:
-        resp = requests.get(f"{api_url}/preview", params={"file": file, "limit": limit})
+        resp = requests.get(f"{api_url}/preview", params={"file": file, "limit": limit, "format": "arrow"})
         resp.raise_for_status()
-        return resp.json()
+        return pa.ipc.open_stream(resp.content).read_all()
     except Exception as exc:
         st.error(f"Ошибка /preview {file}: {exc}")
         return None
 
 
+def fetch_conversions(api_url: str = API_URL):
+    """Return conversion jobs from /conversions with their latest progress."""
+    try:
+        resp = requests.get(f"{api_url}/conversions")
+        resp.raise_for_status()
+        jobs = resp.json().get("jobs", [])
+        for job in jobs:
+            if job["state"] == "running":
+                prog = requests.get(
+                    f"{api_url}/conversion-progress/", params={"dataset_name": job["dataset_name"]}
+                )
+                prog.raise_for_status()
+                job["progress"] = prog.json().get("progress")
+        return jobs
+    except Exception as exc:
+        st.error(f"Ошибка /conversions: {exc}")
+        return []
+
+
+def fetch_contact_sheet(dataset_name: str, episode: int, count: int = 16, api_url: str = API_URL):
+    """Return JPEG bytes of an episode contact sheet or None on error."""
+    try:
+        resp = requests.get(
+            f"{api_url}/contact-sheet/",
+            params={"dataset_name": dataset_name, "episode": episode, "count": count},
+        )
+        resp.raise_for_status()
+        return resp.content
+    except Exception as exc:
+        st.error(f"Ошибка /contact-sheet/: {exc}")
+        return None
+
+
 def list_uploaded(api_url: str = API_URL):
     """Return a list of uploaded files from the server."""
     try:
@@ -1,26 +1,51 @@
 import os
+import json
+import time
+import asyncio
+import functools
 import shutil
-import sys
-import subprocess
 import shlex
+import uuid
 import datetime
 import threading
-import time
-import errno
-import signal
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
 from enum import Enum
 from pathlib import Path
 
-import duckdb
-import pandas as pd
-import pyarrow as pa
-import pyarrow.parquet as pq
 from pydantic import BaseModel
-from fastapi import FastAPI, Query, HTTPException, File, UploadFile, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Query, HTTPException, File, UploadFile, Form, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+
+from rbs_server.scheduler import ConversionJob, ConversionScheduler, JobState, SubprocessRunner
+from rbs_server.coordination import SharedStore
+from rbs_server.workers import WarmWorkerPool
+from rbs_server.progress import last_event, stream_events, with_eta
+from rbs_server.variants import VariantStore, source_hash, variant_key
+from rbs_server import cache_gc
+from rbs_server import frame_index
+from rbs_server.analytics import Analytics, read_catalog_file
+from rbs_server import query_stream
+from rbs_server.sandbox import QueryBusy, QueryGuard, QueryRejected, check_read_only
+from rbs_server.query_cache import QueryCache, file_generation, is_cacheable, referenced_files
+from rbs_server.thumbnails import ThumbnailCache, contact_sheet, sample_frames, thumbnail
+from rbs_server.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, DURATION_BUCKETS, HttpMetrics, HttpMetricsMiddleware, Registry
+from rbs_server.lazy import lazy_import
+
+# Тяжёлые библиотеки загружаются при первом использовании: /health отвечает сразу после старта процесса
+duckdb = lazy_import("duckdb")
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
 
 app = FastAPI()
+# Метрики Prometheus (/metrics); у каждого процесса uvicorn — свои
+metrics = Registry()
+app.add_middleware(HttpMetricsMiddleware, metrics=HttpMetrics(metrics))
+CATALOG_WRITE_SECONDS = metrics.histogram("rbs_catalog_write_seconds", "Catalog parquet rewrite latency", ("file",))
+CONVERSION_WAIT_SECONDS = metrics.histogram("rbs_conversion_wait_seconds", "Time conversions spend queued", buckets=DURATION_BUCKETS)
+CONVERSION_SECONDS = metrics.histogram("rbs_conversion_duration_seconds", "Conversion run time", ("state",), DURATION_BUCKETS)
+CONVERSION_JOBS = metrics.gauge("rbs_conversion_jobs", "Active conversion jobs (all server processes)", ("state",))
 
 # Папка с файлами БД - .parquet
 DIR_DATA = "data"
@@ -29,88 +54,328 @@ DIR_CACHE = "cache"
 # Пути к parquet-файлам
 DATASET_FILE = DIR_DATA + "/datasets.parquet"
 WEIGHTS_FILE = DIR_DATA + "/weights.parquet"
+# Индекс эпизодов сконвертированных датасетов (заполняется после конвертации)
+EPISODES_FILE = DIR_DATA + "/episodes.parquet"
+# Общее состояние процессов сервера (блокировки, аренды, очередь конвертаций); при нескольких
+# машинах — каталог на общем диске с поддержкой flock
+DIR_STATE = os.environ.get("RBS_STATE_DIR", DIR_DATA + "/_state")
+# Срок аренды задачи конвертации (продлевается каждые 1/3 срока) и сессии загрузки файла
+CONVERSION_LEASE_SEC = float(os.environ.get("RBS_CONVERSION_LEASE_SEC", "60"))
+UPLOAD_LEASE_SEC = float(os.environ.get("RBS_UPLOAD_LEASE_SEC", "300"))
+# Сколько конвертаций может выполняться одновременно (во всех процессах сервера)
+MAX_CONVERSIONS = int(os.environ.get("RBS_MAX_CONVERSIONS", "2"))
+# Конвертация в прогретых процессах (без повторного импорта lerobot/torch на каждую задачу)
+WARM_WORKERS = os.environ.get("RBS_WARM_WORKERS", "1") == "1"
+# Сколько прогретых воркеров каждый процесс сервера держит между задачами. Воркеры
+# создаются, когда процесс забрал задачу; при uvicorn --workers N простаивающих
+# воркеров не больше N * RBS_WARM_WORKERS_IDLE, работающих — не больше RBS_MAX_CONVERSIONS
+WARM_WORKERS_IDLE = int(os.environ.get("RBS_WARM_WORKERS_IDLE", "1"))
+# После скольких задач процесс-воркер перезапускается
+WORKER_MAX_JOBS = int(os.environ.get("RBS_WORKER_MAX_JOBS", "20"))
+CONVERSION_SCRIPT = Path("convert_rosbag_to_lerobot.py").resolve()
+# Сэмплирующий профайлер конвертера (folded stacks рядом с логом)
+SAMPLE_PROFILE = os.environ.get("RBS_SAMPLE_PROFILE", "0") == "1"
+# Производные варианты датасетов (разные fps/разрешение/формат) — data/variants/<key>
+DIR_VARIANTS = DIR_DATA + "/variants"
+VARIANTS_BUDGET = int(float(os.environ.get("RBS_VARIANTS_BUDGET_GB", "50")) * 2**30)
+# Запомненные хэши файлов бэгов, чтобы не перечитывать их при каждом запросе варианта
+SOURCE_HASHES_FILE = DIR_CACHE + "/source_hashes.json"
+# Представления DuckDB над данными сконвертированных датасетов (ссылки в Hive-разметке)
+DIR_VIEWS = DIR_DATA + "/_views"
+# Ограничения общего соединения DuckDB для /query, чтобы тяжёлый запрос не съел весь сервер
+DUCKDB_THREADS = int(os.environ.get("RBS_DUCKDB_THREADS", "4"))
+DUCKDB_MEMORY_LIMIT = os.environ.get("RBS_DUCKDB_MEMORY_LIMIT", "2GB")
+# Ограничения /query: тайм-аут, число одновременных запросов, строк в ответе, доступные каталоги
+QUERY_TIMEOUT = float(os.environ.get("RBS_QUERY_TIMEOUT", "30"))
+QUERY_CONCURRENCY = int(os.environ.get("RBS_QUERY_CONCURRENCY", "2"))
+QUERY_QUEUE_TIMEOUT = float(os.environ.get("RBS_QUERY_QUEUE_TIMEOUT", "2"))
+QUERY_MAX_ROWS = int(os.environ.get("RBS_QUERY_MAX_ROWS", "1000000"))
+QUERY_ALLOWED_DIRS = [d for d in os.environ.get("RBS_QUERY_ALLOWED_DIRS", DIR_DATA).split(os.pathsep) if d]
+# Кэш результатов /query и /preview в памяти
+QUERY_CACHE_MB = float(os.environ.get("RBS_QUERY_CACHE_MB", "256"))
+QUERY_CACHE_ENTRY_MB = float(os.environ.get("RBS_QUERY_CACHE_ENTRY_MB", "16"))
+# Превью кадров и контактные листы (свой LRU-бюджет, сборщик мусора cache/ их не трогает)
+DIR_THUMBNAILS = DIR_CACHE + "/thumbnails"
+THUMBNAILS_BUDGET = int(float(os.environ.get("RBS_THUMBNAILS_BUDGET_MB", "512")) * 2**20)
+# Сколько браузер/прокси может не перепроверять превью
+THUMBNAILS_MAX_AGE = int(os.environ.get("RBS_THUMBNAILS_MAX_AGE", "3600"))
+# Пул потоков для блокирующей работы async-эндпоинтов (каталог parquet, запись загрузок),
+# чтобы она не останавливала цикл событий
+BLOCKING_WORKERS = int(os.environ.get("RBS_BLOCKING_WORKERS", "8"))
+# Размер блока при записи загруженного файла на диск
+UPLOAD_CHUNK = 4 * 2**20
+# Сборка мусора в cache/: сроки хранения по классам (дни, < 0 — хранить всегда) и общий бюджет
+GC_RETENTION_DAYS = {
+    cache_gc.LOGS: float(os.environ.get("RBS_GC_LOGS_DAYS", "14")),
+    cache_gc.INTERMEDIATE: float(os.environ.get("RBS_GC_INTERMEDIATE_DAYS", "1")),
+    cache_gc.ORPHAN: float(os.environ.get("RBS_GC_ORPHAN_DAYS", "7")),
+    cache_gc.RAW: float(os.environ.get("RBS_GC_RAW_DAYS", "-1")),
+}
+GC_BUDGET = int(float(os.environ.get("RBS_CACHE_BUDGET_GB", "200")) * 2**30)
+# Период фоновой сборки мусора, минуты (0 — только по запросу)
+GC_INTERVAL_MIN = float(os.environ.get("RBS_GC_INTERVAL_MIN", "60"))
 
 class DatasetStatus(str, Enum):
     CREATING = "creating"
     SAVE = "save"
+    QUEUED = "queued" # ждёт в очереди конвертации
     CONVERSION = "conversion"
     STORE = "store"
     AT_WORK = "at work" # is weights
 
-if not os.path.exists(DATASET_FILE):
-    # Опишем схему
-    schema = pa.schema([
-        # ("id", pa.int32()),
-        ("name", pa.string()),
-        ("num_episodes", pa.int32()),
-        ("src_format", pa.string()),
-        ("work_format", pa.string()),
-        ("status", pa.string())
-    ])
-    # Создаем пустую таблицу с заданной схемой
-    table = pa.Table.from_pandas(pd.DataFrame(columns=schema.names), schema=schema)
-    # Сохраняем таблицу в файл .parquet
-    pq.write_table(table, DATASET_FILE)
-
-if not os.path.exists(WEIGHTS_FILE):
-    schema = pa.schema([
-        # ("id", pa.int32()),
-        ("name", pa.string()),
-        ("dataset", pa.string()),
-        ("steps", pa.int32())
-    ])
-    table = pa.Table.from_pandas(pd.DataFrame(columns=schema.names), schema=schema)
-    pq.write_table(table, WEIGHTS_FILE)
-
-# Простой helper для проверки, жив ли процесс (работает на Unix/Windows)
-def is_process_alive(pid: int) -> bool:
-    try:
-        if pid <= 0:
-            return False
-        # На Unix: посылаем 0 сигнал
-        os.kill(pid, 0)
-    except OSError as e:
-        if e.errno in (errno.ESRCH,):  # No such process
+shared_store = SharedStore(Path(DIR_STATE))
+# Чтение-изменение-запись файлов каталога из разных потоков и процессов выполняем под блокировкой
+CATALOG_LOCK = shared_store.lock("catalog")
+
+def write_catalog(df: "pd.DataFrame", path: str) -> None:
+    """Атомарная запись parquet-файла каталога: читатели не увидят недописанный файл."""
+    tmp_path = path + ".tmp"
+    with CATALOG_WRITE_SECONDS.time(os.path.basename(path)):
+        df.to_parquet(tmp_path, index=False, engine="pyarrow")
+        os.replace(tmp_path, path)
+
+@app.on_event("startup")
+def init_catalog() -> None:
+    """Создаёт пустые файлы каталога (один раз на все процессы сервера)."""
+    os.makedirs(DIR_DATA, exist_ok=True)
+    with CATALOG_LOCK:
+        if not os.path.exists(DATASET_FILE):
+            # Опишем схему
+            schema = pa.schema([
+                # ("id", pa.int32()),
+                ("name", pa.string()),
+                ("num_episodes", pa.int32()),
+                ("src_format", pa.string()),
+                ("work_format", pa.string()),
+                ("status", pa.string()),
+                # статистика сконвертированного датасета (meta/rbs_stats.json)
+                ("num_frames", pa.int64()),
+                ("duration_sec", pa.float64()),
+                ("size_bytes", pa.int64()),
+                ("fps", pa.float64()),
+                ("num_joints", pa.int32()),
+                ("num_cameras", pa.int32()),
+                ("state_min", pa.list_(pa.float64())),
+                ("state_max", pa.list_(pa.float64())),
+            ])
+            # Создаем пустую таблицу с заданной схемой
+            table = schema.empty_table()
+            # Сохраняем таблицу в файл .parquet (атомарно, как write_catalog)
+            pq.write_table(table, DATASET_FILE + ".tmp")
+            os.replace(DATASET_FILE + ".tmp", DATASET_FILE)
+
+        if not os.path.exists(WEIGHTS_FILE):
+            schema = pa.schema([
+                # ("id", pa.int32()),
+                ("name", pa.string()),
+                ("dataset", pa.string()),
+                ("steps", pa.int32())
+            ])
+            table = schema.empty_table()
+            pq.write_table(table, WEIGHTS_FILE + ".tmp")
+            os.replace(WEIGHTS_FILE + ".tmp", WEIGHTS_FILE)
+
+blocking_pool = ThreadPoolExecutor(BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполняет блокирующую *func* в blocking_pool, не занимая цикл событий."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_pool, functools.partial(func, *args, **kwargs))
+
+def set_dataset_status(dataset_name: str, status: DatasetStatus) -> bool:
+    """Обновляет статус датасета в каталоге; False, если датасет не найден."""
+    with CATALOG_LOCK:
+        df = pd.read_parquet(DATASET_FILE)
+        mask = df["name"] == dataset_name
+        if not mask.any():
             return False
-        if e.errno in (errno.EPERM,):  # Нет прав, но процесс есть
-            return True
+        df.loc[mask, "status"] = status
+        write_catalog(df, DATASET_FILE)
+    return True
+
+def register_episodes(dataset_name: str) -> int:
+    """Переносит индекс эпизодов датасета (meta/rbs_episodes.parquet) в каталог EPISODES_FILE."""
+    ds_path = Path(DIR_DATA) / dataset_name
+    if not frame_index.has_index(ds_path):
+        return 0
+    episodes = pd.DataFrame(frame_index.read_episodes(ds_path))
+    episodes.insert(0, "dataset", dataset_name)
+    with CATALOG_LOCK:
+        if os.path.exists(EPISODES_FILE):
+            existing = pd.read_parquet(EPISODES_FILE)
+            episodes = pd.concat([existing[existing["dataset"] != dataset_name], episodes], ignore_index=True)
+        write_catalog(episodes, EPISODES_FILE)
+    return len(episodes)
+
+# Поля meta/rbs_stats.json, которые попадают в datasets.parquet
+STATS_COLUMNS = ("num_episodes", "num_frames", "duration_sec", "size_bytes", "fps", "num_joints", "state_min", "state_max")
+# Целочисленные колонки каталога (nullable — у несконвертированных датасетов статистики нет)
+STATS_INT_DTYPES = {"num_episodes": "Int32", "num_frames": "Int64", "size_bytes": "Int64", "num_joints": "Int32", "num_cameras": "Int32"}
+
+def register_dataset_stats(dataset_name: str) -> bool:
+    """Переносит сводную статистику сконвертированного датасета в каталог DATASET_FILE."""
+    stats_file = Path(DIR_DATA) / dataset_name / "meta" / "rbs_stats.json"
+    if not stats_file.is_file():
         return False
+    with open(stats_file) as f:
+        stats = json.load(f)
+    stats["num_cameras"] = len(stats.get("cameras", []))
+    with CATALOG_LOCK:
+        df = pd.read_parquet(DATASET_FILE)
+        mask = df["name"] == dataset_name
+        if not mask.any():
+            return False
+        row = df.index[mask][0]
+        for col in STATS_COLUMNS + ("num_cameras",):
+            if col not in df.columns:
+                df[col] = None  # каталог, созданный до появления статистики
+            if isinstance(stats.get(col), list):
+                df[col] = df[col].astype(object)
+            df.at[row, col] = stats.get(col)
+        write_catalog(df.astype(STATS_INT_DTYPES), DATASET_FILE)
+    return True
+
+def link_catalog_views() -> None:
+    """Раскладывает ссылки data/_views для всех сохранённых датасетов (перед подключением DuckDB)."""
+    with VIEWS_LOCK:
+        catalog = read_catalog_file(DATASET_FILE, columns=["name"], filters=[("status", "==", DatasetStatus.STORE.value)])
+        for name in catalog.column("name").to_pylist():
+            analytics.link_dataset(name, Path(DIR_DATA) / name)
+
+variant_store = VariantStore(Path(DIR_VARIANTS), VARIANTS_BUDGET, shared_store.lock("variants"))
+analytics = Analytics(Path(DIR_VIEWS), DUCKDB_THREADS, DUCKDB_MEMORY_LIMIT,
+                      {"datasets": DATASET_FILE, "weights": WEIGHTS_FILE, "episodes": EPISODES_FILE},
+                      QUERY_ALLOWED_DIRS, prepare=link_catalog_views)
+query_guard = QueryGuard(QUERY_CONCURRENCY, QUERY_TIMEOUT, QUERY_QUEUE_TIMEOUT)
+query_cache = QueryCache(int(QUERY_CACHE_MB * 2**20), int(QUERY_CACHE_ENTRY_MB * 2**20))
+thumbnail_cache = ThumbnailCache(Path(DIR_THUMBNAILS), THUMBNAILS_BUDGET)
+
+def job_seconds(start: Optional[str], end: Optional[str]) -> Optional[float]:
+    if not start or not end:
+        return None
+    return (datetime.datetime.fromisoformat(end) - datetime.datetime.fromisoformat(start)).total_seconds()
+
+def on_conversion_start(job: ConversionJob) -> None:
+    wait = job_seconds(job.submitted_at, job.started_at)
+    if wait is not None:
+        CONVERSION_WAIT_SECONDS.observe(wait)
+    if job.variant:
+        return  # вариант не меняет статус исходного датасета
+    set_dataset_status(job.dataset_name, DatasetStatus.CONVERSION)
+
+def on_conversion_finish(job: ConversionJob) -> None:
+    """Обновляет статус после завершения (или отмены) конвертации."""
+    duration = job_seconds(job.started_at, job.finished_at)
+    if duration is not None:
+        CONVERSION_SECONDS.observe(duration, job.state)
+    event = last_event(job.progress_file) if job.progress_file else None
+    if event:
+        job.profile = event.get("profile")
+    if job.variant:
+        if job.state == JobState.FINISHED:
+            variant_store.register(job.variant["key"], job.variant["source"], job.params, job.variant["dataset"])
+        else:
+            with open(job.log_file, "ab") as lf:
+                lf.write(f"\n[!] Variant conversion {job.state} (exit code {job.returncode})\n".encode("utf-8"))
+    elif job.state == JobState.FINISHED:
+        register_episodes(job.dataset_name)
+        register_dataset_stats(job.dataset_name)
+        with VIEWS_LOCK:
+            analytics.link_dataset(job.dataset_name, Path(DIR_DATA) / job.dataset_name)
+        set_dataset_status(job.dataset_name, DatasetStatus.STORE)
     else:
-        return True
-
-def monitor_conversion(dataset_name: str, pid: int, log_file: Path, pid_file: Path, process: subprocess.Popen): #, dataset_mask_func):
-    """Ждёт завершения процесса и обновляет статус."""
-    try:
-        retcode = process.wait()
-        # Читаем текущий df, обновляем статус в зависимости от результата
+        set_dataset_status(job.dataset_name, DatasetStatus.SAVE)  # откатываем
+        with open(job.log_file, "ab") as lf:
+            lf.write(f"\n[!] Conversion {job.state} (exit code {job.returncode})\n".encode("utf-8"))
+
+if WARM_WORKERS:
+    conversion_runner = WarmWorkerPool(min(WARM_WORKERS_IDLE, MAX_CONVERSIONS), CONVERSION_SCRIPT, WORKER_MAX_JOBS)
+else:
+    conversion_runner = SubprocessRunner(CONVERSION_SCRIPT)
+conversion_scheduler = ConversionScheduler(MAX_CONVERSIONS, conversion_runner, shared_store,
+                                           on_start=on_conversion_start, on_finish=on_conversion_finish,
+                                           lease_ttl=CONVERSION_LEASE_SEC)
+
+def active_conversion_counts() -> dict:
+    counts = {(JobState.QUEUED,): 0, (JobState.RUNNING,): 0}
+    for job in conversion_scheduler.jobs():
+        if (job["state"],) in counts:
+            counts[(job["state"],)] += 1
+    return counts
+
+CONVERSION_JOBS.set_function(active_conversion_counts)
+
+GC_LOCK = shared_store.lock("cache-gc")
+# Ссылки data/_views перестраивает один процесс за раз
+VIEWS_LOCK = shared_store.lock("views")
+
+def active_conversion_paths() -> list:
+    """Пути (без расширений) исходников, промежуточных файлов и логов queued/running задач."""
+    paths = []
+    for job in conversion_scheduler.jobs():
+        if job["state"] not in (JobState.QUEUED, JobState.RUNNING):
+            continue
+        argv = conversion_scheduler.get(job["dataset_name"]).argv
+        paths.append(Path(argv[0]))
+        for flag in ("--json", "--images"):
+            if flag in argv:
+                paths.append(Path(argv[argv.index(flag) + 1]).with_suffix(""))
+        paths.append(Path(job["conversion_log"]).with_suffix(""))
+    return paths
+
+def collect_cache_garbage(dry_run: bool = True) -> dict:
+    with GC_LOCK:
+        with CATALOG_LOCK:
+            catalog = pd.read_parquet(DATASET_FILE)
+        datasets = set(catalog["name"])
+        # бэги датасетов, которые ещё загружаются или ждут (до)конвертации, не трогаем
+        pinned = set(catalog.loc[catalog["status"] != DatasetStatus.STORE, "name"])
+        artifacts = cache_gc.scan(Path(DIR_CACHE), datasets)
+        victims = cache_gc.plan(artifacts, GC_RETENTION_DAYS, GC_BUDGET, active_conversion_paths(), pinned)
+        result = cache_gc.report(artifacts, victims, GC_BUDGET)
+        result["dry_run"] = dry_run
+        if not dry_run:
+            result["freed_bytes"] = cache_gc.delete(victims)
+            cache_gc.prune_hash_memo(Path(SOURCE_HASHES_FILE))
+            if victims:
+                print(f"[gc] removed {len(victims)} artifacts from {DIR_CACHE}, freed {result['freed_bytes']} bytes")
+    return result
+
+def cache_gc_loop():
+    while True:
+        time.sleep(GC_INTERVAL_MIN * 60)
+        # периодическую сборку выполняет один процесс сервера за период; аренду не отпускаем
+        if shared_store.acquire("cache-gc", GC_INTERVAL_MIN * 60 * 0.9) is None:
+            continue
         try:
-            df = pd.read_parquet(DATASET_FILE)
-            mask = df["name"] == dataset_name #dataset_mask_func(df)
-            if not mask.any():
-                # Не нашли — странно, оставляем как есть
-                return
-            if retcode == 0:
-                df.loc[mask, "status"] = DatasetStatus.STORE
-            else:
-                df.loc[mask, "status"] = DatasetStatus.SAVE  # откатываем
-                with open(log_file, "ab") as lf:
-                    lf.write(f"\n[!] Conversion exited with code {retcode}\n".encode("utf-8"))
-            # Пишем обратно
-            df.to_parquet(DATASET_FILE, index=False, engine="pyarrow")
+            shared_store.prune_leases()
+            collect_cache_garbage(dry_run=False)
         except Exception as e:
-            with open(log_file, "ab") as lf:
-                lf.write(f"\n[!] Failed to update status after conversion: {e}\n".encode("utf-8"))
-    finally:
-        # Удаляем pid-файл, потому что конвертация завершена
-        try:
-            if pid_file.exists():
-                pid_file.unlink()
-        except Exception:
-            pass
+            print(f"[gc] failed: {e}")
 
-def get_dataset_info(name: str) -> dict:
-    df = duckdb.query(f"SELECT * FROM '{DATASET_FILE}' WHERE name = '{name}'").to_df()
-    return df.to_dict(orient="records")
+def df_records(df: "pd.DataFrame") -> list:
+    """Строки DataFrame в JSON-совместимом виде (списки вместо numpy-массивов, None вместо NaN)."""
+    return json.loads(df.to_json(orient="records"))
+
+def get_dataset_info(name: str) -> list:
+    # фильтр в pyarrow: потокобезопасно (в отличие от общего соединения duckdb.query) и без подстановки имени в SQL
+    df = read_catalog_file(DATASET_FILE, filters=[("name", "==", name)]).to_pandas()
+    return df_records(df)
+
+def warm_up_analytics():
+    try:
+        analytics.connect()
+    except Exception as e:
+        print(f"[analytics] warm-up failed: {e}")  # следующий запрос попробует подключиться снова
+
+@app.on_event("startup")
+def start_conversion_workers():
+    # воркеры пула конвертации создаются при первой задаче этого процесса, а не здесь
+    conversion_scheduler.start()
+    # ссылки и соединение DuckDB готовятся в фоне; аналитические запросы до готовности ждут в analytics.cursor()
+    threading.Thread(target=warm_up_analytics, daemon=True, name="analytics").start()
+    if GC_INTERVAL_MIN > 0:
+        threading.Thread(target=cache_gc_loop, daemon=True, name="cache_gc").start()
 
 @app.get("/")
 def root():
@@ -120,207 +385,479 @@ def root():
 def health():
     return {"status": "ok"}
 
+@app.get("/metrics")
+def get_metrics():
+    """Метрики в текстовом формате Prometheus (этого процесса сервера)."""
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.post("/create-dataset/")
 async def create_dataset(dataset_name: str):
-    # Проверим на повтор
-    ds_info = get_dataset_info(dataset_name)
-    if ds_info:
-        raise HTTPException(status_code=500, detail=f"Repeat name '{dataset_name}'")
+    await run_blocking(add_dataset_record, dataset_name)
+    return {"message": f"Dataset '{dataset_name}' added successfully"}
 
-    # Открываем соединение с DuckDB
-    con = duckdb.connect()
+def add_dataset_record(dataset_name: str) -> None:
+    """Добавляет датасет в каталог (в blocking_pool)."""
+    new_d = {
+        # "id": cid,
+        "name": dataset_name,
+        "num_episodes": 0,
+        "src_format": "rosbag",
+        "work_format": "lerobot",
+        "status": DatasetStatus.CREATING,
+        "num_frames": 0,
+        "duration_sec": 0.0,
+        "size_bytes": 0,
+    }
+    # Добавляем новую запись в DATASET_FILE
+    new_df = pd.DataFrame([new_d])
 
     try:
-        # Начинаем транзакцию
-        con.execute("BEGIN;")
-
-        new_d = {
-            # "id": cid,
-            "name": dataset_name,
-            "num_episodes": 0,
-            "src_format": "rosbag",
-            "work_format": "lerobot",
-            "status": DatasetStatus.CREATING
-        }
-        # Добавляем новую запись в DATASET_FILE
-        new_df = pd.DataFrame([new_d])
-
-        # Читаем существующий файл, если он существует
-        try:
-            existing_df = pd.read_parquet(DATASET_FILE)
+        with CATALOG_LOCK:
+            # Проверим на повтор под блокировкой: два одновременных запроса не создадут дубль
+            try:
+                existing_df = pd.read_parquet(DATASET_FILE)
+            except FileNotFoundError:
+                # Если файл не существует, просто используем новый DataFrame
+                existing_df = None
+            if existing_df is not None and (existing_df["name"] == dataset_name).any():
+                raise HTTPException(status_code=500, detail=f"Repeat name '{dataset_name}'")
             # Объединяем существующий DataFrame с новым
-            combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-        except FileNotFoundError:
-            # Если файл не существует, просто используем новый DataFrame
-            combined_df = new_df
+            combined_df = new_df if existing_df is None else pd.concat([existing_df, new_df], ignore_index=True)
 
-        # Сохраняем объединенный DataFrame обратно в файл
-        combined_df.to_parquet(DATASET_FILE, index=False, engine='pyarrow')
-
-        # Завершаем транзакцию
-        con.execute("COMMIT;")
+            # Сохраняем объединенный DataFrame обратно в файл (атомарно)
+            write_catalog(combined_df, DATASET_FILE)
         # !!! Будет создана при конвертации в lerobot
         # # Создадим папку датасета
         # ds_path.mkdir()
+    except HTTPException:
+        raise
     except Exception as e:
-        # В случае ошибки откатываем транзакцию
-        con.execute("ROLLBACK;")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        con.close()
 
-    return {"message": f"Dataset '{dataset_name}' added successfully"}
-
-def conversion_dataset(dataset_name:str):
-    # Дедупликация: если уже есть PID и процесс жив — отклоняем
-    log_dir = Path(DIR_CACHE)
-    log_dir.mkdir(parents=True, exist_ok=True)
-    pid_file = log_dir / f"convert_{dataset_name}.pid"
-
-    if pid_file.exists():
-        try:
-            existing_pid = int(pid_file.read_text().strip())
-            if is_process_alive(existing_pid):
-                raise HTTPException(
-                    status_code=409,
-                    detail=f"Conversion already in progress for dataset '{dataset_name}' (pid={existing_pid})"
-                )
-            else:
-                # Старая запись мёртвая — очищаем
-                pid_file.unlink()
-        except ValueError:
-            # битый файл — удалим
-            try:
-                pid_file.unlink()
-            except Exception:
-                pass
+def conversion_params(target_fps: Optional[float] = None, width: Optional[int] = None,
+                      height: Optional[int] = None, videos: bool = False) -> dict:
+    """Канонический набор параметров конвертации (прореживание, разрешение, видео)."""
+    if (width is None) != (height is None):
+        raise HTTPException(status_code=400, detail="Both width and height must be set to resize frames")
+    if target_fps is not None and target_fps <= 0:
+        raise HTTPException(status_code=400, detail="target_fps must be positive")
+    if width is not None and (width <= 0 or height <= 0):
+        raise HTTPException(status_code=400, detail="width and height must be positive")
+    return {
+        "target_fps": float(target_fps) if target_fps else None,
+        "resolution": [width, height] if width is not None else None,
+        "videos": bool(videos),
+    }
 
-    # Установим статус на CONVERSION
+def params_argv(params: dict) -> List[str]:
+    argv = []
+    if params.get("target_fps"):
+        argv += ["--target-fps", str(params["target_fps"])]
+    if params.get("resolution"):
+        argv += ["--resolution", "{}x{}".format(*params["resolution"])]
+    if params.get("videos"):
+        argv += ["--videos"]
+    return argv
+
+def params_match(output_dir: Path, params: dict) -> bool:
+    """
+    Совпадают ли *params* с параметрами, с которыми уже сконвертирован датасет в
+    *output_dir* (meta/rbs_conversion.json конвертера). Нет датасета — совпадают.
+    """
     try:
-        df = pd.read_parquet(DATASET_FILE)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        with open(output_dir / "meta" / "rbs_conversion.json", "r") as f:
+            stored = json.load(f).get("params")
+    except (OSError, ValueError):
+        return True
+    if stored is None:
+        return True
+    return ((stored.get("target_fps"), stored.get("resolution"), bool(stored.get("use_videos")))
+            == (params.get("target_fps"), params.get("resolution"), bool(params.get("videos"))))
+
+def conversion_dataset(dataset_name:str, priority:int = 0, params:Optional[dict] = None):
+    params = params or conversion_params()
+    # Дедупликация: на датасет допускается одна задача в очереди или в работе
+    if conversion_scheduler.is_active(dataset_name):
+        job = conversion_scheduler.get(dataset_name)
+        raise HTTPException(
+            status_code=409,
+            detail=f"Conversion already {job.state} for dataset '{dataset_name}'"
+        )
 
-    mask = df["name"] == dataset_name
-    if not mask.any():
-        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' metadata not found")
+    if not CONVERSION_SCRIPT.exists():
+        raise HTTPException(status_code=500, detail=f"Conversion script not found at {CONVERSION_SCRIPT}")
 
+    # Установим статус на QUEUED
     try:
-        df.loc[mask, "status"] = DatasetStatus.CONVERSION
-        df.to_parquet(DATASET_FILE, index=False, engine="pyarrow")
+        found = set_dataset_status(dataset_name, DatasetStatus.QUEUED)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update status metadata: {e}")
+    if not found:
+        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' metadata not found")
+
+    job = submit_conversion(dataset_name, Path(DIR_CACHE) / dataset_name, Path(DIR_DATA) / dataset_name,
+                            dataset_name, priority, params)
+    return {
+        "message": f"Dataset '{dataset_name}' conversion queued",
+        "conversion_log": str(job.log_file),
+        "queue_position": conversion_scheduler.position(dataset_name),
+    }
 
-    # Подготовка логов и запуск
+def submit_conversion(job_name: str, src_dir: Path, output_dir: Path, work_name: str, priority: int,
+                      params: dict, variant: Optional[dict] = None) -> ConversionJob:
+    """Формирует аргументы конвертера и ставит задачу в очередь (409, если такая уже активна)."""
+    # Подготовка логов и постановка в очередь
+    log_dir = Path(DIR_CACHE)
+    log_dir.mkdir(parents=True, exist_ok=True)
     # timestamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
     timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-    log_file = log_dir / f"convert_{dataset_name}_{timestamp}.log"
-
-    script_path = Path("convert_rosbag_to_lerobot.py").resolve()
-    if not script_path.exists():
-        # откатываем статус
-        try:
-            df = pd.read_parquet(DATASET_FILE)
-            df.loc[df["name"] == dataset_name, "status"] = DatasetStatus.SAVE
-            df.to_parquet(DATASET_FILE, index=False, engine="pyarrow")
-        except Exception:
-            pass
-        raise HTTPException(status_code=500, detail=f"Conversion script not found at {script_path}")
+    log_file = log_dir / f"convert_{work_name}_{timestamp}.log"
+    progress_file = log_dir / f"convert_{work_name}_{timestamp}.progress.jsonl"
 
     # Формируем аргументы
-    json_out = (Path(DIR_CACHE) / f"{dataset_name}_msg.json").resolve()
-    images_out = (Path(DIR_CACHE) / f"{dataset_name}_frames").resolve()
-    cmd = [
-        sys.executable,
-        str(script_path),
-        str(Path(DIR_CACHE) / dataset_name),
-        "--output", str(Path(DIR_DATA) / dataset_name),
+    json_out = (Path(DIR_CACHE) / f"{work_name}_msg.json").resolve()
+    images_out = (Path(DIR_CACHE) / f"{work_name}_frames").resolve()
+    argv = [
+        str(src_dir),
+        "--output", str(output_dir),
         "--json", str(json_out),
         "--images", str(images_out),
-    ]
+        "--progress", str(progress_file),
+    ] + params_argv(params)
+    if params_match(output_dir, params):
+        # продолжить прерванную конвертацию / дописать новые эпизоды
+        argv.append("--append")
+    # иначе конвертер начнёт заново, отложив старый датасет в сторону: дописать с другими параметрами нельзя
+    if SAMPLE_PROFILE:
+        argv += ["--sample-profile", str(log_dir / f"convert_{work_name}_{timestamp}.folded")]
 
     try:
-        with open(log_file, "wb") as lf:
-            process = subprocess.Popen(
-                cmd,
-                stdout=lf,
-                stderr=subprocess.STDOUT,
-                start_new_session=True
-            )
-        # Записываем PID
-        pid_file.write_text(str(process.pid))
-
-        # # Запускаем мониторящий поток
-        # def dataset_mask_func(df_inner):
-        #     return df_inner["name"] == dataset_name
-
-        monitor_thread = threading.Thread(
-            target=monitor_conversion,
-            args=(dataset_name, process.pid, log_file, pid_file, process), # dataset_mask_func),
-            daemon=True,
-            name=f"monitor_conv_{dataset_name}"
-        )
-        monitor_thread.start()
+        # под блокировкой GC: сборщик не удалит бэги, на которые только что поставлена задача
+        with GC_LOCK:
+            return conversion_scheduler.submit(ConversionJob(job_name, argv, log_file, priority, progress_file, params, variant))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    except Exception as e:
-        # Откат статуса
+@app.post("/save-dataset/")
+async def save_dataset(dataset_name: str, priority: int = 0, target_fps: Optional[float] = None,
+                       width: Optional[int] = None, height: Optional[int] = None, videos: bool = False):
+    """Finalize dataset creation by updating its status."""
+    params = conversion_params(target_fps, width, height, videos)
+    return await run_blocking(finalize_dataset, dataset_name, priority, params)
+
+def finalize_dataset(dataset_name: str, priority: int, params: dict) -> dict:
+    # Проверка статуса и смена на SAVE — под блокировкой каталога, как и открытие сессии загрузки
+    with CATALOG_LOCK:
+        # Проверим на наличие
+        ds_info = get_dataset_info(dataset_name)
+        if not ds_info:
+            raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not created")
+        ds_status = ds_info[0]["status"]
+        if not ds_status == DatasetStatus.CREATING:
+            raise HTTPException(status_code=500, detail=f"Датасет '{dataset_name}' имеет статус '{ds_status}'")
+        uploads = shared_store.leases(f"upload/{dataset_name}/")
+        if uploads:
+            raise HTTPException(status_code=409, detail=f"{len(uploads)} uploads to dataset '{dataset_name}' are still in progress")
+
+        # Обновляем статус датасета
         try:
-            df = pd.read_parquet(DATASET_FILE)
-            df.loc[df["name"] == dataset_name, "status"] = DatasetStatus.SAVE
-            df.to_parquet(DATASET_FILE, index=False, engine="pyarrow")
-        except Exception:
-            pass
-        raise HTTPException(status_code=500, detail=f"Failed to start conversion: {e}")
+            found = set_dataset_status(dataset_name, DatasetStatus.SAVE)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to update status metadata: {e}")
+        if not found:
+            raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' metadata not found")
 
-    return {
-        "message": f"Dataset '{dataset_name}' conversion started in background",
-        "conversion_log": str(log_file),
-        "conversion_pid_file": str(pid_file),
-        "pid": process.pid,
-    }
+    return conversion_dataset(dataset_name, priority, params)
 
-@app.post("/save-dataset/")
-async def save_dataset(dataset_name: str):
-    """Finalize dataset creation by updating its status."""
-    ds_path = Path(DIR_DATA) / dataset_name
+@app.post("/convert-dataset/")
+async def convert_dataset(dataset_name: str, priority: int = 0, target_fps: Optional[float] = None,
+                          width: Optional[int] = None, height: Optional[int] = None, videos: bool = False):
+    params = conversion_params(target_fps, width, height, videos)
+    return await run_blocking(convert_saved_dataset, dataset_name, priority, params)
 
+def convert_saved_dataset(dataset_name: str, priority: int, params: dict) -> dict:
     # Проверим на наличие
     ds_info = get_dataset_info(dataset_name)
     if not ds_info:
         raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not created")
     ds_status = ds_info[0]["status"]
-    if not ds_status == DatasetStatus.CREATING:
-        raise HTTPException(status_code=500, detail=f"Датасет '{dataset_name}' имеет статус '{ds_status}'")
+    if not ds_status == DatasetStatus.SAVE:
+        raise HTTPException(status_code=500, detail=f"Dataset '{dataset_name}' is '{ds_status}'")
 
-    # Обновляем статус датасета
-    try:
-        df = pd.read_parquet(DATASET_FILE)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return conversion_dataset(dataset_name, priority, params)
+
+@app.post("/cancel-conversion/")
+def cancel_conversion(dataset_name: str):
+    job = conversion_scheduler.cancel(dataset_name)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No queued or running conversion for dataset '{dataset_name}'")
+    return {"message": f"Conversion of dataset '{dataset_name}' cancelled", "job": job.to_dict()}
+
+@app.get("/conversions")
+def list_conversions():
+    return {"max_workers": conversion_scheduler.max_workers, "jobs": conversion_scheduler.jobs()}
+
+@app.get("/conversion-progress/")
+def conversion_progress(dataset_name: str):
+    """Последнее событие прогресса конвертации с процентом выполнения и ETA."""
+    job = conversion_scheduler.get(dataset_name)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No conversion for dataset '{dataset_name}'")
+    event = last_event(job.progress_file) if job.progress_file else None
+    return {
+        "state": job.state,
+        "queue_position": conversion_scheduler.position(dataset_name),
+        "progress": with_eta(event) if event else None,
+    }
 
-    mask = df["name"] == dataset_name
-    if not mask.any():
-        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' metadata not found")
+@app.get("/conversion-events/")
+def conversion_events(dataset_name: str):
+    """Поток событий прогресса (text/event-stream) до завершения конвертации."""
+    job = conversion_scheduler.get(dataset_name)
+    if job is None or job.progress_file is None:
+        raise HTTPException(status_code=404, detail=f"No conversion for dataset '{dataset_name}'")
+    return StreamingResponse(
+        stream_events(job.progress_file, lambda: conversion_scheduler.is_active(dataset_name)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+@app.get("/dataset-status/")
+def dataset_status(dataset_name: str):
+    """Статус датасета из каталога вместе с состоянием задачи конвертации и позицией в очереди."""
+    ds_info = get_dataset_info(dataset_name)
+    if not ds_info:
+        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not created")
+    job = conversion_scheduler.get(dataset_name)
+    return {
+        **ds_info[0],
+        "conversion": job.to_dict() if job else None,
+        "queue_position": conversion_scheduler.position(dataset_name),
+    }
+
+@app.post("/reopen-dataset/")
+async def reopen_dataset(dataset_name: str):
+    """Reopen a stored dataset for uploading new bags; /save-dataset/ then converts only the new episodes."""
+    return await run_blocking(reopen_dataset_record, dataset_name)
+
+def reopen_dataset_record(dataset_name: str) -> dict:
+    ds_info = get_dataset_info(dataset_name)
+    if not ds_info:
+        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not created")
+    ds_status = ds_info[0]["status"]
+    if not ds_status in (DatasetStatus.STORE, DatasetStatus.SAVE):
+        raise HTTPException(status_code=500, detail=f"Dataset '{dataset_name}' is '{ds_status}'")
 
     try:
-        df.loc[mask, "status"] = DatasetStatus.SAVE
-        df.to_parquet(DATASET_FILE, index=False, engine="pyarrow")
+        set_dataset_status(dataset_name, DatasetStatus.CREATING)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update status metadata: {e}")
 
-    return conversion_dataset(dataset_name)
+    return {"message": f"Dataset '{dataset_name}' reopened for upload"}
 
-@app.post("/convert-dataset/")
-async def convert_dataset(dataset_name: str):
-    # Проверим на наличие
+@app.post("/dataset-variant/")
+def dataset_variant(dataset_name: str, priority: int = 0, target_fps: Optional[float] = None,
+                    width: Optional[int] = None, height: Optional[int] = None, videos: bool = False):
+    """
+    Вариант датасета с заданными параметрами конвертации. Уже готовый вариант (те же бэги и
+    параметры, в том числе от другого датасета) возвращается сразу, иначе ставится конвертация.
+    """
+    params = conversion_params(target_fps, width, height, videos)
     ds_info = get_dataset_info(dataset_name)
     if not ds_info:
         raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not created")
-    ds_status = ds_info[0]["status"]
-    if not ds_status == DatasetStatus.SAVE:
-        raise HTTPException(status_code=500, detail=f"Dataset '{dataset_name}' is '{ds_status}'")
+    if ds_info[0]["status"] == DatasetStatus.CREATING:
+        raise HTTPException(status_code=500, detail=f"Dataset '{dataset_name}' is still uploading")
+    src_dir = Path(DIR_CACHE) / dataset_name
+    if not src_dir.is_dir():
+        raise HTTPException(status_code=404, detail=f"Source bags of dataset '{dataset_name}' not found")
+
+    source = source_hash(src_dir, Path(SOURCE_HASHES_FILE))
+    key = variant_key(source, params)
+    path = str(Path("variants") / key)  # относительно DIR_DATA, для /list и /download
+    entry = variant_store.get(key)
+    if entry is not None:
+        return {"cached": True, "key": key, "path": path, "variant": entry}
+
+    job_name = f"variant-{key}"
+    job = conversion_scheduler.get(job_name)
+    if job is None or not conversion_scheduler.is_active(job_name):
+        # промежуточные файлы — в cache/<dataset>_<key>_*
+        job = submit_conversion(job_name, src_dir, variant_store.path(key), f"{dataset_name}_{key}", priority, params,
+                                {"key": key, "source": source, "dataset": dataset_name})
+    return {
+        "cached": False,
+        "key": key,
+        "path": path,
+        "job": job_name,  # для /conversion-progress/ и /conversion-events/
+        "conversion_log": str(job.log_file),
+        "queue_position": conversion_scheduler.position(job_name),
+    }
 
-    return conversion_dataset(dataset_name)
+@app.get("/dataset-variants/")
+def dataset_variants():
+    entries = variant_store.entries()
+    return {
+        "budget_bytes": variant_store.budget_bytes,
+        "used_bytes": sum(e.get("size", 0) for e in entries),
+        "variants": sorted(entries, key=lambda e: e.get("last_access", 0), reverse=True),
+    }
+
+@app.get("/cache-gc/")
+def cache_gc_report():
+    """Отчёт без удаления: что и почему удалит сборка мусора в cache/."""
+    return collect_cache_garbage(dry_run=True)
+
+@app.post("/cache-gc/")
+def cache_gc_run(dry_run: bool = False):
+    return collect_cache_garbage(dry_run=dry_run)
+
+def indexed_dataset(dataset_name: str) -> Path:
+    ds_path = Path(DIR_DATA) / dataset_name
+    if not get_dataset_info(dataset_name):
+        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' not created")
+    if not frame_index.has_index(ds_path):
+        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_name}' has no frame index, convert it first")
+    return ds_path
+
+def indexed_episode(ds_path: Path, episode: int) -> dict:
+    ep = frame_index.get_episode(ds_path, episode)
+    if ep is None:
+        raise HTTPException(status_code=404, detail=f"Episode {episode} not found")
+    return ep
+
+@app.get("/episodes/")
+def list_episodes(dataset_name: Optional[str] = None, min_duration: Optional[float] = None, max_duration: Optional[float] = None):
+    """Эпизоды из каталога с фильтром по датасету и длительности (сек)."""
+    if not os.path.exists(EPISODES_FILE):
+        return []
+    # фильтр в pyarrow, как в get_dataset_info: общее соединение duckdb по умолчанию не потокобезопасно
+    filters = [(column, op, value) for column, op, value in
+               (("dataset", "==", dataset_name), ("duration_sec", ">=", min_duration), ("duration_sec", "<=", max_duration))
+               if value is not None]
+    table = read_catalog_file(EPISODES_FILE, filters=filters or None)
+    return df_records(table.sort_by([("dataset", "ascending"), ("episode_index", "ascending")]).to_pandas())
+
+@app.get("/frame-index/")
+def get_frame_index(dataset_name: str, episode: int, start: int = 0, stop: Optional[int] = None):
+    """Строки индекса кадров эпизода: время ROS, глобальный index, row group в parquet."""
+    ds_path = indexed_dataset(dataset_name)
+    ep = indexed_episode(ds_path, episode)
+    return {"episode": ep, "cameras": frame_index.cameras(ds_path), "frames": frame_index.read_frames(ds_path, episode, start, stop)}
+
+@app.get("/frame/")
+def get_frame(dataset_name: str, episode: int, frame: int, camera: Optional[str] = None, format: str = "png"):
+    """Один кадр камеры; читается только его row group (или ближайший ключевой кадр видео)."""
+    if format not in frame_index.MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{format}'")
+    ds_path = indexed_dataset(dataset_name)
+    cams = frame_index.cameras(ds_path)
+    camera = camera or cams[0]
+    if camera not in cams:
+        raise HTTPException(status_code=404, detail=f"Camera '{camera}' not found, available: {cams}")
+    ep = indexed_episode(ds_path, episode)
+    rows = frame_index.read_frames(ds_path, episode, frame, frame + 1)
+    if not rows:
+        raise HTTPException(status_code=404, detail=f"Frame {frame} not found in episode {episode}")
+    raw, image = frame_index.read_frame(ds_path, ep, rows[0], camera)
+    if raw is None or format != "png":
+        # PNG из parquet отдаём как есть, иначе (пере)кодируем
+        raw = frame_index.encode(image if image is not None else frame_index.decode(raw), format)
+    return Response(content=raw, media_type=frame_index.MEDIA_TYPES[format])
+
+@app.get("/joint-states/")
+def get_joint_states(dataset_name: str, episode: int, start: int = 0, stop: Optional[int] = None):
+    """Срез observation.state/action эпизода по номерам кадров [start, stop)."""
+    ds_path = indexed_dataset(dataset_name)
+    ep = indexed_episode(ds_path, episode)
+    rows = frame_index.read_frames(ds_path, episode, start, stop)
+    return frame_index.read_state_slice(ds_path, ep, rows)
+
+def cached_image(request: Request, key: str, fmt: str, render) -> Response:
+    """Картинка из кэша превью (или *render()* с сохранением) с ETag/Cache-Control; 304 при совпадении ETag."""
+    etag = f'"{key}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={THUMBNAILS_MAX_AGE}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    data = thumbnail_cache.get(key, fmt)
+    if data is None:
+        data = frame_index.encode(render(), fmt, quality=80)
+        thumbnail_cache.put(key, fmt, data)
+    return Response(content=data, media_type=frame_index.MEDIA_TYPES[fmt], headers=headers)
+
+def index_version(ds_path: Path) -> int:
+    # индекс перезаписывается при каждой (до)конвертации — ключ кэша меняется вместе с данными
+    return (ds_path / frame_index.FRAME_INDEX).stat().st_mtime_ns
+
+def preview_camera(ds_path: Path, camera: Optional[str], fmt: str) -> str:
+    if fmt not in frame_index.MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{fmt}'")
+    cams = frame_index.cameras(ds_path)
+    if camera is not None and camera not in cams:
+        raise HTTPException(status_code=404, detail=f"Camera '{camera}' not found, available: {cams}")
+    return camera or cams[0]
+
+@app.get("/thumbnail/")
+def get_thumbnail(request: Request, dataset_name: str, episode: int, frame: int = 0, camera: Optional[str] = None,
+                  width: int = Query(160, ge=16, le=1024), format: str = "jpeg"):
+    """Уменьшенный кадр эпизода."""
+    ds_path = indexed_dataset(dataset_name)
+    camera = preview_camera(ds_path, camera, format)
+    key = ThumbnailCache.key("thumb", dataset_name, index_version(ds_path), episode, frame, camera, width)
+    ep = indexed_episode(ds_path, episode)
+    rows = frame_index.read_frames(ds_path, episode, frame, frame + 1)
+    if not rows:
+        raise HTTPException(status_code=404, detail=f"Frame {frame} not found in episode {episode}")
+    return cached_image(request, key, format, lambda: thumbnail(ds_path, ep, rows[0], camera, width))
+
+@app.get("/contact-sheet/")
+def get_contact_sheet(request: Request, dataset_name: str, episode: int, start: int = 0, stop: Optional[int] = None,
+                      count: int = Query(16, ge=1, le=100), cols: int = Query(4, ge=1, le=20),
+                      camera: Optional[str] = None, width: int = Query(160, ge=16, le=512), format: str = "jpeg"):
+    """Контактный лист: *count* равномерно выбранных кадров из [start, stop) сеткой по *cols* в ряд."""
+    ds_path = indexed_dataset(dataset_name)
+    camera = preview_camera(ds_path, camera, format)
+    ep = indexed_episode(ds_path, episode)
+    stop = ep["num_frames"] if stop is None else min(stop, ep["num_frames"])
+    wanted = sample_frames(start, stop, count)
+    if not wanted:
+        raise HTTPException(status_code=404, detail=f"No frames in [{start}, {stop}) of episode {episode}")
+    key = ThumbnailCache.key("sheet", dataset_name, index_version(ds_path), episode, camera, width, cols, *wanted)
+
+    def render():
+        rows = frame_index.read_frames(ds_path, episode, wanted[0], wanted[-1] + 1)
+        frames = [r for r in rows if r["frame_index"] in set(wanted)]
+        return contact_sheet(ds_path, ep, frames, camera, width, cols)
+    return cached_image(request, key, format, render)
+
+@app.get("/thumbnail-cache/")
+def thumbnail_cache_stats():
+    return thumbnail_cache.stats()
+
+def open_upload_session(dataset_name: str):
+    """
+    Сессия загрузки файла — аренда upload/<датасет>/<id>: пока она действует,
+    /save-dataset/ (в любом процессе сервера) не переведёт датасет в SAVE.
+    """
+    with CATALOG_LOCK:
+        ds_info = get_dataset_info(dataset_name)
+        if not ds_info:
+            raise HTTPException(status_code=404, detail=f"Датасет '{dataset_name}' не создан")
+        if not ds_info[0]["status"] == DatasetStatus.CREATING:
+            raise HTTPException(status_code=405, detail=f"Датасет '{dataset_name}' уже сохранён")
+        return ds_info, shared_store.acquire(f"upload/{dataset_name}/{uuid.uuid4().hex}", UPLOAD_LEASE_SEC)
+
+def save_upload(file: UploadFile, dest_path: Path) -> None:
+    """
+    Копирует загруженный файл (уже принятый во временный файл Starlette) блоками,
+    не читая его целиком в память; на место файл встаёт атомарно.
+    """
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dest_path.with_name(dest_path.name + ".part")
+    file.file.seek(0)
+    with open(tmp_path, "wb") as f:
+        shutil.copyfileobj(file.file, f, UPLOAD_CHUNK)
+    os.replace(tmp_path, dest_path)
 
 def safe_relative_path(rel_path: str) -> Path:
     """
@@ -337,29 +874,24 @@ async def upload_rel(
     relative_path: str = Form(...),
     file: UploadFile = File(...)
 ):
-    ds_info = get_dataset_info(dataset_name)
-    if not ds_info:
-        raise HTTPException(status_code=404, detail=f"Датасет '{dataset_name}' не создан")
-    if not ds_info[0]["status"] == DatasetStatus.CREATING:
-        raise HTTPException(status_code=405, detail=f"Датасет '{dataset_name}' уже сохранён")
-
-    print(f"{ds_info=}")
     try:
         relp = safe_relative_path(relative_path)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    ds_info, session = await run_blocking(open_upload_session, dataset_name)
+    print(f"{ds_info=}")
+
     dataset_path = Path(DIR_CACHE) / dataset_name
     dest_path = dataset_path / relp
-    dest_path.parent.mkdir(parents=True, exist_ok=True)
 
     try:
         # Сохраняем файл
-        with open(dest_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        await run_blocking(save_upload, file, dest_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка сохранения файла: {e}")
+    finally:
+        await run_blocking(shared_store.release, session)
 
     return JSONResponse({"status": "ok", "saved_to": str(dest_path)})
 
@@ -378,12 +910,9 @@ async def upload_weights(
 
     weights_root = Path(DIR_DATA) / "weights" / weights_name
     dest_path = weights_root / relp
-    dest_path.parent.mkdir(parents=True, exist_ok=True)
 
     try:
-        with open(dest_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        await run_blocking(save_upload, file, dest_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка сохранения файла: {e}")
 
@@ -415,25 +944,120 @@ async def upload_weights(
 #     except Exception as e:
 #         raise HTTPException(status_code=500, detail=f"Failed to upload: {e}")
 
-@app.get("/preview")
-def preview(file:str = "file_ids", limit: int = 10):
-    table = DIR_DATA + "/" + file + ".parquet"
-    try:
-        df = duckdb.query(f"SELECT * FROM '{table}' LIMIT {limit}").to_df()
-        return df.to_dict(orient="records")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse, вызывающий *on_close* при любом исходе отправки, в том числе при отключении клиента."""
 
+    def __init__(self, content, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
 
-@app.get("/query")
-def run_query(sql: str = Query(..., description="SQL-запрос к parquet-файлу")):
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+def query_response(request: Request, sql: str, format: Optional[str], limit: Optional[int],
+                   cursor: Optional[str], batch_size: int) -> StreamingResponse:
+    """
+    Результат запроса потоком: Arrow IPC, NDJSON или JSON-массив (?format= или Accept).
+    Ответ не длиннее QUERY_MAX_ROWS строк; в заголовке X-Next-Cursor — курсор следующей
+    страницы, страница короче limit — последняя.
+    """
+    try:
+        is_select = check_read_only(sql)
+        fmt = query_stream.negotiate(format, request.headers.get("accept"))
+        if is_select:
+            page_sql, next_cursor = query_stream.paginate(sql, min(limit or QUERY_MAX_ROWS, QUERY_MAX_ROWS), cursor)
+        else:
+            page_sql, next_cursor = sql, None  # EXPLAIN
+    except (QueryRejected, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    cacheable = is_cacheable(page_sql)
+    if cacheable:
+        key = QueryCache.key(page_sql, data_generation(page_sql))
+        etag = f'"{key}-{fmt}"'
+        if request.headers.get("if-none-match") == etag:
+            query_cache.not_modified += 1
+            return Response(status_code=304, headers={**headers, "ETag": etag, "Cache-Control": "no-cache"})
+        table = query_cache.get(key)
+        if table is not None:
+            return StreamingResponse(query_stream.stream(table.to_reader(batch_size), fmt),
+                                     media_type=query_stream.MEDIA_TYPES[fmt],
+                                     headers={**headers, "ETag": etag, "Cache-Control": "no-cache", "X-Cache": "hit"})
+    else:
+        query_cache.uncacheable += 1
+
+    cur = analytics.cursor()
+    try:
+        # слот и сторожевой таймер держатся до конца передачи ответа
+        release = query_guard.start(cur)
+    except QueryBusy as e:
+        cur.close()
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    closed = threading.Lock()
+
+    def close():
+        # вызывается из finally генератора и после отправки ответа (клиент мог отключиться
+        # до начала передачи, и тогда генератор не запустится) — срабатывает один раз
+        if not closed.acquire(blocking=False):
+            return
+        release()
+        cur.close()
     try:
-        if "drop" in sql.lower() or "delete" in sql.lower():
-            raise HTTPException(status_code=400, detail="Модифицирующие запросы запрещены.")
-        df = duckdb.query(sql).to_df()
-        return df.to_dict(orient="records")
+        reader = query_stream.open_reader(cur, page_sql, batch_size)
+    except duckdb.InterruptException:
+        close()
+        raise HTTPException(status_code=504, detail=f"Query exceeded {query_guard.timeout:g} s")
     except Exception as e:
+        close()
         raise HTTPException(status_code=400, detail=str(e))
+    if cacheable:
+        reader = query_cache.capture(key, reader)
+        headers.update({"ETag": etag, "Cache-Control": "no-cache"})
+    return ClosingStreamingResponse(query_stream.stream(reader, fmt, close), close, media_type=query_stream.MEDIA_TYPES[fmt],
+                                    headers=headers)
+
+def data_generation(sql: str) -> tuple:
+    """Состояние данных, от которых зависит результат: файлы каталога, файлы из запроса, ссылки frames."""
+    return (file_generation([DATASET_FILE, WEIGHTS_FILE, EPISODES_FILE] + referenced_files(sql)), analytics.generation)
+
+@app.get("/preview")
+def preview(request: Request, file:str = "file_ids", limit: int = 10, format: Optional[str] = None):
+    table = DIR_DATA + "/" + file + ".parquet"
+    if not os.path.isfile(table):
+        raise HTTPException(status_code=500, detail=f"Table '{file}' not found")
+    return query_response(request, f"SELECT * FROM '{table}' LIMIT {int(limit)}", format, None, None, query_stream.BATCH_SIZE)
+
+
+@app.get("/query")
+def run_query(
+    request: Request,
+    sql: str = Query(..., description="SQL-запрос к parquet-файлу"),
+    format: Optional[str] = Query(None, description="arrow | ndjson | json"),
+    limit: Optional[int] = Query(None, ge=1, description="Размер страницы"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor предыдущей страницы"),
+    batch_size: int = Query(query_stream.BATCH_SIZE, ge=1, le=1_000_000),
+):
+    # только чтение (проверяется разбором SQL), файлы из QUERY_ALLOWED_DIRS, лимиты threads/memory/времени
+    return query_response(request, sql, format, limit, cursor, batch_size)
+
+@app.get("/query-cache")
+def query_cache_stats():
+    return {**query_cache.stats(), **query_guard.stats()}
+
+@app.post("/query-cache/clear")
+def query_cache_clear():
+    query_cache.clear()
+    return query_cache.stats()
+
+@app.get("/query-views")
+def query_views():
+    """Представления, доступные в /query, и их колонки."""
+    cur = analytics.cursor()
+    return {view: [row[0] for row in cur.execute(f"DESCRIBE {view}").fetchall()] for view in analytics.views()}
 
 class UploadParams(BaseModel):
     dataset_name: Optional[str] = "new_ds"
@@ -0,0 +1 @@
+"""Server-side components of RBS Cloud"""
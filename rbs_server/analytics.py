@@ -0,0 +1,161 @@
+"""
+Аналитические запросы к сконвертированным датасетам через одно долгоживущее
+соединение DuckDB (ограничения threads / memory_limit) и представления (views)
+над parquet-файлами LeRobot, разложенными ссылками по Hive-разделам
+<views>/frames/dataset=<name>/episode=<i>/data.parquet. Соединению доступны
+только файлы из allowed_dirs, настройки после подключения заблокированы.
+
+Файлы каталога (datasets/weights/episodes) перезаписываются целиком, а DuckDB
+переоткрывает parquet-файл между чтением метаданных и сканированием — запрос,
+попавший на подмену файла, падает. Поэтому каталог загружается в таблицы
+в памяти и перечитывается, когда у файла меняются mtime/размер.
+
+Соединение открывается при первом запросе (или заранее из фонового потока —
+connect()), а не при старте процесса; *prepare* выполняется перед построением
+представлений (например, раскладка ссылок для всех датасетов каталога).
+"""
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from rbs_server.lazy import lazy_import
+
+duckdb = lazy_import("duckdb")
+pq = lazy_import("pyarrow.parquet")
+
+EPISODE_FILE = re.compile(r"episode_(\d+)\.parquet$")
+
+def read_catalog_file(path, **kwargs):
+    """Читает parquet через один открытый файл: подмена файла во время чтения не смешает две версии."""
+    with open(path, "rb") as f:
+        return pq.read_table(f, **kwargs)
+
+class Analytics:
+    def __init__(self, views_dir: Path, threads: int, memory_limit: str, tables: Optional[dict] = None,
+                 allowed_dirs: Optional[List[str]] = None, prepare: Optional[Callable[[], None]] = None):
+        self.views_dir = Path(views_dir)
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self.tables = tables or {}  # имя таблицы -> parquet-файл каталога
+        self._versions = {}  # имя таблицы -> (mtime_ns, size) загруженного файла
+        self.allowed_dirs = [str(Path(d).resolve()) + "/" for d in (allowed_dirs or [])]
+        self.prepare = prepare
+        self._lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._con: "Optional[duckdb.DuckDBPyConnection]" = None
+        self._frames_version = None  # generation, для которой построено представление frames
+
+    def connect(self) -> None:
+        """Открывает соединение, если оно ещё не открыто; параллельные вызовы ждут первый."""
+        with self._connect_lock:
+            if self._con is not None:
+                return
+            if self.prepare is not None:
+                self.prepare()
+            con = duckdb.connect()
+            con.execute(f"SET threads TO {int(self.threads)}")
+            con.execute(f"SET memory_limit = '{self.memory_limit}'")
+            if self.allowed_dirs:
+                # чтение только из белого списка каталогов; запрос не может вернуть настройки назад
+                con.execute("SET allowed_directories = ?", [self.allowed_dirs])
+                con.execute("SET enable_external_access = false")
+                con.execute("SET autoinstall_known_extensions = false")
+                con.execute("SET lock_configuration = true")
+            self._con = con
+            self.refresh_views()
+
+    @property
+    def frames_dir(self) -> Path:
+        return self.views_dir / "frames"
+
+    def link_dataset(self, name: str, dataset_dir: Path) -> int:
+        """(Пере)создаёт ссылки на parquet-файлы эпизодов датасета; возвращает их число."""
+        self.unlink_dataset(name)
+        count = 0
+        for path in sorted(Path(dataset_dir).glob("data/chunk-*/episode_*.parquet")):
+            m = EPISODE_FILE.search(path.name)
+            link = self.frames_dir / f"dataset={name}" / f"episode={int(m.group(1))}" / "data.parquet"
+            link.parent.mkdir(parents=True, exist_ok=True)
+            link.symlink_to(path.resolve())
+            count += 1
+        self.refresh_views()
+        return count
+
+    @property
+    def generation(self):
+        """
+        Меняется при каждой перестройке ссылок (каталоги dataset=<имя> пересоздаются),
+        в том числе другим процессом сервера — часть ключа кэша запросов.
+        """
+        try:
+            return os.stat(self.frames_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def unlink_dataset(self, name: str) -> None:
+        part = self.frames_dir / f"dataset={name}"
+        if not part.is_dir():
+            return
+        for link in part.glob("episode=*/data.parquet"):
+            link.unlink()
+        for d in part.glob("episode=*"):
+            d.rmdir()
+        part.rmdir()
+
+    def refresh_views(self) -> None:
+        """Представления создаются для существующих файлов (glob без совпадений — ошибка DuckDB)."""
+        if self._con is None:
+            return
+        with self._lock:
+            self._frames_version = self.generation
+            if any(self.frames_dir.glob("dataset=*/episode=*/data.parquet")):
+                pattern = str(self.frames_dir / "*" / "*" / "data.parquet")
+                self._con.execute(
+                    f"CREATE OR REPLACE VIEW frames AS SELECT * FROM read_parquet('{pattern}', "
+                    "hive_partitioning = true, union_by_name = true, hive_types = {'dataset': VARCHAR, 'episode': BIGINT})"
+                )
+            else:
+                self._con.execute("DROP VIEW IF EXISTS frames")
+        self.refresh_catalog()
+
+    def refresh_catalog(self) -> None:
+        """Перечитывает изменившиеся файлы каталога в таблицы (проверка — stat каждого файла)."""
+        if self._con is None:
+            return
+        for name, path in self.tables.items():
+            try:
+                st = os.stat(path)
+                version = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                version = None
+            if self._versions.get(name, False) == version:
+                continue
+            table = read_catalog_file(path) if version else None
+            with self._lock:
+                if table is None:
+                    self._con.execute(f"DROP TABLE IF EXISTS {name}")
+                else:
+                    # незавершённые запросы дочитывают прежнюю версию таблицы
+                    self._con.register("_catalog_load", table)
+                    self._con.execute(f"CREATE OR REPLACE TABLE {name} AS SELECT * FROM _catalog_load")
+                    self._con.unregister("_catalog_load")
+                self._versions[name] = version
+
+    def cursor(self) -> "duckdb.DuckDBPyConnection":
+        """Курсор общего соединения для одного запроса (курсоры можно использовать из разных потоков)."""
+        if self._con is None:
+            self.connect()
+        if self.generation != self._frames_version:
+            self.refresh_views()  # ссылки перестроил другой процесс
+        else:
+            self.refresh_catalog()
+        return self._con.cursor()
+
+    def views(self) -> List[str]:
+        cur = self.cursor()
+        names = cur.execute(
+            "SELECT view_name FROM duckdb_views() WHERE NOT internal UNION SELECT table_name FROM duckdb_tables() ORDER BY 1"
+        ).fetchall()
+        return [row[0] for row in names]
@@ -0,0 +1,169 @@
+"""
+Сборка мусора в каталоге cache/: сроки хранения по классам артефактов,
+общий дисковый бюджет с вытеснением по LRU и защита файлов активных конвертаций.
+"""
+import os
+import json
+import time
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# Классы артефактов в порядке вытеснения при превышении бюджета:
+# сначала то, что дешевле всего восстановить
+LOGS = "logs"                  # convert_<name>_<ts>.log / .progress.jsonl / .folded
+INTERMEDIATE = "intermediate"  # <name>_msg*.json(l), <name>_frames/ — промежуточные файлы конвертера
+ORPHAN = "orphan"              # бэги датасетов, которых нет в каталоге, и прочие файлы
+RAW = "raw"                    # cache/<dataset>/ — исходные бэги (нужны для вариантов и дозаписи)
+CLASSES = (LOGS, INTERMEDIATE, ORPHAN, RAW)
+
+# Служебные файлы и каталоги со своим бюджетом (превью — rbs_server.thumbnails), которые не трогаем
+KEEP = ("source_hashes.json", "thumbnails")
+
+class Artifact:
+    def __init__(self, path: Path, cls: str, owner: Optional[str], size: int, last_used: float):
+        self.path = path
+        self.cls = cls
+        self.owner = owner  # имя датасета / задачи, к которой относится артефакт
+        self.size = size
+        self.last_used = last_used
+
+    def to_dict(self) -> dict:
+        return {
+            "path": str(self.path),
+            "class": self.cls,
+            "owner": self.owner,
+            "size": self.size,
+            "last_used": self.last_used,
+        }
+
+def _usage(path: Path):
+    """Размер и время последнего изменения (самого свежего файла для каталога)."""
+    st = path.lstat()
+    if not path.is_dir():
+        return st.st_size, st.st_mtime
+    size, last = 0, st.st_mtime
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                fst = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += fst.st_size
+            last = max(last, fst.st_mtime)
+    return size, last
+
+def classify(path: Path, datasets: Iterable[str]):
+    """Класс артефакта и его владелец по имени файла в cache/."""
+    name = path.name
+    if path.is_dir():
+        if name in datasets:
+            return RAW, name
+        if name.endswith("_frames"):
+            return INTERMEDIATE, name[: -len("_frames")]
+        return ORPHAN, name
+    if name.startswith("convert_"):
+        return LOGS, name[len("convert_"):].split(".")[0].rsplit("_", 1)[0]
+    if "_msg" in name and name.endswith((".json", ".jsonl")):
+        return INTERMEDIATE, name.split("_msg")[0]
+    return ORPHAN, None
+
+def scan(cache_dir: Path, datasets: Iterable[str]) -> List[Artifact]:
+    datasets = set(datasets)
+    artifacts = []
+    for path in sorted(cache_dir.iterdir()) if cache_dir.is_dir() else []:
+        if path.name in KEEP or path.name.endswith(".tmp"):
+            continue
+        cls, owner = classify(path, datasets)
+        try:
+            size, last_used = _usage(path)
+        except OSError:
+            continue  # удалён параллельно
+        artifacts.append(Artifact(path, cls, owner, size, last_used))
+    return artifacts
+
+def is_protected(artifact: Artifact, protected: Iterable[Path]) -> bool:
+    """
+    Артефакт относится к активной задаче: *protected* — пути без расширения
+    (cache/<name>, cache/<name>_msg, cache/convert_<name>_<ts>), защищаются и их «продолжения»
+    (<name>_msg_synced.jsonl, .progress.jsonl и т.п.).
+    """
+    a = str(artifact.path.resolve())
+    for p in protected:
+        p = str(Path(p).resolve())
+        if a == p or a.startswith((p + os.sep, p + ".", p + "_")) or p.startswith(a + os.sep):
+            return True
+    return False
+
+def plan(artifacts: List[Artifact], retention: Dict[str, float], budget_bytes: Optional[int],
+         protected: Iterable[Path] = (), pinned_owners: Iterable[str] = (), now: Optional[float] = None) -> List[dict]:
+    """
+    Что удалить: сначала всё, что старше срока хранения своего класса (срок < 0 — хранить всегда),
+    затем, пока занято больше бюджета, — по классам CLASSES и внутри класса по LRU.
+    Артефакты активных задач (*protected*) и бэги датасетов в работе (*pinned_owners*) не трогаются.
+    """
+    now = time.time() if now is None else now
+    protected = list(protected)
+    pinned_owners = set(pinned_owners)
+    candidates, victims = [], []
+    for a in artifacts:
+        if is_protected(a, protected) or (a.cls == RAW and a.owner in pinned_owners):
+            continue
+        ttl_days = retention.get(a.cls, -1)
+        if ttl_days >= 0 and now - a.last_used > ttl_days * 86400:
+            victims.append({**a.to_dict(), "reason": "retention"})
+        else:
+            candidates.append(a)
+
+    if budget_bytes is not None:
+        used = sum(a.size for a in artifacts) - sum(v["size"] for v in victims)
+        for a in sorted(candidates, key=lambda a: (CLASSES.index(a.cls), a.last_used)):
+            if used <= budget_bytes:
+                break
+            victims.append({**a.to_dict(), "reason": "budget"})
+            used -= a.size
+    return victims
+
+def delete(victims: List[dict]) -> int:
+    freed = 0
+    for v in victims:
+        path = Path(v["path"])
+        try:
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+            freed += v["size"]
+        except FileNotFoundError:
+            pass
+    return freed
+
+def prune_hash_memo(memo_file: Path) -> None:
+    """Убирает из памяти хэшей (rbs_server.variants.source_hash) записи об удалённых файлах."""
+    if not memo_file.is_file():
+        return
+    try:
+        memo = json.loads(memo_file.read_text())
+    except ValueError:
+        return
+    alive = {k: v for k, v in memo.items() if os.path.exists(k)}
+    if len(alive) != len(memo):
+        tmp = memo_file.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(alive))
+        os.replace(tmp, memo_file)
+
+def report(artifacts: List[Artifact], victims: List[dict], budget_bytes: Optional[int]) -> dict:
+    by_class = {cls: {"count": 0, "bytes": 0} for cls in CLASSES}
+    for a in artifacts:
+        by_class[a.cls]["count"] += 1
+        by_class[a.cls]["bytes"] += a.size
+    used = sum(a.size for a in artifacts)
+    to_free = sum(v["size"] for v in victims)
+    return {
+        "budget_bytes": budget_bytes,
+        "used_bytes": used,
+        "to_free_bytes": to_free,
+        "after_bytes": used - to_free,
+        "by_class": by_class,
+        "victims": victims,
+    }
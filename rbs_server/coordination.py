@@ -0,0 +1,182 @@
+"""
+Общее состояние процессов сервера (uvicorn --workers N или несколько машин
+с общим хранилищем) в каталоге на общем диске:
+
+* блокировки между процессами (flock на <root>/locks/<имя>.lock);
+* записи JSON (<root>/<вид>/<имя>.json), заменяемые атомарно;
+* аренды (leases) — записи с владельцем и сроком действия. Владелец продлевает
+  аренду, пока работает; аренда упавшего процесса истекает через ttl и может
+  быть захвачена другим. Токен растёт при каждой смене владельца.
+
+Сроки аренд сравниваются по time.time(), часы машин должны быть синхронизированы.
+"""
+import os
+import json
+import time
+import fcntl
+import socket
+import threading
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import quote, unquote
+
+LEASES = "leases"
+
+def owner_id() -> str:
+    """Идентификатор процесса (вычисляется при вызове — после fork воркеров uvicorn он другой)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _file_name(name: str) -> str:
+    return quote(name, safe="")
+
+class SharedLock:
+    """
+    Блокировка с именем, общая для потоков и процессов. Повторный вход из того же
+    потока разрешён (set_dataset_status внутри другой операции над каталогом).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+
+    def __enter__(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # flock на отдельных открытиях файла исключает друг друга и внутри одного процесса
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                os.close(fd)
+                raise
+            self._local.fd = fd
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, *exc):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            fcntl.flock(self._local.fd, fcntl.LOCK_UN)
+            os.close(self._local.fd)
+
+class Lease:
+    def __init__(self, name: str, owner: str, token: int, expires_at: float):
+        self.name = name
+        self.owner = owner
+        self.token = token
+        self.expires_at = expires_at
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "owner": self.owner, "token": self.token, "expires_at": self.expires_at}
+
+class SharedStore:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def lock(self, name: str) -> SharedLock:
+        with self._locks_guard:
+            if name not in self._locks:
+                self._locks[name] = SharedLock(self.root / "locks" / f"{_file_name(name)}.lock")
+            return self._locks[name]
+
+    # --- записи ---
+
+    def _path(self, kind: str, name: str) -> Path:
+        return self.root / kind / f"{_file_name(name)}.json"
+
+    def read(self, kind: str, name: str) -> Optional[dict]:
+        try:
+            return json.loads(self._path(kind, name).read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write(self, kind: str, name: str, data: dict) -> None:
+        path = self._path(kind, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, path)
+
+    def delete(self, kind: str, name: str) -> None:
+        try:
+            self._path(kind, name).unlink()
+        except FileNotFoundError:
+            pass
+
+    def names(self, kind: str) -> List[str]:
+        folder = self.root / kind
+        if not folder.is_dir():
+            return []
+        return [unquote(p.name[:-len(".json")]) for p in folder.glob("*.json")]
+
+    def records(self, kind: str) -> List[dict]:
+        result = []
+        for name in self.names(kind):
+            data = self.read(kind, name)
+            if data is not None:
+                result.append(data)
+        return result
+
+    # --- аренды ---
+
+    def acquire(self, name: str, ttl: float, owner: Optional[str] = None) -> Optional[Lease]:
+        """Захватывает аренду *name* на *ttl* сек; None, если её держит другой живой владелец."""
+        owner = owner or owner_id()
+        with self.lock(LEASES):
+            current = self.read(LEASES, name)
+            now = time.time()
+            if current and current["expires_at"] > now and current["owner"] != owner:
+                return None
+            token = (current or {}).get("token", 0) + (0 if current and current["owner"] == owner else 1)
+            lease = Lease(name, owner, token, now + ttl)
+            self.write(LEASES, name, lease.to_dict())
+            return lease
+
+    def renew(self, lease: Lease, ttl: float) -> bool:
+        """
+        Продлевает аренду; False, если она уже истекла (её могли захватить, а работу — перезапустить)
+        или перешла к другому владельцу. Истёкшую аренду владелец должен считать потерянной.
+        """
+        with self.lock(LEASES):
+            if not self.holds(lease):
+                return False
+            lease.expires_at = time.time() + ttl
+            self.write(LEASES, lease.name, lease.to_dict())
+            return True
+
+    def holds(self, lease: Lease) -> bool:
+        """Аренда всё ещё наша: не истекла, владелец и токен (fencing token) не сменились."""
+        current = self.read(LEASES, lease.name)
+        return (current is not None and current["owner"] == lease.owner and current["token"] == lease.token
+                and current["expires_at"] > time.time())
+
+    def release(self, lease: Lease) -> None:
+        with self.lock(LEASES):
+            current = self.read(LEASES, lease.name)
+            if current and current["owner"] == lease.owner and current["token"] == lease.token:
+                self.delete(LEASES, lease.name)
+
+    def holder(self, name: str) -> Optional[dict]:
+        """Действующая аренда *name* или None."""
+        current = self.read(LEASES, name)
+        if current and current["expires_at"] > time.time():
+            return current
+        return None
+
+    def leases(self, prefix: str = "") -> List[dict]:
+        """Действующие аренды с именем, начинающимся на *prefix*."""
+        now = time.time()
+        return [l for l in self.records(LEASES) if l["name"].startswith(prefix) and l["expires_at"] > now]
+
+    def prune_leases(self, grace: float = 3600) -> int:
+        """Удаляет записи аренд, истёкших больше *grace* сек назад (например, сессий загрузки упавших процессов)."""
+        removed = 0
+        with self.lock(LEASES):
+            for lease in self.records(LEASES):
+                if lease["expires_at"] + grace < time.time():
+                    self.delete(LEASES, lease["name"])
+                    removed += 1
+        return removed
@@ -0,0 +1,94 @@
+"""
+Произвольный доступ к кадрам и срезам состояний сконвертированного датасета
+по индексу, который пишет convert_rosbag_to_lerobot.py (meta/rbs_episodes.parquet,
+meta/rbs_frames.parquet). Читаются только нужные row group'ы и колонки.
+"""
+import json
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from rbs_server.lazy import lazy_import
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+pq = lazy_import("pyarrow.parquet")
+
+EPISODE_INDEX = "meta/rbs_episodes.parquet"
+FRAME_INDEX = "meta/rbs_frames.parquet"
+# Колонки состояния в parquet-файлах эпизодов LeRobot
+STATE_COLUMNS = ("timestamp", "frame_index", "index", "observation.state", "action")
+
+MEDIA_TYPES = {"png": "image/png", "jpeg": "image/jpeg"}
+
+def has_index(dataset_dir: Path) -> bool:
+    return (dataset_dir / EPISODE_INDEX).is_file() and (dataset_dir / FRAME_INDEX).is_file()
+
+def read_episodes(dataset_dir: Path) -> List[dict]:
+    return pq.read_table(dataset_dir / EPISODE_INDEX).to_pylist()
+
+def get_episode(dataset_dir: Path, episode_index: int) -> Optional[dict]:
+    rows = pq.read_table(dataset_dir / EPISODE_INDEX, filters=[("episode_index", "=", episode_index)]).to_pylist()
+    return rows[0] if rows else None
+
+def read_frames(dataset_dir: Path, episode_index: int, start: int = 0, stop: Optional[int] = None) -> List[dict]:
+    """Строки индекса кадров эпизода в диапазоне [start, stop)."""
+    filters = [("episode_index", "=", episode_index), ("frame_index", ">=", start)]
+    if stop is not None:
+        filters.append(("frame_index", "<", stop))
+    return pq.read_table(dataset_dir / FRAME_INDEX, filters=filters).sort_by("frame_index").to_pylist()
+
+def cameras(dataset_dir: Path) -> List[str]:
+    info = json.loads((dataset_dir / "meta" / "info.json").read_text())
+    return [key for key, f in info["features"].items() if f["dtype"] in ("image", "video")]
+
+def encode(image: "np.ndarray", fmt: str, quality: int = 90) -> bytes:
+    """RGB-кадр -> PNG/JPEG."""
+    bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if fmt == "jpeg" else []
+    ok, buf = cv2.imencode("." + ("jpg" if fmt == "jpeg" else "png"), bgr, params)
+    if not ok:
+        raise ValueError(f"Failed to encode frame as {fmt}")
+    return buf.tobytes()
+
+def _read_video_frame(video_path: Path, frame_index: int) -> "np.ndarray":
+    cap = cv2.VideoCapture(str(video_path))
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)  # перемотка к ближайшему ключевому кадру
+        ok, bgr = cap.read()
+    finally:
+        cap.release()
+    if not ok:
+        raise KeyError(f"Frame {frame_index} not found in {video_path.name}")
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+def read_frame(dataset_dir: Path, episode: dict, frame: dict, camera: str) -> "Tuple[Optional[bytes], Optional[np.ndarray]]":
+    """
+    Кадр камеры: (PNG-байты как они лежат в parquet, None) в режиме изображений
+    или (None, RGB-массив), декодированный из видео.
+    """
+    videos = json.loads(episode["videos"] or "{}")
+    if camera in videos:
+        return None, _read_video_frame(dataset_dir / videos[camera], frame["frame_index"])
+    pf = pq.ParquetFile(dataset_dir / episode["data_file"])
+    column = pf.read_row_group(frame["row_group"], columns=[camera]).column(camera)
+    return column[frame["row_in_group"]].as_py()["bytes"], None
+
+def frame_image(dataset_dir: Path, episode: dict, frame: dict, camera: str) -> "np.ndarray":
+    """Кадр камеры как RGB-массив."""
+    raw, image = read_frame(dataset_dir, episode, frame, camera)
+    return image if image is not None else decode(raw)
+
+def decode(raw: bytes) -> "np.ndarray":
+    bgr = cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+def read_state_slice(dataset_dir: Path, episode: dict, frames: List[dict], columns=STATE_COLUMNS) -> dict:
+    """Колонки состояния для кадров *frames* (подряд идущих) — только их row group'ы."""
+    if not frames:
+        return {c: [] for c in columns}
+    pf = pq.ParquetFile(dataset_dir / episode["data_file"])
+    groups = sorted({f["row_group"] for f in frames})
+    table = pf.read_row_groups(groups, columns=list(columns))
+    # первый кадр лежит в первом из прочитанных row group'ов
+    table = table.slice(frames[0]["row_in_group"], len(frames))
+    return table.to_pydict()
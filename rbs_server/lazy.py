@@ -0,0 +1,26 @@
+"""
+Отложенный импорт тяжёлых библиотек (pandas, pyarrow, duckdb, cv2): модуль
+загружается при первом обращении к его атрибуту, а не при импорте сервера.
+Аннотации с типами таких модулей пишутся строками — иначе импорт случится
+при определении функции.
+"""
+import importlib
+
+class LazyModule:
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        module = self._module
+        if module is None:
+            # import_module потокобезопасен; повторный вызов берёт модуль из sys.modules
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self._name}'{' (loaded)' if self._module is not None else ''}>"
+
+def lazy_import(name: str) -> LazyModule:
+    """`pd = lazy_import("pandas")` вместо `import pandas as pd`."""
+    return LazyModule(name)
@@ -0,0 +1,63 @@
+"""
+Чтение событий прогресса конвертации (JSONL, пишет convert_rosbag_to_lerobot.py --progress)
+и оценка оставшегося времени по измеренной скорости.
+"""
+import json
+import asyncio
+from pathlib import Path
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+# Стадии конвертера в порядке выполнения; каждая проходит по всем эпизодам
+STAGES = ("extract", "lerobot")
+
+def read_events(path: Path, offset: int = 0) -> Tuple[List[dict], int]:
+    """Новые полные строки-события начиная с байта *offset* и смещение после них."""
+    if not path.is_file():
+        return [], offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        chunk = f.read()
+    end = chunk.rfind(b"\n") + 1  # недописанную строку оставляем на следующий раз
+    events = [json.loads(line) for line in chunk[:end].splitlines() if line.strip()]
+    return events, offset + end
+
+def last_event(path: Path) -> Optional[dict]:
+    events, _ = read_events(path)
+    return events[-1] if events else None
+
+def with_eta(event: dict) -> dict:
+    """Добавляет к событию общий процент выполнения и ETA (сек) по скорости текущей стадии."""
+    num_episodes = event.get("num_episodes") or 0
+    stage = event.get("stage")
+    if event.get("event") == "done":
+        return {**event, "percent": 100.0, "eta_sec": 0.0}
+    if stage not in STAGES or num_episodes <= 0:
+        return {**event, "percent": None, "eta_sec": None}
+
+    stage_idx = STAGES.index(stage)
+    episode = event.get("episode", 0)
+    total = len(STAGES) * num_episodes
+    done = stage_idx * num_episodes + episode
+    eta = None
+    if episode > 0:
+        # эпизоды последующих стадий оцениваем по скорости текущей
+        sec_per_episode = event.get("stage_elapsed", 0.0) / episode
+        eta = round(sec_per_episode * (total - done), 1)
+    return {**event, "percent": round(100.0 * done / total, 1), "eta_sec": eta}
+
+async def stream_events(path: Path, is_active: Callable[[], bool], poll_interval: float = 0.5) -> AsyncIterator[str]:
+    """
+    Server-Sent Events: отдаёт события по мере появления, пока конвертация активна.
+    Чтение файла и *is_active* (состояние задачи в общем хранилище) — в пуле потоков,
+    не в цикле событий.
+    """
+    loop = asyncio.get_running_loop()
+    offset = 0
+    while True:
+        events, offset = await loop.run_in_executor(None, read_events, path, offset)
+        for event in events:
+            yield f"data: {json.dumps(with_eta(event))}\n\n"
+        if not events:
+            if not await loop.run_in_executor(None, is_active):
+                break
+            await asyncio.sleep(poll_interval)
@@ -0,0 +1,147 @@
+"""
+Кэш результатов SQL-запросов в памяти (Arrow-таблицы) с вытеснением по LRU
+в пределах бюджета байт. Ключ — нормализованный SQL и «поколение» данных:
+mtime файлов каталога и упомянутых в запросе parquet-файлов плюс счётчик
+перестроек представлений, так что изменение данных само делает старые записи недостижимыми.
+Шаблоны ('data/x/*/*.parquet') раскрываются: в поколение входят найденные файлы и
+mtime их каталогов. Запросы к прочим файлам (csv, json, пути без .parquet) не кэшируются.
+"""
+import os
+import re
+import glob
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from rbs_server.lazy import lazy_import
+
+pa = lazy_import("pyarrow")
+
+# Запросы с недетерминированными функциями не кэшируем
+VOLATILE = re.compile(r"\b(random|uuid|gen_random_uuid|now|current_timestamp|current_date|current_time|setseed)\b", re.I)
+PARQUET_PATH = re.compile(r"'([^']+\.parquet)'")
+STRING_LITERAL = re.compile(r"'([^']*)'")
+# Строка похожа на путь к файлу: есть разделитель каталогов или расширение файла данных
+PATH_LIKE = re.compile(r"[/\\]|\.(parquet|csv|tsv|json|jsonl|ndjson|arrow|feather|txt|gz|zst)$", re.I)
+GLOB_CHARS = re.compile(r"[*?\[]")
+
+def normalize(sql: str) -> str:
+    return " ".join(sql.split()).rstrip(";")
+
+def is_cacheable(sql: str) -> bool:
+    """Нет недетерминированных функций, и все упомянутые файлы — parquet (их поколение отслеживается)."""
+    if VOLATILE.search(sql) is not None:
+        return False
+    return all(not PATH_LIKE.search(s) or s.lower().endswith(".parquet") for s in STRING_LITERAL.findall(sql))
+
+def _stat(path: str) -> tuple:
+    try:
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return (path, 0, 0)
+
+def file_generation(paths: Iterable[str]) -> tuple:
+    """
+    mtime_ns и размер файлов (0 для отсутствующих). Шаблон заменяется найденными файлами
+    и mtime их каталогов: новый, удалённый или перезаписанный файл меняет поколение.
+    """
+    result = []
+    for path in sorted(set(paths)):
+        if not GLOB_CHARS.search(path):
+            result.append(_stat(path))
+            continue
+        matches = sorted(glob.glob(path, recursive=True))
+        dirs = sorted({os.path.dirname(m) for m in matches})
+        result.append((path, len(matches)))
+        result.extend(_stat(d)[:2] for d in dirs)
+        result.extend(_stat(m) for m in matches)
+    return tuple(result)
+
+def referenced_files(sql: str) -> list:
+    """parquet-файлы, к которым запрос обращается напрямую ('data/xxx.parquet')."""
+    return PARQUET_PATH.findall(sql)
+
+class QueryCache:
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[str, pa.Table]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uncacheable = 0
+
+    @staticmethod
+    def key(sql: str, generation) -> str:
+        return hashlib.sha256(repr((normalize(sql), generation)).encode("utf-8")).hexdigest()[:32]
+
+    def get(self, key: str) -> "Optional[pa.Table]":
+        with self._lock:
+            table = self._entries.get(key)
+            if table is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return table
+
+    def put(self, key: str, table: "pa.Table") -> bool:
+        size = table.nbytes
+        if size > self.max_entry_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key).nbytes
+            self._entries[key] = table
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= old.nbytes
+                self.evictions += 1
+        return True
+
+    def capture(self, key: str, reader: "pa.RecordBatchReader") -> "pa.RecordBatchReader":
+        """
+        Обёртка над потоком пакетов: пакеты уходят клиенту как есть и параллельно копятся;
+        если поток дочитан целиком и уложился в max_entry_bytes — результат попадает в кэш.
+        """
+        def batches():
+            kept, size, overflow = [], 0, False
+            for batch in reader:
+                if not overflow:
+                    size += batch.nbytes
+                    overflow = size > self.max_entry_bytes
+                    if overflow:
+                        kept = []  # слишком большой результат — не держим копию
+                    else:
+                        kept.append(batch)
+                yield batch
+            if not overflow:
+                self.put(key, pa.Table.from_batches(kept, schema=reader.schema))
+        return pa.RecordBatchReader.from_batches(reader.schema, batches())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entry_bytes": self.max_entry_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+                "uncacheable": self.uncacheable,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
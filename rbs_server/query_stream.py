@@ -0,0 +1,120 @@
+"""
+Потоковая выдача результатов SQL-запросов: пакеты Arrow из DuckDB уходят клиенту
+по мере выполнения запроса — в Arrow IPC (stream) или NDJSON, без сборки
+всего результата в pandas. Постраничность — через непрозрачный курсор.
+"""
+import io
+import json
+import base64
+import hashlib
+from typing import Callable, Iterator, Optional, Tuple
+
+from rbs_server.lazy import lazy_import
+
+pa = lazy_import("pyarrow")
+
+ARROW = "arrow"
+NDJSON = "ndjson"
+JSON = "json"
+MEDIA_TYPES = {
+    ARROW: "application/vnd.apache.arrow.stream",
+    NDJSON: "application/x-ndjson",
+    JSON: "application/json",
+}
+BATCH_SIZE = 10_000
+
+def negotiate(fmt: Optional[str], accept: Optional[str]) -> str:
+    """Формат из параметра ?format= или заголовка Accept; по умолчанию — JSON-массив, как раньше."""
+    if fmt:
+        if fmt not in MEDIA_TYPES:
+            raise ValueError(f"Unsupported format '{fmt}', expected one of {list(MEDIA_TYPES)}")
+        return fmt
+    accept = accept or ""
+    for name, media_type in MEDIA_TYPES.items():
+        if media_type in accept:
+            return name
+    return JSON
+
+def _sql_tag(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()[:12]
+
+def encode_cursor(sql: str, offset: int) -> str:
+    payload = json.dumps({"q": _sql_tag(sql), "o": offset}).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+def decode_cursor(sql: str, cursor: Optional[str]) -> int:
+    """Смещение из курсора; курсор от другого запроса — ошибка."""
+    if not cursor:
+        return 0
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise ValueError("Malformed cursor")
+    if payload.get("q") != _sql_tag(sql):
+        raise ValueError("Cursor belongs to a different query")
+    return int(payload["o"])
+
+def paginate(sql: str, limit: Optional[int], cursor: Optional[str]) -> Tuple[str, Optional[str]]:
+    """SQL страницы и курсор следующей (None без limit). Последняя страница — та, где строк меньше limit."""
+    offset = decode_cursor(sql, cursor)
+    sql = sql.strip().rstrip(";")
+    if limit is None:
+        return (f"SELECT * FROM ({sql}) OFFSET {offset}" if offset else sql), None
+    return f"SELECT * FROM ({sql}) LIMIT {int(limit)} OFFSET {offset}", encode_cursor(sql, offset + int(limit))
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    return str(value)
+
+def _drain(buf: io.BytesIO) -> bytes:
+    data = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return data
+
+def iter_arrow(reader: "pa.RecordBatchReader") -> Iterator[bytes]:
+    """Arrow IPC stream: схема, затем по сообщению на пакет."""
+    buf = io.BytesIO()
+    with pa.ipc.new_stream(buf, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            yield _drain(buf)
+    yield _drain(buf)  # маркер конца потока
+
+def iter_ndjson(reader: "pa.RecordBatchReader") -> Iterator[bytes]:
+    for batch in reader:
+        yield "".join(json.dumps(row, default=_json_default, ensure_ascii=False) + "\n" for row in batch.to_pylist()).encode("utf-8")
+
+def iter_json(reader: "pa.RecordBatchReader") -> Iterator[bytes]:
+    """JSON-массив, отдаваемый по пакетам."""
+    yield b"["
+    first = True
+    for batch in reader:
+        rows = batch.to_pylist()
+        if not rows:
+            continue
+        chunk = ",".join(json.dumps(row, default=_json_default, ensure_ascii=False) for row in rows)
+        yield (chunk if first else "," + chunk).encode("utf-8")
+        first = False
+    yield b"]"
+
+ENCODERS = {ARROW: iter_arrow, NDJSON: iter_ndjson, JSON: iter_json}
+
+def open_reader(cursor, sql: str, batch_size: int = BATCH_SIZE) -> "pa.RecordBatchReader":
+    """
+    Запускает *sql*; ошибки разбора/планирования возникают здесь, до начала ответа.
+    Строки DuckDB выдаёт по мере выполнения, пакетами по *batch_size*.
+    """
+    result = cursor.execute(sql)
+    if hasattr(result, "to_arrow_reader"):
+        return result.to_arrow_reader(batch_size)
+    return result.fetch_record_batch(batch_size)
+
+def stream(reader: "pa.RecordBatchReader", fmt: str, on_close: Optional[Callable[[], None]] = None) -> Iterator[bytes]:
+    """Кодирует пакеты *reader* в *fmt*; *on_close* вызывается, когда клиент дочитал или отключился."""
+    try:
+        yield from ENCODERS[fmt](reader)
+    finally:
+        if on_close is not None:
+            on_close()
@@ -0,0 +1,74 @@
+"""
+Ограничения для пользовательских SQL-запросов: только чтение (один SELECT/EXPLAIN),
+ограниченное число одновременных запросов, тайм-аут с прерыванием запроса в DuckDB.
+Доступ к файлам и лимиты threads/memory задаёт соединение (rbs_server.analytics).
+"""
+import threading
+from typing import Callable, Optional
+
+from rbs_server.lazy import lazy_import
+
+duckdb = lazy_import("duckdb")
+
+class QueryRejected(Exception):
+    """Запрос не прошёл проверку (не только чтение, несколько операторов)."""
+
+class QueryBusy(Exception):
+    """Все слоты аналитических запросов заняты."""
+
+def check_read_only(sql: str) -> bool:
+    """Проверяет, что *sql* — ровно один оператор чтения; True, если это SELECT (его можно оборачивать)."""
+    try:
+        statements = duckdb.extract_statements(sql)
+    except duckdb.Error as e:
+        raise QueryRejected(str(e))
+    if len(statements) != 1:
+        raise QueryRejected("Exactly one statement is allowed")
+    if statements[0].type not in (duckdb.StatementType.SELECT, duckdb.StatementType.EXPLAIN):
+        raise QueryRejected(f"Only SELECT queries are allowed, got {statements[0].type.name}")
+    return statements[0].type == duckdb.StatementType.SELECT
+
+class QueryGuard:
+    """
+    Не больше *max_concurrent* запросов одновременно (ожидание слота — до *queue_timeout* сек,
+    затем QueryBusy) и не дольше *timeout* сек на запрос (затем cursor.interrupt()).
+    """
+
+    def __init__(self, max_concurrent: int, timeout: float, queue_timeout: float):
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self.rejected_busy = 0
+        self.timed_out = 0
+
+    def start(self, cursor) -> Callable[[], None]:
+        """Занимает слот и запускает сторожевой таймер; возвращает функцию освобождения."""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.rejected_busy += 1
+            raise QueryBusy("Too many analytical queries, retry later")
+        timer: Optional[threading.Timer] = None
+        if self.timeout > 0:
+            timer = threading.Timer(self.timeout, self._interrupt, (cursor,))
+            timer.daemon = True
+            timer.start()
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            if timer is not None:
+                timer.cancel()
+            self._slots.release()
+        return release
+
+    def _interrupt(self, cursor) -> None:
+        self.timed_out += 1
+        try:
+            cursor.interrupt()
+        except duckdb.Error:
+            pass
+
+    def stats(self) -> dict:
+        return {"timeout_sec": self.timeout, "rejected_busy": self.rejected_busy, "timed_out": self.timed_out}
@@ -0,0 +1,396 @@
+"""
+Очередь задач конвертации датасетов с ограниченным числом одновременно
+работающих процессов, приоритетами и отменой. Очередь и состояние задач хранятся
+в общем хранилище (rbs_server.coordination), так что задачи видны всем процессам
+сервера, а выполняет каждую ровно один — владелец аренды.
+"""
+import os
+import sys
+import time
+import signal
+import datetime
+import threading
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from rbs_server.coordination import Lease, SharedStore, owner_id
+
+class JobState:
+    QUEUED = "queued"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+ACTIVE_STATES = (JobState.QUEUED, JobState.RUNNING)
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+class ConversionJob:
+    """Одна задача конвертации: команда, лог и текущее состояние."""
+
+    def __init__(self, dataset_name: str, argv: List[str], log_file: Path, priority: int = 0, progress_file: Optional[Path] = None,
+                 params: Optional[dict] = None, variant: Optional[dict] = None):
+        self.dataset_name = dataset_name
+        self.argv = argv  # аргументы convert_rosbag_to_lerobot.py
+        self.log_file = log_file
+        self.progress_file = progress_file
+        self.priority = priority
+        self.params = params or {}  # параметры производного варианта (fps, разрешение, видео)
+        self.variant = variant  # {"key", "source", "dataset"} для задач кэша вариантов
+        self.state = JobState.QUEUED
+        self.returncode: Optional[int] = None
+        self.pid: Optional[int] = None
+        self.profile: Optional[dict] = None  # сводка таймеров стадий конвертера
+        self.submitted_at = _now()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.seq = time.time_ns()  # порядок поступления при равном приоритете
+        self.owner: Optional[str] = None  # процесс сервера, выполняющий задачу
+        self.attempts = 0
+        self.cancel_requested = False
+
+    def to_dict(self) -> dict:
+        return {
+            "dataset_name": self.dataset_name,
+            "state": self.state,
+            "priority": self.priority,
+            "params": self.params,
+            "variant": self.variant,
+            "pid": self.pid,
+            "returncode": self.returncode,
+            "conversion_log": str(self.log_file),
+            "progress_file": str(self.progress_file) if self.progress_file else None,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "profile": self.profile,
+            "owner": self.owner,
+            "attempts": self.attempts,
+        }
+
+    def to_record(self) -> dict:
+        return {**self.to_dict(), "argv": self.argv, "seq": self.seq, "cancel_requested": self.cancel_requested}
+
+    @classmethod
+    def from_record(cls, record: dict) -> "ConversionJob":
+        job = cls(record["dataset_name"], record["argv"], Path(record["conversion_log"]), record["priority"],
+                  Path(record["progress_file"]) if record.get("progress_file") else None,
+                  record.get("params"), record.get("variant"))
+        for field in ("state", "returncode", "pid", "profile", "submitted_at", "started_at", "finished_at",
+                      "seq", "owner", "attempts", "cancel_requested"):
+            setattr(job, field, record.get(field, getattr(job, field)))
+        return job
+
+def attempt_header(job: ConversionJob) -> bytes:
+    """Строка-разделитель попыток в логе задачи: лог дописывается, вывод упавшей попытки остаётся."""
+    return f"\n=== Attempt {job.attempts} started {_now()} ===\n".encode("utf-8")
+
+class SubprocessRunner:
+    """Запускает каждую конвертацию отдельным интерпретатором."""
+
+    def __init__(self, script_path: Path):
+        self.script_path = script_path
+        self._processes: Dict[str, subprocess.Popen] = {}
+
+    def run(self, job: ConversionJob) -> int:
+        with open(job.log_file, "ab") as lf:
+            lf.write(attempt_header(job))
+            lf.flush()
+            process = subprocess.Popen(
+                [sys.executable, str(self.script_path), *job.argv],
+                stdout=lf,
+                stderr=subprocess.STDOUT,
+                start_new_session=True
+            )
+        job.pid = process.pid
+        self._processes[job.dataset_name] = process
+        try:
+            if job.state == JobState.CANCELLED:
+                self.cancel(job)
+            return process.wait()
+        finally:
+            self._processes.pop(job.dataset_name, None)
+
+    def cancel(self, job: ConversionJob) -> None:
+        process = self._processes.get(job.dataset_name)
+        if process is not None:
+            # процесс запущен в своей сессии — останавливаем всю группу
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+JOBS = "jobs"
+JOBS_LOCK = "jobs"
+
+class ConversionScheduler:
+    """
+    Не больше *max_workers* конвертаций одновременно во всех процессах сервера (слоты —
+    аренды conversion-slot/<i>). Задачи с большим priority выполняются раньше, при равном
+    приоритете — в порядке поступления. На один датасет допускается одна активная задача.
+
+    Каждый процесс держит *max_workers* потоков, которые забирают задачи из общей очереди;
+    запущенная задача держит аренду conversion/<датасет> и продлевает её каждые ttl/3 сек.
+    Задача, чей владелец пропал (аренда истекла), возвращается в очередь — конвертер
+    продолжит её с чекпоинта, — а после *max_attempts* попыток считается упавшей.
+    Владелец, не сумевший продлить аренду, останавливает свой процесс конвертации и не
+    записывает результат: задачу уже может выполнять другой процесс сервера.
+    """
+
+    def __init__(self, max_workers: int, runner, store: SharedStore,
+                 on_start: Optional[Callable[[ConversionJob], None]] = None,
+                 on_finish: Optional[Callable[[ConversionJob], None]] = None,
+                 lease_ttl: float = 60, poll_interval: float = 1.0, max_attempts: int = 3):
+        self.max_workers = max_workers
+        self.runner = runner  # SubprocessRunner или rbs_server.workers.WarmWorkerPool
+        self.on_start = on_start
+        self.on_finish = on_finish
+        self.store = store
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._running: Dict[str, tuple] = {}  # датасет -> (job, [аренды]) — задачи этого процесса
+        self._fenced = set()  # датасеты, чьи задачи потеряли аренду и остановлены
+        self._workers: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for i in range(self.max_workers - len(self._workers)):
+            worker = threading.Thread(target=self._worker, daemon=True, name=f"conversion_worker_{len(self._workers)}")
+            worker.start()
+            self._workers.append(worker)
+        if len(self._workers) == self.max_workers:
+            threading.Thread(target=self._heartbeat, daemon=True, name="conversion_heartbeat").start()
+
+    def _job(self, dataset_name: str) -> Optional[ConversionJob]:
+        record = self.store.read(JOBS, dataset_name)
+        return ConversionJob.from_record(record) if record else None
+
+    def _save(self, job: ConversionJob) -> None:
+        self.store.write(JOBS, job.dataset_name, job.to_record())
+
+    def submit(self, job: ConversionJob) -> ConversionJob:
+        """Ставит задачу в очередь; ValueError, если по датасету уже есть активная задача."""
+        with self.store.lock(JOBS_LOCK):
+            current = self._job(job.dataset_name)
+            if current is not None and current.state in ACTIVE_STATES:
+                raise ValueError(f"Conversion already {current.state} for dataset '{job.dataset_name}'")
+            self._save(job)
+        with self._cond:
+            self._cond.notify()
+        return job
+
+    def cancel(self, dataset_name: str) -> Optional[ConversionJob]:
+        """Отменяет задачу в очереди или останавливает запущенный процесс (в любом процессе сервера)."""
+        with self.store.lock(JOBS_LOCK):
+            job = self._job(dataset_name)
+            if job is None or job.state not in ACTIVE_STATES:
+                return None
+            was_queued = job.state == JobState.QUEUED
+            if was_queued:
+                job.state = JobState.CANCELLED
+                job.finished_at = _now()
+            else:
+                job.cancel_requested = True  # владелец остановит процесс при следующем продлении аренды
+            self._save(job)
+        if was_queued:
+            self._notify_finish(job)
+        else:
+            self._cancel_local(dataset_name)
+        return job
+
+    def _cancel_local(self, dataset_name: str) -> None:
+        with self._cond:
+            running = self._running.get(dataset_name)
+        if running is not None:
+            job = running[0]
+            job.state = JobState.CANCELLED
+            self.runner.cancel(job)
+
+    def get(self, dataset_name: str) -> Optional[ConversionJob]:
+        return self._job(dataset_name)
+
+    def is_active(self, dataset_name: str) -> bool:
+        job = self.get(dataset_name)
+        return job is not None and job.state in ACTIVE_STATES
+
+    def _queued(self) -> List[ConversionJob]:
+        jobs = [ConversionJob.from_record(r) for r in self.store.records(JOBS) if r["state"] == JobState.QUEUED]
+        return sorted(jobs, key=lambda job: (-job.priority, job.seq))
+
+    def position(self, dataset_name: str) -> Optional[int]:
+        """Позиция в очереди (1 — следующая к запуску), None если задача не ожидает."""
+        for pos, job in enumerate(self._queued(), 1):
+            if job.dataset_name == dataset_name:
+                return pos
+        return None
+
+    def jobs(self) -> List[dict]:
+        queued = self._queued()
+        others = [ConversionJob.from_record(r) for r in self.store.records(JOBS) if r["state"] != JobState.QUEUED]
+        result = [{**job.to_dict(), "queue_position": pos} for pos, job in enumerate(queued, 1)]
+        result += [{**job.to_dict(), "queue_position": None} for job in sorted(others, key=lambda job: job.seq)]
+        return result
+
+    def _worker(self) -> None:
+        while True:
+            claimed = self._claim()
+            if claimed is None:
+                with self._cond:
+                    self._cond.wait(self.poll_interval)
+                continue
+            self._run(*claimed)
+
+    def _claim(self):
+        """Забирает первую задачу общей очереди, если есть свободный слот; (job, аренды) или None."""
+        with self.store.lock(JOBS_LOCK):
+            lost = self._recover()
+            job = self._take_slot_and_job()
+        for finished in lost:
+            self._notify_finish(finished)
+        return job
+
+    def _take_slot_and_job(self):
+        """Под блокировкой очереди: слот + аренда датасета для первой задачи очереди, чей датасет свободен."""
+        queued = self._queued()
+        if not queued:
+            return None
+        # поток-исполнитель — отдельный владелец: слоты одного процесса не сливаются в одну аренду
+        owner = f"{owner_id()}:{threading.get_ident()}"
+        slot = None
+        for i in range(self.max_workers):
+            slot = self.store.acquire(f"conversion-slot/{i}", self.lease_ttl, owner=owner)
+            if slot is not None:
+                break
+        if slot is None:
+            return None
+        # аренду датасета может ещё держать упавший владелец — такую задачу пропускаем, а не ждём
+        with self._cond:
+            local = set(self._running)  # остановленная попытка этого процесса ещё не завершилась
+        for job in queued:
+            if job.dataset_name in local:
+                continue
+            lease = self.store.acquire(f"conversion/{job.dataset_name}", self.lease_ttl, owner=owner)
+            if lease is not None:
+                break
+        else:
+            self.store.release(slot)
+            return None
+        job.state = JobState.RUNNING
+        job.started_at = _now()
+        job.owner = owner_id()
+        job.attempts += 1
+        self._save(job)
+        with self._cond:
+            self._running[job.dataset_name] = (job, [slot, lease])
+        return job, [slot, lease]
+
+    def _recover(self) -> List[ConversionJob]:
+        """
+        Задачи running без действующей аренды (процесс-владелец упал) — снова в очередь
+        или, если попытки исчерпаны, в failed; возвращает завершённые так задачи.
+        """
+        lost = []
+        for record in self.store.records(JOBS):
+            if record["state"] != JobState.RUNNING or self.store.holder(f"conversion/{record['dataset_name']}"):
+                continue
+            job = ConversionJob.from_record(record)
+            if job.cancel_requested or job.attempts >= self.max_attempts:
+                job.state = JobState.CANCELLED if job.cancel_requested else JobState.FAILED
+                job.finished_at = _now()
+                self._save(job)
+                lost.append(job)
+            else:
+                job.state = JobState.QUEUED
+                job.owner = None
+                self._save(job)
+        return lost
+
+    def _heartbeat(self) -> None:
+        """Продлевает аренды запущенных задач (каждые ttl/3) и передаёт им отмену, запрошенную другим процессом."""
+        renewed = time.monotonic()
+        while True:
+            time.sleep(self.poll_interval)
+            renew = time.monotonic() - renewed >= self.lease_ttl / 3
+            if renew:
+                renewed = time.monotonic()
+            with self._cond:
+                running = list(self._running.items())
+            for dataset_name, (job, leases) in running:
+                if dataset_name in self._fenced:
+                    continue
+                if renew and not all([self.store.renew(lease, self.lease_ttl) for lease in leases]):
+                    self._fence(job, "lease expired before it was renewed")
+                    continue
+                record = self.store.read(JOBS, dataset_name)
+                if not self._same_attempt(job, record):
+                    self._fence(job, "job was requeued by another server process")
+                elif record.get("cancel_requested") and job.state != JobState.CANCELLED:
+                    self._cancel_local(dataset_name)
+
+    @staticmethod
+    def _same_attempt(job: ConversionJob, record: Optional[dict]) -> bool:
+        """Запись задачи — всё та же запущенная нами попытка."""
+        return (record is not None and record.get("state") == JobState.RUNNING
+                and record.get("seq") == job.seq and record.get("attempts") == job.attempts)
+
+    def _fence(self, job: ConversionJob, reason: str) -> None:
+        """Аренда потеряна: останавливаем процесс, результат задачи этим процессом не записывается."""
+        with self._cond:
+            self._fenced.add(job.dataset_name)
+        with open(job.log_file, "ab") as lf:
+            lf.write(f"\n[!] Conversion stopped: {reason}\n".encode("utf-8"))
+        self.runner.cancel(job)
+
+    def _owns(self, job: ConversionJob, leases: List[Lease]) -> bool:
+        """Под блокировкой очереди: аренды ещё наши и задачу не перезапустил другой процесс."""
+        with self._cond:
+            fenced = job.dataset_name in self._fenced
+        return (not fenced and all(self.store.holds(lease) for lease in leases)
+                and self._same_attempt(job, self.store.read(JOBS, job.dataset_name)))
+
+    def _run(self, job: ConversionJob, leases: List[Lease]) -> None:
+        try:
+            if self.on_start:
+                self.on_start(job)
+            if not job.cancel_requested:
+                job.returncode = self.runner.run(job)
+        except Exception as e:
+            with open(job.log_file, "ab") as lf:
+                lf.write(f"\n[!] Failed to start conversion: {e}\n".encode("utf-8"))
+        with self.store.lock(JOBS_LOCK):
+            # аренда истекла — задачу мог забрать другой процесс: его запись не трогаем
+            owned = self._owns(job, leases)
+            if owned:
+                record = self.store.read(JOBS, job.dataset_name) or {}
+                if job.state == JobState.CANCELLED or job.cancel_requested or record.get("cancel_requested"):
+                    job.state = JobState.CANCELLED
+                else:
+                    job.state = JobState.FINISHED if job.returncode == 0 else JobState.FAILED
+                job.finished_at = _now()
+                self._save(job)
+        with self._cond:
+            self._running.pop(job.dataset_name, None)
+            self._fenced.discard(job.dataset_name)
+        if owned:
+            self._notify_finish(job)
+            with self.store.lock(JOBS_LOCK):
+                record = self.store.read(JOBS, job.dataset_name)
+                if record and record.get("seq") == job.seq and record.get("attempts") == job.attempts:
+                    self._save(job)  # профиль, заполненный в on_finish (не затираем задачу, поставленную заново)
+        else:
+            with open(job.log_file, "ab") as lf:
+                lf.write(b"\n[!] Lease lost: result of this attempt is not recorded\n")
+        for lease in leases:
+            self.store.release(lease)
+
+    def _notify_finish(self, job: ConversionJob) -> None:
+        if self.on_finish:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                with open(job.log_file, "ab") as lf:
+                    lf.write(f"\n[!] Failed to update status after conversion: {e}\n".encode("utf-8"))
@@ -0,0 +1,108 @@
+"""
+Уменьшенные превью кадров и контактные листы эпизодов. Генерируются лениво
+из сконвертированного датасета (через индекс кадров) и хранятся в дисковом
+LRU-кэше с ограничением по размеру.
+"""
+import os
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from rbs_server import frame_index
+from rbs_server.lazy import lazy_import
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+
+class ThumbnailCache:
+    """Файлы <root>/<key>.<fmt>; время последнего обращения — mtime (обновляется при попадании)."""
+
+    def __init__(self, root: Path, budget_bytes: int):
+        self.root = Path(root)
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:32]
+
+    def get(self, key: str, fmt: str) -> Optional[bytes]:
+        path = self.root / f"{key}.{fmt}"
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key: str, fmt: str, data: bytes) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / f"{key}.{fmt}"
+        # уникальное имя: with_suffix(".tmp") совпадал бы у форматов одного ключа и у параллельных записей
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            files = []
+            for entry in os.scandir(self.root):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.budget_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        files = [e for e in os.scandir(self.root) if e.is_file()] if self.root.is_dir() else []
+        return {
+            "budget_bytes": self.budget_bytes,
+            "used_bytes": sum(e.stat().st_size for e in files),
+            "files": len(files),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+def resize_to_width(image: "np.ndarray", width: int) -> "np.ndarray":
+    h, w = image.shape[:2]
+    if w <= width:
+        return image
+    return cv2.resize(image, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+
+def sample_frames(start: int, stop: int, count: int) -> List[int]:
+    """*count* равномерно распределённых номеров кадров из [start, stop)."""
+    if stop <= start:
+        return []
+    count = min(count, stop - start)
+    return sorted(set(np.linspace(start, stop - 1, count).round().astype(int).tolist()))
+
+def thumbnail(dataset_dir: Path, episode: dict, frame: dict, camera: str, width: int) -> "np.ndarray":
+    return resize_to_width(frame_index.frame_image(dataset_dir, episode, frame, camera), width)
+
+def contact_sheet(dataset_dir: Path, episode: dict, frames: List[dict], camera: str, width: int, cols: int) -> "np.ndarray":
+    """Сетка превью *frames* по *cols* в ряд с номером кадра в углу."""
+    tiles = []
+    for frame in frames:
+        tile = np.ascontiguousarray(thumbnail(dataset_dir, episode, frame, camera, width))
+        cv2.putText(tile, str(frame["frame_index"]), (4, 14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 0), 1, cv2.LINE_AA)
+        tiles.append(tile)
+    h, w = tiles[0].shape[:2]
+    rows = (len(tiles) + cols - 1) // cols
+    sheet = np.zeros((rows * h, min(cols, len(tiles)) * w, 3), dtype=np.uint8)
+    for i, tile in enumerate(tiles):
+        r, c = divmod(i, cols)
+        sheet[r * h:r * h + tile.shape[0], c * w:c * w + tile.shape[1]] = tile
+    return sheet
@@ -0,0 +1,168 @@
+"""
+Кэш производных вариантов датасета: результат конвертации хранится один раз
+по ключу (хэш содержимого исходных бэгов, параметры конвертации) и вытесняется
+по LRU при превышении дискового бюджета.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# Файл, который конвертер пишет в выходной датасет (см. CHECKPOINT в convert_rosbag_to_lerobot.py)
+CHECKPOINT = "meta/rbs_conversion.json"
+INDEX = "index.json"
+
+def _write_json(path: Path, data) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+_HASH_LOCK = threading.Lock()
+
+def source_hash(src_dir: Path, memo_file: Optional[Path] = None) -> str:
+    """
+    Хэш содержимого каталога с бэгами (относительные пути + sha256 файлов).
+    Хэши файлов запоминаются в *memo_file* по (size, mtime) — повторно читаются только изменённые.
+    """
+    with _HASH_LOCK:
+        memo = {}
+        if memo_file is not None and memo_file.is_file():
+            try:
+                memo = json.loads(memo_file.read_text())
+            except ValueError:
+                memo = {}
+        h = hashlib.sha256()
+        changed = False
+        for path in sorted(p for p in src_dir.rglob("*") if p.is_file()):
+            st = path.stat()
+            key = str(path.resolve())
+            cached = memo.get(key)
+            if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                digest = cached[2]
+            else:
+                digest = _file_digest(path)
+                memo[key] = [st.st_size, st.st_mtime_ns, digest]
+                changed = True
+            h.update(str(path.relative_to(src_dir)).encode("utf-8"))
+            h.update(digest.encode("ascii"))
+        if changed and memo_file is not None:
+            _write_json(memo_file, memo)
+        return h.hexdigest()
+
+def variant_key(source: str, params: dict) -> str:
+    payload = json.dumps({"source": source, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+class VariantStore:
+    """Каталог <root>/<key>/ с готовыми датасетами и индекс <root>/index.json (LRU по last_access)."""
+
+    def __init__(self, root: Path, budget_bytes: int, lock=None):
+        self.root = Path(root)
+        self.budget_bytes = budget_bytes
+        # индекс читают и переписывают все процессы сервера — им нужна общая блокировка
+        self._lock = lock or threading.Lock()
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def _load(self) -> Dict[str, dict]:
+        index = self.root / INDEX
+        if not index.is_file():
+            return {}
+        try:
+            return json.loads(index.read_text())
+        except ValueError:
+            return {}
+
+    def _save(self, entries: Dict[str, dict]) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        _write_json(self.root / INDEX, entries)
+
+    def _complete(self, key: str) -> bool:
+        try:
+            return json.loads((self.path(key) / CHECKPOINT).read_text()).get("complete", False)
+        except (OSError, ValueError):
+            return False
+
+    def get(self, key: str) -> Optional[dict]:
+        """Готовый вариант (с обновлением времени доступа) или None."""
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry is None:
+                return None
+            if not self._complete(key):
+                # каталог удалён или повреждён — забываем вариант
+                del entries[key]
+                self._save(entries)
+                return None
+            entry["last_access"] = time.time()
+            entry["hits"] = entry.get("hits", 0) + 1
+            self._save(entries)
+            return {"key": key, **entry}
+
+    def register(self, key: str, source: str, params: dict, dataset_name: str) -> dict:
+        """Регистрирует только что сконвертированный вариант и вытесняет старые по бюджету."""
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key) or {"source": source, "params": params, "datasets": [], "created": time.time(), "hits": 0}
+            if dataset_name not in entry["datasets"]:
+                entry["datasets"].append(dataset_name)
+            entry["size"] = dir_size(self.path(key))
+            entry["last_access"] = time.time()
+            entries[key] = entry
+            self._evict(entries, protect={key})
+            self._save(entries)
+            return {"key": key, **entry}
+
+    def evict(self, protect: Iterable[str] = ()) -> List[str]:
+        with self._lock:
+            entries = self._load()
+            evicted = self._evict(entries, set(protect))
+            self._save(entries)
+            return evicted
+
+    def _evict(self, entries: Dict[str, dict], protect: set) -> List[str]:
+        evicted = []
+        total = sum(e.get("size", 0) for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k].get("last_access", 0)):
+            if total <= self.budget_bytes:
+                break
+            if key in protect:
+                continue
+            total -= entries[key].get("size", 0)
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            del entries[key]
+            evicted.append(key)
+        if evicted:
+            print(f"[variants] evicted {evicted}, {total} bytes in use")
+        return evicted
+
+    def entries(self) -> List[dict]:
+        with self._lock:
+            return [{"key": k, **e} for k, e in self._load().items()]
+
+    def total_size(self) -> int:
+        return sum(e.get("size", 0) for e in self.entries())
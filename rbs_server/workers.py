@@ -0,0 +1,192 @@
+"""
+Пул долгоживущих процессов конвертации.
+
+Каждый воркер один раз импортирует convert_rosbag_to_lerobot.py (а с ним lerobot,
+torch, cv_bridge, rosbags, cv2) и строит typestore, после чего получает задачи
+через multiprocessing.Pipe. Задача выполняется в процессе воркера, поэтому его
+падение не затрагивает сервер; упавший или отработавший *max_jobs* задач воркер
+заменяется новым.
+
+Воркеры создаются по требованию — когда процесс сервера забрал задачу из общей
+очереди, а не при старте. Между задачами процесс держит не больше *max_idle*
+прогретых воркеров: при uvicorn --workers N общее число одновременных конвертаций
+ограничивают аренды планировщика (rbs_server.scheduler), и пулы всех процессов
+вместе занимают память не больше чем N * max_idle простаивающих воркеров плюс
+работающие задачи (не больше RBS_MAX_CONVERSIONS на все процессы).
+"""
+import os
+import sys
+import signal
+import traceback
+import threading
+import importlib.util
+import multiprocessing
+from pathlib import Path
+from typing import Dict, List
+
+from rbs_server.scheduler import ConversionJob, JobState, attempt_header
+
+def _load_converter(script_path: str):
+    spec = importlib.util.spec_from_file_location("convert_rosbag_to_lerobot", script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _run_job(converter, argv: list, log_file: str) -> int:
+    """Выполняет converter.main(argv), перенаправляя stdout/stderr (в т.ч. дочерних процессов) в лог."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    with open(log_file, "ab") as lf:  # заголовок попытки уже записан пулом
+        os.dup2(lf.fileno(), 1)
+        os.dup2(lf.fileno(), 2)
+        try:
+            converter.main(argv)
+            returncode = 0
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+    return returncode
+
+def worker_main(conn, script_path: str, cwd: str, max_jobs: int) -> None:
+    """Точка входа процесса-воркера."""
+    os.chdir(cwd)
+    os.setsid()  # своя группа процессов, чтобы отмена задачи задевала и ffmpeg
+    try:
+        converter = _load_converter(script_path)
+        converter.preload()
+    except BaseException:
+        conn.send({"ready": False, "error": traceback.format_exc()})
+        return
+    conn.send({"ready": True})
+
+    for _ in range(max_jobs):
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        conn.send({"returncode": _run_job(converter, request["argv"], request["log_file"])})
+
+class _Worker:
+    def __init__(self, ctx, script_path: Path, max_jobs: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=worker_main,
+            args=(child_conn, str(script_path), os.getcwd(), max_jobs),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs_left = max_jobs
+        self.ready = None  # ответ о прогреве читается при первой задаче
+
+    def wait_ready(self) -> dict:
+        if self.ready is None:
+            self.ready = self.conn.recv()
+        return self.ready
+
+    def stop(self) -> None:
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+class WarmWorkerPool:
+    """Исполнитель задач для ConversionScheduler на прогретых процессах."""
+
+    def __init__(self, max_idle: int, script_path: Path, max_jobs: int = 20):
+        self.max_idle = max_idle  # прогретых воркеров, оставляемых между задачами
+        self.script_path = script_path
+        self.max_jobs = max_jobs
+        self._ctx = multiprocessing.get_context("spawn")  # fork в многопоточном сервере небезопасен
+        self._idle: List[_Worker] = []
+        self._busy: Dict[str, _Worker] = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> _Worker:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return _Worker(self._ctx, self.script_path, self.max_jobs)
+
+    def _keep(self, worker: _Worker) -> None:
+        """Возвращает воркер в пул, если в нём есть место, иначе останавливает."""
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(worker)
+                return
+        worker.stop()
+
+    def _replace(self, worker: _Worker) -> None:
+        worker.stop()
+        with self._lock:
+            if len(self._idle) >= self.max_idle:
+                return
+        # свежий процесс прогревается, пока нет задач
+        self._keep(_Worker(self._ctx, self.script_path, self.max_jobs))
+
+    def _release(self, worker: _Worker) -> None:
+        worker.jobs_left -= 1
+        if worker.jobs_left > 0 and worker.process.is_alive():
+            self._keep(worker)
+        else:
+            # отработал свой лимит задач — заменяем свежим процессом
+            self._replace(worker)
+
+    def idle(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    def close(self) -> None:
+        """Останавливает простаивающие воркеры."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+    def run(self, job: ConversionJob) -> int:
+        with open(job.log_file, "ab") as lf:
+            lf.write(attempt_header(job))
+        worker = self._acquire()
+        job.pid = worker.process.pid
+        with self._lock:
+            self._busy[job.dataset_name] = worker
+        try:
+            ready = worker.wait_ready()
+            if not ready["ready"]:
+                with open(job.log_file, "ab") as lf:
+                    lf.write(f"[!] Conversion worker failed to start:\n{ready['error']}".encode("utf-8"))
+                worker.stop()
+                return 1
+            if job.state == JobState.CANCELLED:
+                self._keep(worker)
+                return -1
+            worker.conn.send({"argv": job.argv, "log_file": str(job.log_file)})
+            reply = worker.conn.recv()
+        except (EOFError, OSError):
+            # воркер упал или был остановлен отменой — задача не удалась, процесс не переиспользуем
+            self._replace(worker)
+            return worker.process.exitcode if worker.process.exitcode is not None else 1
+        finally:
+            with self._lock:
+                self._busy.pop(job.dataset_name, None)
+        self._release(worker)
+        return reply["returncode"]
+
+    def cancel(self, job: ConversionJob) -> None:
+        with self._lock:
+            worker = self._busy.get(job.dataset_name)
+        if worker is not None and worker.process.is_alive():
+            try:
+                os.killpg(worker.process.pid, signal.SIGKILL)
+            except OSError:
+                worker.process.kill()
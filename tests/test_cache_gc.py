@@ -0,0 +1,54 @@
+from pathlib import Path
+
+from rbs_server import cache_gc
+from rbs_server.cache_gc import Artifact
+
+NOW = 1_000_000.0
+DAY = 86400
+
+def artifact(name: str, cls: str, size: int, age_days: float, owner=None) -> Artifact:
+    return Artifact(Path("/cache") / name, cls, owner, size, NOW - age_days * DAY)
+
+def names(victims):
+    return [Path(v["path"]).name for v in victims]
+
+ARTIFACTS = [
+    artifact("ds_a", cache_gc.RAW, 100, 1, owner="ds_a"),
+    artifact("ds_b", cache_gc.RAW, 100, 5, owner="ds_b"),
+    artifact("ds_a_frames", cache_gc.INTERMEDIATE, 50, 2, owner="ds_a"),
+    artifact("ds_b_msg.json", cache_gc.INTERMEDIATE, 50, 3, owner="ds_b"),
+    artifact("convert_ds_a_20250101T000000Z.log", cache_gc.LOGS, 10, 0.5, owner="ds_a"),
+    artifact("stray.bin", cache_gc.ORPHAN, 30, 1),
+]
+
+def test_retention_only():
+    victims = cache_gc.plan(ARTIFACTS, {cache_gc.INTERMEDIATE: 2.5, cache_gc.RAW: -1}, None, now=NOW)
+    assert names(victims) == ["ds_b_msg.json"]
+    assert victims[0]["reason"] == "retention"
+
+def test_budget_evicts_by_class_then_lru():
+    # занято 340 байт; до 150 вытесняются логи, промежуточные (старые первыми), сироты, затем бэги
+    victims = cache_gc.plan(ARTIFACTS, {}, 150, now=NOW)
+    assert names(victims) == ["convert_ds_a_20250101T000000Z.log", "ds_b_msg.json", "ds_a_frames", "stray.bin", "ds_b"]
+    assert {v["reason"] for v in victims} == {"budget"}
+
+def test_budget_stops_when_met():
+    victims = cache_gc.plan(ARTIFACTS, {}, 300, now=NOW)
+    assert names(victims) == ["convert_ds_a_20250101T000000Z.log", "ds_b_msg.json"]
+
+def test_retention_victims_count_towards_budget():
+    victims = cache_gc.plan(ARTIFACTS, {cache_gc.ORPHAN: 0}, 300, now=NOW)
+    assert names(victims) == ["stray.bin", "convert_ds_a_20250101T000000Z.log"]
+    assert [v["reason"] for v in victims] == ["retention", "budget"]
+
+def test_protected_and_pinned_are_kept():
+    victims = cache_gc.plan(ARTIFACTS, {}, 0, now=NOW,
+                            protected=[Path("/cache/ds_b_msg"), Path("/cache/convert_ds_a_20250101T000000Z")],
+                            pinned_owners=["ds_a"])
+    assert names(victims) == ["ds_a_frames", "stray.bin", "ds_b"]
+
+def test_classify():
+    datasets = {"ds_a"}
+    assert cache_gc.classify(Path("/nonexistent/convert_ds_a_20250101T000000Z.progress.jsonl"), datasets) == (cache_gc.LOGS, "ds_a")
+    assert cache_gc.classify(Path("/nonexistent/ds_a_msg_synced.jsonl"), datasets) == (cache_gc.INTERMEDIATE, "ds_a")
+    assert cache_gc.classify(Path("/nonexistent/other"), datasets) == (cache_gc.ORPHAN, None)
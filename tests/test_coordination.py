@@ -0,0 +1,77 @@
+import types
+
+import pytest
+
+from rbs_server import coordination
+from rbs_server.coordination import SharedStore
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемые часы модуля coordination: clock.now сдвигается тестом."""
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(coordination, "time", types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+@pytest.fixture
+def store(tmp_path):
+    return SharedStore(tmp_path)
+
+def test_acquire_is_exclusive_while_alive(store, clock):
+    lease = store.acquire("job/a", ttl=10, owner="A")
+    assert lease is not None and lease.token == 1
+    assert store.acquire("job/a", ttl=10, owner="B") is None
+    assert store.holder("job/a")["owner"] == "A"
+
+def test_reacquire_by_owner_keeps_token(store, clock):
+    first = store.acquire("job/a", ttl=10, owner="A")
+    again = store.acquire("job/a", ttl=10, owner="A")
+    assert again.token == first.token
+
+def test_expired_lease_is_taken_over_with_new_token(store, clock):
+    old = store.acquire("job/a", ttl=10, owner="A")
+    clock.now += 11
+    assert store.holder("job/a") is None
+    new = store.acquire("job/a", ttl=10, owner="B")
+    assert new is not None and new.token == old.token + 1
+    assert not store.holds(old)
+    assert store.holds(new)
+
+def test_renew_extends_live_lease(store, clock):
+    lease = store.acquire("job/a", ttl=10, owner="A")
+    clock.now += 8
+    assert store.renew(lease, ttl=10)
+    clock.now += 8
+    assert store.holds(lease)
+    assert store.acquire("job/a", ttl=10, owner="B") is None
+
+def test_renew_fails_after_expiry(store, clock):
+    lease = store.acquire("job/a", ttl=10, owner="A")
+    clock.now += 11
+    # даже если никто не захватил аренду, истёкшая считается потерянной
+    assert not store.renew(lease, ttl=10)
+    assert not store.holds(lease)
+
+def test_renew_fails_after_takeover(store, clock):
+    lease = store.acquire("job/a", ttl=10, owner="A")
+    clock.now += 11
+    store.acquire("job/a", ttl=10, owner="B")
+    assert not store.renew(lease, ttl=10)
+    assert store.holder("job/a")["owner"] == "B"
+
+def test_release_ignores_stale_lease(store, clock):
+    old = store.acquire("job/a", ttl=10, owner="A")
+    clock.now += 11
+    new = store.acquire("job/a", ttl=10, owner="B")
+    store.release(old)
+    assert store.holds(new)
+    store.release(new)
+    assert store.holder("job/a") is None
+
+def test_leases_and_prune(store, clock):
+    store.acquire("upload/ds/1", ttl=10, owner="A")
+    store.acquire("upload/ds/2", ttl=100, owner="A")
+    store.acquire("job/x", ttl=100, owner="A")
+    clock.now += 50
+    assert [l["name"] for l in store.leases("upload/ds/")] == ["upload/ds/2"]
+    assert store.prune_leases(grace=30) == 1
+    assert sorted(store.names(coordination.LEASES)) == ["job/x", "upload/ds/2"]
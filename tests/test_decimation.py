@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+# конвертер импортирует ROS (cv_bridge, rosbags) и lerobot — без них тест пропускается
+conv = pytest.importorskip("convert_rosbag_to_lerobot")
+
+MS = 1_000_000  # нс
+
+def test_nearest_indices():
+    timestamps = np.array([0, 10, 20, 30]) * MS
+    query = np.array([-5, 4, 6, 15, 26, 100]) * MS
+    assert conv.nearest_indices(timestamps, query).tolist() == [0, 0, 1, 1, 3, 3]
+
+def test_nearest_indices_tie_prefers_earlier():
+    timestamps = np.array([0, 10]) * MS
+    assert conv.nearest_indices(timestamps, np.array([5 * MS])).tolist() == [0]
+
+def test_nearest_indices_single_timestamp():
+    assert conv.nearest_indices(np.array([7]), np.array([0, 7, 100])).tolist() == [0, 0, 0]
+
+def test_decimate_to_lower_rate():
+    # 30 Гц -> 10 Гц: каждый третий кадр
+    timestamps = (np.arange(30) * 1e9 / 30).astype(np.int64)
+    assert conv.decimate_indices(timestamps, 10).tolist() == list(range(0, 30, 3))
+
+def test_decimate_jittered_timestamps():
+    rng = np.random.default_rng(0)
+    timestamps = np.sort((np.arange(300) * 1e9 / 30 + rng.uniform(-3, 3, 300) * MS).astype(np.int64))
+    indices = conv.decimate_indices(timestamps, 15)
+    assert len(indices) == len(np.unique(indices))
+    assert np.all(np.diff(indices) >= 1)
+    gaps = np.diff(timestamps[indices]) / 1e9
+    assert np.all(np.abs(gaps - 1 / 15) < 0.01)
+
+def test_decimate_never_upsamples():
+    timestamps = (np.arange(10) * 1e9 / 5).astype(np.int64)
+    assert conv.decimate_indices(timestamps, 30).tolist() == list(range(10))
+
+@pytest.mark.parametrize("timestamps, target_fps", [(np.array([5]), 10), (np.arange(5), 0)])
+def test_decimate_passthrough(timestamps, target_fps):
+    assert conv.decimate_indices(timestamps, target_fps).tolist() == list(range(len(timestamps)))
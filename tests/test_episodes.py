@@ -0,0 +1,66 @@
+import gc
+import json
+import os
+from contextlib import closing
+from types import SimpleNamespace
+
+import pyarrow.parquet as pq
+import pytest
+
+conv = pytest.importorskip("convert_rosbag_to_lerobot")
+
+def open_files(path) -> int:
+    """Сколько дескрипторов процесса открыто на *path*."""
+    fd_dir = "/proc/self/fd"
+    count = 0
+    for fd in os.listdir(fd_dir):
+        try:
+            count += os.readlink(os.path.join(fd_dir, fd)) == str(path)
+        except OSError:
+            pass
+    return count
+
+def write_episodes(tmp_path, episodes):
+    episodes_file = tmp_path / "episodes.jsonl"
+    episodes_file.write_text("".join(json.dumps(e) + "\n" for e in episodes))
+    header = tmp_path / "synced.json"
+    header.write_text(json.dumps({"episodes_file": str(episodes_file)}))
+    return header, episodes_file
+
+def test_iter_episodes_is_lazy(tmp_path):
+    header, episodes_file = write_episodes(tmp_path, [{"eidx": 0}, {"eidx": 1}])
+    # битая строка после первого эпизода: ленивое чтение до неё не доходит
+    with open(episodes_file, "a") as f:
+        f.write("{not json\n")
+    with closing(conv.iter_episodes(header)) as episodes:
+        assert next(episodes) == {"eidx": 0}
+        assert open_files(episodes_file) == 1
+    assert open_files(episodes_file) == 0
+    with pytest.raises(json.JSONDecodeError):
+        list(conv.iter_episodes(header))
+    gc.collect()
+    assert open_files(episodes_file) == 0
+
+def test_sync_episode_uses_given_topics(tmp_path):
+    buffer = conv.JointStateBuffer()
+    for t in (0, 100, 200, 300):
+        buffer.append(t, SimpleNamespace(name=["j1"], position=[t / 100], velocity=[], effort=[]))
+    joint_states = tmp_path / conv.JOINT_STATES
+    pq.write_table(buffer.to_table(), joint_states)
+    frames = [{"timestamp": t, "/cam/rgb": f"rgb_{t}.png"} for t in (10, 110, 210, 290)]
+    frames += [{"timestamp": t, "/cam/depth": f"depth_{t}.png"} for t in (0, 200)]
+    frames += [{"timestamp": 150, "/cam/other": "other.png"}]
+    episode = {"bag": "/bags/a", "eidx": 0, "joint_states": str(joint_states), "frames": frames}
+
+    synced = conv.sync_episode(episode, ["/cam/rgb", "/cam/depth"])
+    assert synced["joint_names"] == ["j1"]
+    assert [f["timestamp"] for f in synced["frames"]] == [10, 110, 210, 290]
+    assert [f["joint_state"]["pos"] for f in synced["frames"]] == [[0.0], [1.0], [2.0], [3.0]]
+    assert [f["/cam/depth"] for f in synced["frames"]] == ["depth_0.png", "depth_200.png", "depth_200.png", "depth_200.png"]
+    # камеры вне переданного списка не попадают в кадры
+    assert all("/cam/other" not in f for f in synced["frames"])
+
+    # основная камера — первая в списке; прореживание по target_fps (метки в нс: шаг сетки 200)
+    synced = conv.sync_episode(episode, ["/cam/depth", "/cam/rgb"], target_fps=1e9 / 200)
+    assert [f["timestamp"] for f in synced["frames"]] == [0, 200]
+    assert [f["/cam/rgb"] for f in synced["frames"]] == ["rgb_10.png", "rgb_210.png"]
@@ -0,0 +1,78 @@
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from rbs_server import frame_index
+
+conv = pytest.importorskip("convert_rosbag_to_lerobot")
+
+FPS = 10.0
+
+class FakeMeta:
+    video_keys = []
+
+    def get_data_file_path(self, episode_index: int) -> Path:
+        return Path(f"data/chunk-000/episode_{episode_index:06d}.parquet")
+
+class FakeDataset:
+    def __init__(self, root: Path):
+        self.root = root
+        self.meta = FakeMeta()
+
+def write_episode(dataset: FakeDataset, episode_index: int, num_frames: int, row_group_size: int, tag: str) -> dict:
+    """parquet-файл эпизода (как у LeRobot — несколько row group'ов) и синхронизированный эпизод."""
+    path = dataset.root / dataset.meta.get_data_file_path(episode_index)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cam = [{"bytes": f"{tag}:{i}".encode(), "path": None} for i in range(num_frames)]
+    pq.write_table(pa.table({"frame_index": list(range(num_frames)), "cam": cam}), path, row_group_size=row_group_size)
+    frames = [{"timestamp": 1_000 * i, "joint_state": {"pos": [float(i), 1.0]}} for i in range(num_frames)]
+    return {"bag": f"/bags/{tag}", "frames": frames}
+
+def lookup(dataset_dir: Path, episode_index: int, frame: int) -> bytes:
+    """Кадр камеры через индекс (row group + строка в нём), как его читает сервер."""
+    episode = frame_index.get_episode(dataset_dir, episode_index)
+    row = frame_index.read_frames(dataset_dir, episode_index, frame, frame + 1)[0]
+    raw, _ = frame_index.read_frame(dataset_dir, episode, row, "cam")
+    return raw
+
+def test_lookup_after_rewritten_episode(tmp_path):
+    dataset = FakeDataset(tmp_path)
+    index = conv.FrameIndex(tmp_path)
+    index.add_episode(dataset, 0, write_episode(dataset, 0, 5, 2, "a"), FPS, False)
+    index.add_episode(dataset, 1, write_episode(dataset, 1, 4, 3, "b"), FPS, False)
+    # до finish() индекс датасета не переписывается после каждого эпизода
+    assert not (tmp_path / conv.FRAME_INDEX).exists()
+    index.finish()
+    assert not (tmp_path / conv.FRAME_INDEX_PARTS).exists()
+    assert lookup(tmp_path, 1, 3) == b"b:3"
+    assert frame_index.read_frames(tmp_path, 1, 3, 4)[0]["index"] == 8
+
+    # дозапись: эпизод 1 переписан (после сбоя) с другим числом кадров и row group'ов, добавлен эпизод 2
+    index = conv.FrameIndex(tmp_path)
+    index.add_episode(dataset, 1, write_episode(dataset, 1, 6, 4, "c"), FPS, False)
+    index.add_episode(dataset, 2, write_episode(dataset, 2, 3, 2, "d"), FPS, False)
+    index.finish()
+
+    episodes = frame_index.read_episodes(tmp_path)
+    assert [(e["episode_index"], e["num_frames"], e["first_index"]) for e in episodes] == [(0, 5, 0), (1, 6, 5), (2, 3, 11)]
+    frames = pq.read_table(tmp_path / conv.FRAME_INDEX)
+    assert frames.num_rows == 5 + 6 + 3
+    rows = frame_index.read_frames(tmp_path, 1)
+    assert [(r["row_group"], r["row_in_group"]) for r in rows] == [(0, 0), (0, 1), (0, 2), (0, 3), (1, 0), (1, 1)]
+    assert [lookup(tmp_path, 1, i) for i in range(6)] == [f"c:{i}".encode() for i in range(6)]
+    assert lookup(tmp_path, 0, 4) == b"a:4"
+    assert lookup(tmp_path, 2, 2) == b"d:2"
+
+def test_parts_of_interrupted_run_are_picked_up(tmp_path):
+    dataset = FakeDataset(tmp_path)
+    index = conv.FrameIndex(tmp_path)
+    index.add_episode(dataset, 0, write_episode(dataset, 0, 3, 2, "a"), FPS, False)
+    # процесс упал до finish(): новый запуск видит эпизод 0 и продолжает нумерацию кадров
+    resumed = conv.FrameIndex(tmp_path)
+    assert [e["episode_index"] for e in resumed.episodes] == [0]
+    resumed.add_episode(dataset, 1, write_episode(dataset, 1, 2, 2, "b"), FPS, False)
+    resumed.finish()
+    assert [r["index"] for r in frame_index.read_frames(tmp_path, 1)] == [3, 4]
+    assert lookup(tmp_path, 0, 2) == b"a:2"
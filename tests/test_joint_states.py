@@ -0,0 +1,61 @@
+import math
+from types import SimpleNamespace
+
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+
+conv = pytest.importorskip("convert_rosbag_to_lerobot")
+
+def msg(position, velocity=(), effort=(), name=("j1", "j2", "j3")):
+    return SimpleNamespace(name=list(name), position=list(position), velocity=list(velocity), effort=list(effort))
+
+def round_trip(buffer, tmp_path) -> dict:
+    path = tmp_path / conv.JOINT_STATES
+    pq.write_table(buffer.to_table(), path)
+    return conv.read_joint_states(path)
+
+def test_buffer_grows(tmp_path):
+    buffer = conv.JointStateBuffer(capacity=2)
+    for i in range(5):
+        buffer.append(100 * i, msg([i, i + 0.5, -i]))
+    assert buffer.size == 5 and len(buffer.timestamps) == 8
+    states = round_trip(buffer, tmp_path)
+    assert states["name"] == ["j1", "j2", "j3"]
+    assert states["timestamp"].tolist() == [0, 100, 200, 300, 400]
+    assert states["pos"].shape == (5, 3)
+    assert states["pos"][4].tolist() == [4, 4.5, -4]
+
+def test_nan_becomes_zero(tmp_path):
+    buffer = conv.JointStateBuffer()
+    buffer.append(1, msg([1.0, math.nan, 3.0], velocity=[math.nan] * 3))
+    states = round_trip(buffer, tmp_path)
+    assert states["pos"].tolist() == [[1.0, 0.0, 3.0]]
+    assert states["vel"].tolist() == [[0.0, 0.0, 0.0]]
+
+def test_partial_velocity_and_effort(tmp_path):
+    buffer = conv.JointStateBuffer()
+    buffer.append(1, msg([1, 2, 3], velocity=[0.1], effort=[]))
+    # лишние значения сверх числа суставов отбрасываются
+    buffer.append(2, msg([1, 2, 3, 4], velocity=[0.1, 0.2, 0.3, 0.4], effort=[5, 6]))
+    states = round_trip(buffer, tmp_path)
+    assert states["pos"].tolist() == [[1, 2, 3], [1, 2, 3]]
+    assert states["vel"].tolist() == [[0.1, 0, 0], [0.1, 0.2, 0.3]]
+    assert states["eff"].tolist() == [[0, 0, 0], [5, 6, 0]]
+
+def test_zero_joints(tmp_path):
+    buffer = conv.JointStateBuffer()
+    for i in range(3):
+        buffer.append(i, msg([], name=[]))
+    table = buffer.to_table()
+    assert table.num_rows == 3
+    states = round_trip(buffer, tmp_path)
+    assert states["name"] == []
+    assert states["timestamp"].tolist() == [0, 1, 2]
+    for key in ("pos", "vel", "eff"):
+        assert states[key].shape == (3, 0)
+
+def test_empty_buffer(tmp_path):
+    states = round_trip(conv.JointStateBuffer(), tmp_path)
+    assert len(states["timestamp"]) == 0
+    assert states["pos"].shape[0] == 0
@@ -0,0 +1,94 @@
+import os
+
+import pyarrow as pa
+
+from rbs_server.query_cache import QueryCache, file_generation, is_cacheable, referenced_files
+
+def touch(path, data: bytes = b"x", mtime_ns: int = None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def bump_dir(path, mtime_ns: int):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def test_is_cacheable():
+    assert is_cacheable("SELECT * FROM datasets")
+    assert is_cacheable("SELECT * FROM 'data/ds/data/*/*.parquet' WHERE name = 'x'")
+    assert not is_cacheable("SELECT random()")
+    assert not is_cacheable("SELECT now()")
+    assert not is_cacheable("SELECT * FROM 'data/ds/export.csv'")
+    assert not is_cacheable("SELECT * FROM read_json('meta/info.json')")
+    assert not is_cacheable("SELECT * FROM 'data/ds/file_without_extension'")
+
+def test_referenced_files():
+    sql = "SELECT * FROM 'data/a.parquet' JOIN 'data/b/*/*.parquet' USING (x) WHERE y = 'z'"
+    assert referenced_files(sql) == ["data/a.parquet", "data/b/*/*.parquet"]
+
+def test_generation_tracks_plain_file(tmp_path):
+    path = tmp_path / "a.parquet"
+    missing = file_generation([str(path)])
+    touch(path, mtime_ns=1_000_000_000)
+    created = file_generation([str(path)])
+    assert created != missing
+    touch(path, b"y", mtime_ns=2_000_000_000)
+    assert file_generation([str(path)]) != created
+
+def test_generation_expands_globs(tmp_path):
+    pattern = str(tmp_path / "ds" / "data" / "*" / "*.parquet")
+    touch(tmp_path / "ds" / "data" / "chunk-000" / "episode_000000.parquet", mtime_ns=1_000_000_000)
+    before = file_generation([pattern])
+    assert file_generation([pattern]) == before
+
+    # новый файл в существующем каталоге
+    touch(tmp_path / "ds" / "data" / "chunk-000" / "episode_000001.parquet", mtime_ns=1_000_000_000)
+    added = file_generation([pattern])
+    assert added != before
+
+    # перезапись существующего файла
+    touch(tmp_path / "ds" / "data" / "chunk-000" / "episode_000001.parquet", b"yy", mtime_ns=2_000_000_000)
+    rewritten = file_generation([pattern])
+    assert rewritten != added
+
+    # удаление файла
+    (tmp_path / "ds" / "data" / "chunk-000" / "episode_000001.parquet").unlink()
+    bump_dir(tmp_path / "ds" / "data" / "chunk-000", 3_000_000_000)
+    assert file_generation([pattern]) not in (added, rewritten)
+
+def test_generation_changes_key(tmp_path):
+    pattern = str(tmp_path / "*.parquet")
+    sql = f"SELECT count(*) FROM '{pattern}'"
+    key = QueryCache.key(sql, file_generation(referenced_files(sql)))
+    assert QueryCache.key(" ".join(sql.split(" ")) + ";", file_generation(referenced_files(sql))) == key
+    touch(tmp_path / "new.parquet")
+    assert QueryCache.key(sql, file_generation(referenced_files(sql))) != key
+
+def table(rows: int) -> pa.Table:
+    return pa.table({"x": pa.array(range(rows), type=pa.int64())})
+
+def test_lru_eviction_and_entry_limit():
+    small = table(10)  # 80 байт
+    cache = QueryCache(max_bytes=small.nbytes * 2, max_entry_bytes=small.nbytes * 2)
+    assert not cache.put("big", table(100))
+    cache.put("a", small)
+    cache.put("b", small)
+    assert cache.get("a") is not None  # a — самый свежий
+    cache.put("c", small)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.evictions == 1
+
+def test_capture_stores_fully_read_result():
+    cache = QueryCache(max_bytes=1 << 20, max_entry_bytes=1 << 20)
+    source = table(1000)
+    reader = cache.capture("k", source.to_reader(max_chunksize=100))
+    assert reader.read_all().equals(source)
+    assert cache.get("k").equals(source)
+
+def test_capture_skips_oversized_result():
+    source = table(1000)
+    cache = QueryCache(max_bytes=1 << 20, max_entry_bytes=source.nbytes // 2)
+    reader = cache.capture("k", source.to_reader(max_chunksize=100))
+    assert reader.read_all().equals(source)
+    assert cache.get("k") is None
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from rbs_server.sandbox import QueryBusy, QueryGuard, QueryRejected, check_read_only
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1",
+    "select * from datasets where name = 'a; b'",
+    "WITH t AS (SELECT 1 AS x) SELECT x FROM t",
+    "SELECT 1;",
+])
+def test_select_allowed(sql):
+    assert check_read_only(sql) is True
+
+def test_explain_allowed_but_not_wrappable():
+    assert check_read_only("EXPLAIN SELECT 1") is False
+
+@pytest.mark.parametrize("sql", [
+    "DROP TABLE datasets",
+    "INSERT INTO datasets VALUES (1)",
+    "COPY datasets TO 'out.csv'",
+    "ATTACH 'other.db'",
+    "SET threads = 64",
+    "INSTALL httpfs",
+    "PRAGMA enable_profiling",
+])
+def test_non_select_rejected(sql):
+    with pytest.raises(QueryRejected):
+        check_read_only(sql)
+
+def test_multiple_statements_rejected():
+    with pytest.raises(QueryRejected, match="one statement"):
+        check_read_only("SELECT 1; DROP TABLE datasets")
+
+def test_syntax_error_rejected():
+    with pytest.raises(QueryRejected):
+        check_read_only("SELEC 1")
+
+class FakeCursor:
+    def __init__(self):
+        self.interrupted = threading.Event()
+
+    def interrupt(self):
+        self.interrupted.set()
+
+def test_guard_limits_concurrency_and_release_is_idempotent():
+    guard = QueryGuard(1, timeout=0, queue_timeout=0.01)
+    release = guard.start(FakeCursor())
+    with pytest.raises(QueryBusy):
+        guard.start(FakeCursor())
+    release()
+    release()
+    guard.start(FakeCursor())()
+    # повторное освобождение не добавило лишний слот
+    guard.start(FakeCursor())
+    with pytest.raises(QueryBusy):
+        guard.start(FakeCursor())
+    assert guard.rejected_busy == 2
+
+def test_guard_interrupts_slow_query():
+    guard = QueryGuard(1, timeout=0.05, queue_timeout=0.01)
+    cursor = FakeCursor()
+    release = guard.start(cursor)
+    assert cursor.interrupted.wait(2)
+    release()
+    assert guard.timed_out == 1
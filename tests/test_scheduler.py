@@ -0,0 +1,128 @@
+import threading
+from pathlib import Path
+
+import pytest
+
+from rbs_server.coordination import SharedStore
+from rbs_server.scheduler import ConversionJob, ConversionScheduler, JobState, SubprocessRunner
+
+class FakeRunner:
+    def __init__(self, returncode: int = 0):
+        self.returncode = returncode
+
+    def run(self, job: ConversionJob) -> int:
+        return self.returncode
+
+    def cancel(self, job: ConversionJob) -> None:
+        pass
+
+@pytest.fixture
+def scheduler(tmp_path):
+    # потоки-исполнители не запускаются: тест сам вызывает _claim/_run
+    return ConversionScheduler(2, FakeRunner(), SharedStore(tmp_path / "shared"), lease_ttl=60)
+
+def make_job(tmp_path: Path, name: str, priority: int = 0, seq: int = 0) -> ConversionJob:
+    job = ConversionJob(name, [], tmp_path / f"{name}.log", priority)
+    job.seq = seq
+    return job
+
+@pytest.fixture
+def claim():
+    """
+    _claim из отдельного потока: у каждого потока-исполнителя свой владелец слота.
+    Потоки живут до конца теста — иначе ident (а с ним и владелец) переиспользуется.
+    """
+    done = threading.Event()
+    threads = []
+
+    def claim_in_thread(scheduler: ConversionScheduler):
+        result = []
+        claimed = threading.Event()
+
+        def worker():
+            result.append(scheduler._claim())
+            claimed.set()
+            done.wait()
+        thread = threading.Thread(target=worker)
+        thread.start()
+        threads.append(thread)
+        claimed.wait()
+        return result[0]
+    yield claim_in_thread
+    done.set()
+    for thread in threads:
+        thread.join()
+
+def test_queue_order_priority_then_fifo(scheduler, tmp_path):
+    scheduler.submit(make_job(tmp_path, "low_first", priority=0, seq=1))
+    scheduler.submit(make_job(tmp_path, "high", priority=5, seq=3))
+    scheduler.submit(make_job(tmp_path, "low_second", priority=0, seq=2))
+    assert [job.dataset_name for job in scheduler._queued()] == ["high", "low_first", "low_second"]
+    assert scheduler.position("high") == 1
+    assert scheduler.position("low_second") == 3
+
+def test_one_active_job_per_dataset(scheduler, tmp_path):
+    scheduler.submit(make_job(tmp_path, "ds"))
+    with pytest.raises(ValueError):
+        scheduler.submit(make_job(tmp_path, "ds"))
+
+def test_slot_limit(scheduler, tmp_path, claim):
+    for i, name in enumerate(["a", "b", "c"]):
+        scheduler.submit(make_job(tmp_path, name, seq=i))
+    first = claim(scheduler)
+    second = claim(scheduler)
+    assert [first[0].dataset_name, second[0].dataset_name] == ["a", "b"]
+    # оба слота заняты — третья задача ждёт
+    assert claim(scheduler) is None
+    assert scheduler.get("c").state == JobState.QUEUED
+
+    scheduler._run(*first)
+    assert scheduler.get("a").state == JobState.FINISHED
+    third = claim(scheduler)
+    assert third[0].dataset_name == "c"
+
+def test_claim_skips_dataset_leased_by_lost_owner(scheduler, tmp_path, claim):
+    scheduler.submit(make_job(tmp_path, "blocked", priority=1, seq=1))
+    scheduler.submit(make_job(tmp_path, "free", seq=2))
+    scheduler.store.acquire("conversion/blocked", 60, owner="gone")
+    job, leases = claim(scheduler)
+    assert job.dataset_name == "free"
+    assert scheduler.get("blocked").state == JobState.QUEUED
+
+def test_failed_run_and_cancel(tmp_path, claim):
+    scheduler = ConversionScheduler(1, FakeRunner(returncode=1), SharedStore(tmp_path / "shared"))
+    scheduler.submit(make_job(tmp_path, "bad", seq=1))
+    scheduler.submit(make_job(tmp_path, "queued", seq=2))
+    scheduler._run(*claim(scheduler))
+    assert scheduler.get("bad").state == JobState.FAILED
+    scheduler.cancel("queued")
+    assert scheduler.get("queued").state == JobState.CANCELLED
+    assert claim(scheduler) is None
+
+def test_running_job_without_lease_is_requeued(scheduler, tmp_path, claim):
+    scheduler.submit(make_job(tmp_path, "ds"))
+    job, leases = claim(scheduler)
+    for lease in leases:
+        scheduler.store.release(lease)  # владелец пропал, аренды нет
+    with scheduler._cond:
+        scheduler._running.clear()
+    recovered, _ = claim(scheduler)
+    assert recovered.dataset_name == "ds"
+    assert recovered.attempts == 2
+    # результат первой попытки не записывается поверх второй
+    scheduler._run(job, leases)
+    assert scheduler.get("ds").state == JobState.RUNNING
+
+def test_subprocess_runner_keeps_log_of_failed_attempt(tmp_path):
+    script = tmp_path / "convert.py"
+    script.write_text("import sys\nprint('converting', sys.argv[1])\nsys.exit(int(sys.argv[2]))\n")
+    runner = SubprocessRunner(script)
+    job = ConversionJob("ds", ["ds", "3"], tmp_path / "ds.log")
+    job.attempts = 1
+    assert runner.run(job) == 3
+    job.argv = ["ds", "0"]
+    job.attempts = 2
+    assert runner.run(job) == 0
+    log = job.log_file.read_text()
+    assert log.count("converting ds") == 2
+    assert log.index("=== Attempt 1") < log.index("=== Attempt 2")
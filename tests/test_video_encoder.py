@@ -0,0 +1,156 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+conv = pytest.importorskip("convert_rosbag_to_lerobot")
+
+# ffmpeg-заглушка: как настоящий, сразу создаёт выходной файл и пишет в него поток из stdin
+FAKE_FFMPEG = """#!{python}
+import os, sys
+with open(sys.argv[-1], "wb") as out:
+    while True:
+        chunk = sys.stdin.buffer.read(65536)
+        if not chunk:
+            break
+        out.write(chunk)
+        out.flush()
+sys.exit(int(os.environ.get("FAKE_FFMPEG_EXIT", "0")))
+"""
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "ffmpeg"
+    script.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+@pytest.fixture
+def encoders(monkeypatch):
+    """Все VideoEncoder, созданные конвертером за тест."""
+    created = []
+
+    class TrackedEncoder(conv.VideoEncoder):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self)
+    monkeypatch.setattr(conv, "VideoEncoder", TrackedEncoder)
+    return created
+
+def frame(value: int = 0, height: int = 4, width: int = 6) -> np.ndarray:
+    return np.full((height, width, 3), value, dtype=np.uint8)
+
+def test_close_writes_video(fake_ffmpeg, tmp_path):
+    encoder = conv.VideoEncoder(tmp_path / "videos" / "cam.mp4", 6, 4, 10)
+    for i in range(3):
+        encoder.write(frame(i))
+    encoder.close()
+    assert encoder.process.returncode == 0
+    assert (tmp_path / "videos" / "cam.mp4").stat().st_size == 3 * 6 * 4 * 3
+
+def test_close_raises_on_ffmpeg_error(fake_ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_FFMPEG_EXIT", "1")
+    encoder = conv.VideoEncoder(tmp_path / "cam.mp4", 6, 4, 10)
+    encoder.write(frame())
+    with pytest.raises(RuntimeError, match="code 1"):
+        encoder.close()
+
+def test_write_rejects_other_size(fake_ffmpeg, tmp_path):
+    encoder = conv.VideoEncoder(tmp_path / "cam.mp4", 6, 4, 10)
+    with pytest.raises(ValueError):
+        encoder.write(frame(height=5))
+    encoder.abort()
+
+def test_abort_kills_and_removes_partial_file(fake_ffmpeg, tmp_path):
+    encoder = conv.VideoEncoder(tmp_path / "cam.mp4", 6, 4, 10)
+    encoder.write(frame())
+    encoder.abort()
+    assert encoder.process.returncode is not None
+    assert not (tmp_path / "cam.mp4").exists()
+
+class FakeMeta:
+    def __init__(self):
+        self.total_episodes = 0
+        self.video_keys = []
+
+    def get_video_file_path(self, episode_index: int, key: str) -> Path:
+        return Path(f"videos/chunk-000/{key}/episode_{episode_index:06d}.mp4")
+
+    def get_data_file_path(self, episode_index: int) -> Path:
+        return Path(f"data/chunk-000/episode_{episode_index:06d}.parquet")
+
+class FakeDataset:
+    """LeRobotDataset, падающий на кадре номер *fail_at* (проверка данных в add_frame)."""
+    fail_at = None
+    instances = []
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.meta = FakeMeta()
+        self.frames = 0
+        self.writer = None
+        self.instances.append(self)
+
+    @classmethod
+    def create(cls, repo_id, fps, root, features, use_videos, **kwargs):
+        (Path(root) / "meta").mkdir(parents=True)
+        return cls(root)
+
+    def start_image_writer(self, num_processes: int = 0, num_threads: int = 4) -> None:
+        self.writer = "started"
+
+    def stop_image_writer(self) -> None:
+        self.writer = "stopped"
+
+    def add_frame(self, frame: dict, task: str) -> None:
+        self.frames += 1
+        if self.frames == self.fail_at:
+            raise ValueError("frame validation failed")
+
+    def save_episode(self) -> None:
+        self.meta.total_episodes += 1
+
+def write_synced(tmp_path: Path, num_frames: int) -> Path:
+    cameras = ["/cam/color", "/cam/depth"]
+    frames = []
+    for i in range(num_frames):
+        item = {"timestamp": i * 100_000_000, "idx": i, "joint_state": {"pos": [0.1 * i, 0.2], "vel": [0, 0], "eff": [0, 0]}}
+        for cam in cameras:
+            path = tmp_path / "frames" / cam.strip("/").replace("/", "_") / f"{i}.png"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            Image.fromarray(frame(i)).save(path)
+            item[cam] = str(path)
+        frames.append(item)
+    episodes = tmp_path / "msg_synced.jsonl"
+    episode = {"bag": str(tmp_path / "bag0"), "eidx": 0, "joint_names": ["j1", "j2"], "num_frames": num_frames, "frames": frames}
+    episodes.write_text(json.dumps(episode) + "\n")
+    header = tmp_path / "msg_synced.json"
+    header.write_text(json.dumps({"cameras": cameras, "image_shape": [4, 6, 3], "estimated_fps": 10.0, "target_fps": None,
+                                  "num_episodes": 1, "episodes_file": str(episodes)}))
+    return header
+
+def test_failed_episode_stops_encoders(fake_ffmpeg, encoders, tmp_path, monkeypatch):
+    monkeypatch.setattr(conv, "LeRobotDataset", type("FailingDataset", (FakeDataset,), {"fail_at": 3}))
+    with pytest.raises(ValueError, match="validation"):
+        conv.to_lerobot_dataset(write_synced(tmp_path, 5), str(tmp_path / "out"), use_videos=True)
+    assert len(encoders) == 2
+    for encoder in encoders:
+        assert encoder.process.returncode is not None
+        assert not encoder.video_path.exists()
+    assert FakeDataset.instances[-1].writer == "stopped"
+
+def test_successful_episode_closes_encoders(fake_ffmpeg, encoders, tmp_path, monkeypatch):
+    monkeypatch.setattr(conv, "LeRobotDataset", FakeDataset)
+    conv.to_lerobot_dataset(write_synced(tmp_path, 5), str(tmp_path / "out"), use_videos=True)
+    assert len(encoders) == 2
+    for encoder in encoders:
+        assert encoder.process.returncode == 0
+        assert encoder.video_path.stat().st_size == 5 * 6 * 4 * 3
+    # PNG-кадры пишутся асинхронно в потоках LeRobot
+    assert FakeDataset.instances[-1].writer == "stopped"
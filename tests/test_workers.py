@@ -0,0 +1,113 @@
+import re
+import time
+import threading
+from pathlib import Path
+
+import pytest
+
+from rbs_server.scheduler import ConversionJob
+from rbs_server.workers import WarmWorkerPool
+
+# Конвертер-заглушка: main(["<код выхода>", ...]) печатает pid процесса и завершается с этим кодом
+# ("sleep" — запускает дочерний процесс, как ffmpeg, и ждёт отмены)
+CONVERTER = """
+import os, sys, time, subprocess
+
+def preload():
+    pass
+
+def main(argv):
+    print("pid", os.getpid(), flush=True)
+    if argv[0] == "sleep":
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+        print("child", child.pid, flush=True)
+        time.sleep(60)
+    sys.exit(int(argv[0]))
+"""
+
+@pytest.fixture
+def converter(tmp_path) -> Path:
+    script = tmp_path / "convert.py"
+    script.write_text(CONVERTER)
+    return script
+
+def make_job(tmp_path: Path, argv: list, attempts: int = 1, name: str = "ds") -> ConversionJob:
+    job = ConversionJob(name, argv, tmp_path / f"{name}.log")
+    job.attempts = attempts
+    return job
+
+def test_log_keeps_failed_attempt(converter, tmp_path):
+    pool = WarmWorkerPool(1, converter)
+    try:
+        assert pool.run(make_job(tmp_path, ["2"], attempts=1)) == 2
+        assert pool.run(make_job(tmp_path, ["0"], attempts=2)) == 0
+    finally:
+        pool.close()
+    log = (tmp_path / "ds.log").read_text()
+    assert log.count("pid ") == 2
+    assert log.index("=== Attempt 1") < log.index("=== Attempt 2")
+
+def logged(job: ConversionJob, key: str) -> list:
+    return [int(v) for v in re.findall(rf"^{key} (\d+)$", job.log_file.read_text(), re.M)]
+
+def alive(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] not in ("Z", "X")
+    except FileNotFoundError:
+        return False
+
+def test_workers_are_spawned_on_demand(converter, tmp_path):
+    pool = WarmWorkerPool(1, converter)
+    assert pool.idle() == 0
+    try:
+        jobs = [make_job(tmp_path, ["0"], name=f"ds{i}") for i in range(2)]
+        threads = [threading.Thread(target=pool.run, args=(job,)) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # две параллельные задачи — два процесса, но между задачами держится не больше max_idle
+        assert len({logged(job, "pid")[0] for job in jobs}) == 2
+        assert pool.idle() == 1
+    finally:
+        pool.close()
+
+def test_worker_recycled_after_max_jobs(converter, tmp_path):
+    pool = WarmWorkerPool(1, converter, max_jobs=2)
+    try:
+        jobs = [make_job(tmp_path, ["0"], name=f"ds{i}") for i in range(3)]
+        for job in jobs:
+            assert pool.run(job) == 0
+        pids = [logged(job, "pid")[0] for job in jobs]
+        assert pids[0] == pids[1]
+        assert pids[2] != pids[1]
+        assert not alive(pids[0])
+        assert pool.idle() == 1
+    finally:
+        pool.close()
+
+def test_cancel_kills_process_group(converter, tmp_path):
+    pool = WarmWorkerPool(1, converter)
+    job = make_job(tmp_path, ["sleep"])
+    result = []
+    thread = threading.Thread(target=lambda: result.append(pool.run(job)))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 30
+        while not (job.log_file.is_file() and logged(job, "child")):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        worker_pid, child_pid = logged(job, "pid")[0], logged(job, "child")[0]
+        pool.cancel(job)
+        thread.join(30)
+        assert not thread.is_alive()
+        assert result[0] != 0
+        assert not alive(worker_pid)
+        # дочерний процесс задачи (как ffmpeg) в той же группе — остановлен вместе с воркером
+        deadline = time.monotonic() + 5
+        while alive(child_pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not alive(child_pid)
+    finally:
+        pool.close()